@@ -0,0 +1,229 @@
+"""
+Benchmarks of the main processing steps, on synthetic utterances (see ustools.synthetic).
+
+Each benchmark is timed over a number of repeats, on fresh inputs each time, and its best time is reported along with a
+digest of its output. The results can be saved as a baseline, and later runs compared against it: a benchmark is
+flagged as a regression when it is slower than the baseline by more than the tolerance, and as changed when its output
+digest differs.
+
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --baseline baseline.json
+
+The exit status is 1 if any benchmark regressed. Baselines are machine specific, so compare runs on the same machine.
+
+Date: Oct 2026
+
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ustools.chunk import Chunk
+from ustools.core import UltraSuiteCore
+from ustools.segment_signal import get_zero_regions
+from ustools.speech_features import get_mfcc_feat, get_logfbank_feat
+from ustools.synthetic import write_synthetic_utterance
+from ustools.transform_ultrasound import transform_ultrasound
+
+
+def get_digest(output):
+    """
+    A digest of the arrays a benchmark returns, to detect changes in behaviour.
+    :param output: an array, or a tuple or list of arrays
+    :return: (hex digest, list of shapes)
+    """
+    if not isinstance(output, (tuple, list)):
+        output = (output,)
+    sha1 = hashlib.sha1()
+    shapes = []
+    for a in output:
+        a = np.ascontiguousarray(a)
+        sha1.update(str(a.shape).encode() + str(a.dtype).encode())
+        sha1.update(a.tobytes())
+        shapes.append(list(a.shape))
+    return sha1.hexdigest(), shapes
+
+
+def get_benchmarks(directory, basename):
+    """
+    The benchmarks, as (name, setup, run) tuples. setup() prepares fresh inputs and is not timed. run(inputs) is timed
+    and returns the arrays to digest.
+    """
+
+    def read_core(**kwargs):
+        return UltraSuiteCore(directory, basename, **kwargs)
+
+    def synchronised_core():
+        core = read_core()
+        core.apply_sync()
+        return core
+
+    def transform(method):
+        def run(core):
+            return transform_ultrasound(core.ult, num_scanlines=core.params['num_scanlines'],
+                                        size_scanline=core.params['size_scanline'], angle=core.params['angle'],
+                                        zero_offset=core.params['zero_offset'], pixels_per_mm=3, method=method,
+                                        spline_interpolation_order=2 if method == "map_coordinates" else 1)
+        return run
+
+    def process(**kwargs):
+        def run(core):
+            core.process(**kwargs)
+            return core.wav, core.ult
+        return run
+
+    def chunkable_core():
+        core = read_core()
+        core.process(skip_ult_frames=True, stride=5, apply_sync=True)
+        return core
+
+    def chunk(core):
+        c = Chunk(core, mfcc_feat=True, fbank_feat=True)
+        return c.ult_chunks, c.wav_chunks, c.mfcc_chunks, c.fbank_chunks
+
+    def features(func):
+        def run(core):
+            return func(wav=core.wav, samplerate=core.params['wav_fps'], winlen=0.02, winstep=0.01)
+        return run
+
+    return [
+        ("read_ult", lambda: None, lambda _: read_core().ult),
+        ("read_ult_mmap", lambda: None, lambda _: np.array(read_core(mmap=True).ult)),
+        ("transform_ultrasound", read_core, transform("map_coordinates")),
+        ("transform_ultrasound_sparse", read_core, transform("sparse")),
+        ("get_zero_regions", read_core, lambda core: np.array(get_zero_regions(core.wav, num_repetitions=100))),
+        ("apply_sync", read_core, process(apply_sync=True)),
+        ("apply_vad", synchronised_core, process(apply_sync=True, apply_vad=True)),
+        ("change_ult_frame_rate", read_core, process(change_frame_rate=True, new_frame_rate=24)),
+        ("resize_ult_frames_by_ratio", read_core, process(resize_ult_frames_by_ratio=True, ratio=(1, 3))),
+        ("resize_ult_frames", read_core, process(resize_ult_frames_by_size=True, new_frame_size=(63, 138))),
+        ("chunk", chunkable_core, chunk),
+        ("mfcc", read_core, features(get_mfcc_feat)),
+        ("logfbank", read_core, features(get_logfbank_feat)),
+    ]
+
+
+def run_benchmarks(duration=10.0, repeat=5, only=None, seed=0):
+    """
+    Run the benchmarks on a synthetic utterance.
+    :param duration: of the synthetic utterance, in seconds
+    :param repeat: the number of times each benchmark is timed
+    :param only: optionally, the names of the benchmarks to run
+    :param seed:
+    :return: a dictionary with the environment, the configuration and the results of each benchmark
+    """
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_synthetic_utterance(directory, "utterance", duration=duration, seed=seed)
+
+        for name, setup, run in get_benchmarks(directory, "utterance"):
+            if only and name not in only:
+                continue
+
+            times = []
+            for _ in range(repeat):
+                inputs = setup()
+                start = time.perf_counter()
+                output = run(inputs)
+                times.append(time.perf_counter() - start)
+
+            digest, shapes = get_digest(output)
+            results[name] = {"seconds": min(times),
+                             "mean_seconds": float(np.mean(times)),
+                             "repeat": repeat,
+                             "digest": digest,
+                             "shapes": shapes}
+            print("%-30s %8.4f s" % (name, min(times)))
+
+    return {"environment": {"python": platform.python_version(),
+                            "numpy": np.__version__,
+                            "machine": platform.machine(),
+                            "processor": platform.processor(),
+                            "cpu_count": os.cpu_count()},
+            "config": {"duration": duration, "seed": seed},
+            "results": results}
+
+
+def compare(results, baseline, tolerance=0.25, min_difference=0.005):
+    """
+    Compare results against a baseline.
+    :param results: as returned by run_benchmarks
+    :param baseline: as returned by run_benchmarks, e.g., loaded from a JSON file
+    :param tolerance: the relative slowdown above which a benchmark is a regression, e.g., 0.25 for 25%
+    :param min_difference: slowdowns smaller than this many seconds are ignored as noise
+    :return: a list of (name, ratio, status) tuples, where status is "ok", "faster", "regression" or "changed"
+    """
+    if baseline.get("config") != results.get("config"):
+        print("Warning: the baseline was run with a different configuration:", baseline.get("config"))
+
+    comparison = []
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        old = baseline["results"][name]
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] > 0 else float("inf")
+        difference = result["seconds"] - old["seconds"]
+
+        if ratio > 1 + tolerance and difference > min_difference:
+            status = "regression"
+        elif result["digest"] != old["digest"]:
+            status = "changed"
+        elif ratio < 1 / (1 + tolerance) and -difference > min_difference:
+            status = "faster"
+        else:
+            status = "ok"
+        comparison.append((name, ratio, status))
+
+    return comparison
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ustools on a synthetic utterance.")
+    parser.add_argument("--duration", type=float, default=10.0, help="duration of the synthetic utterance in seconds")
+    parser.add_argument("--repeat", type=int, default=5, help="number of times each benchmark is timed")
+    parser.add_argument("--only", nargs="+", help="only run these benchmarks")
+    parser.add_argument("--output", help="write the results to a JSON file, e.g., to use as a baseline")
+    parser.add_argument("--baseline", help="compare the results against a baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative slowdown flagged as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(duration=args.duration, repeat=args.repeat, only=args.only)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    print()
+    print("%-30s %8s  %s" % ("benchmark", "ratio", "status"))
+    comparison = compare(results, baseline, tolerance=args.tolerance)
+    for name, ratio, status in comparison:
+        print("%-30s %8.2f  %s" % (name, ratio, status))
+
+    if any(status == "changed" for _, _, status in comparison):
+        print("Warning: some outputs differ from the baseline.")
+
+    return 1 if any(status == "regression" for _, _, status in comparison) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
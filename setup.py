@@ -10,6 +10,9 @@ setup(
     long_description=open('README.md').read(),
     install_requires=['numpy', 'scipy', 'matplotlib', 'pandas', 'skimage', 'python_speech_feature', 'webrtcvad',
                       'samplerate'],
+    entry_points={
+        'console_scripts': ['ustools-process=ustools.corpus_runner:main', 'ustools-render=ustools.render_farm:main'],
+    },
     url='https://github.com/UltraSuite/ultrasuite-tools.git',
     author='Aciel Eshky',
     author_email='aeshky@ed.ac.uk'
@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+
+from ustools.cache import ArrayCache, make_key
+
+
+def test_key_stability():
+    a = np.arange(12, dtype=np.int16).reshape(3, 4)
+    key = make_key("transform_ult/1", [a], order=2, scale=0.5)
+
+    assert make_key("transform_ult/1", [a.copy()], scale=0.5, order=2) == key
+    # views with the same contents, e.g., a memmap or a non-contiguous slice, give the same key
+    assert make_key("transform_ult/1", [np.asfortranarray(a)], order=2, scale=0.5) == key
+
+    assert make_key("transform_ult/2", [a], order=2, scale=0.5) != key
+    assert make_key("transform_ult/1", [a], order=1, scale=0.5) != key
+    assert make_key("transform_ult/1", [a.astype(np.int32)], order=2, scale=0.5) != key
+    assert make_key("transform_ult/1", [a.reshape(4, 3)], order=2, scale=0.5) != key
+    changed = a.copy()
+    changed[2, 3] += 1
+    assert make_key("transform_ult/1", [changed], order=2, scale=0.5) != key
+
+
+def test_save_and_load(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    key = make_key("test", x=1)
+    assert cache.load(key) is None
+
+    arrays = {"ult": np.arange(24, dtype=np.uint8).reshape(2, 3, 4), "empty": np.zeros(0)}
+    saved = cache.save(key, arrays)
+    loaded = cache.load(key)
+
+    for entry in (saved, loaded):
+        assert sorted(entry) == ["empty", "ult"]
+        assert np.array_equal(entry["ult"], arrays["ult"])
+        assert isinstance(entry["ult"], np.memmap)
+        assert not entry["ult"].flags.writeable
+        assert entry["empty"].shape == (0,)
+
+
+def test_get_or_compute(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"a": np.ones(3)}
+
+    for _ in range(2):
+        assert np.array_equal(cache.get_or_compute("ab" * 32, compute)["a"], np.ones(3))
+    assert len(calls) == 1
+
+
+def test_concurrent_writers_keep_the_first_entry(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    key = make_key("test")
+
+    cache.save(key, {"a": np.zeros(3)})
+    # a second writer which computed the same entry loses the rename and gets the first writer's entry
+    entry = cache.save(key, {"a": np.ones(3)})
+
+    assert np.array_equal(entry["a"], np.zeros(3))
+    assert len(cache.get_entries()) == 1
+    # no temporary directories are left behind
+    assert [name for name in os.listdir(str(tmp_path)) if name.startswith(".")] == []
+
+
+def test_lru_eviction(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    keys = [make_key("test", i=i) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.save(key, {"a": np.zeros(1000, dtype=np.uint8)})
+        os.utime(cache._get_entry_dir(key), (i, i))
+
+    # using the oldest entry makes it the most recently used
+    cache.load(keys[0])
+    entry_size = cache.get_size() // 4
+
+    assert cache.evict(2 * entry_size) == 2
+    assert cache.load(keys[1]) is None and cache.load(keys[2]) is None
+    assert cache.load(keys[0]) is not None and cache.load(keys[3]) is not None
+
+    assert cache.clear() == 2
+    assert cache.get_entries() == []
+
+
+def test_max_bytes(tmp_path):
+    probe = ArrayCache(str(tmp_path / "probe"))
+    probe.save(make_key("test"), {"a": np.zeros(1000, dtype=np.uint8)})
+    cache = ArrayCache(str(tmp_path / "capped"), max_bytes=int(2.5 * probe.get_size()))
+
+    for i in range(5):
+        cache.save(make_key("test", i=i), {"a": np.zeros(1000, dtype=np.uint8)})
+        assert cache.get_size() <= cache.max_bytes
+
+    assert len(cache.get_entries()) == 2
+
+
+def test_evicted_entries_stay_readable(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    entry = cache.save(make_key("test"), {"a": np.arange(5)})
+    cache.clear()
+    assert np.array_equal(entry["a"], np.arange(5))
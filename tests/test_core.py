@@ -0,0 +1,29 @@
+import numpy as np
+
+from ustools.cache import ArrayCache
+from ustools.core import UltraSuiteCore
+from ustools.synthetic import write_synthetic_utterance
+
+
+def read_frames(directory, num_frames=10):
+    core = UltraSuiteCore(directory, "utterance")
+    core.ult = core.ult[:num_frames]
+    return core
+
+
+def test_transform_ult_sparse(tmp_path):
+    write_synthetic_utterance(str(tmp_path), "utterance", duration=0.5)
+    cache = ArrayCache(str(tmp_path / "cache"))
+
+    sparse = read_frames(str(tmp_path))
+    sparse.transform_ult(method="sparse", cache=cache)  # order 1 by default
+
+    linear = read_frames(str(tmp_path))
+    linear.transform_ult(method="map_coordinates", order=1)
+    np.testing.assert_allclose(sparse.ult_t, linear.ult_t, atol=1)
+
+    # a different order is a different cache entry
+    nearest = read_frames(str(tmp_path))
+    nearest.transform_ult(method="sparse", order=0, cache=cache)
+    assert len(cache.get_entries()) == 2
+    assert not np.array_equal(nearest.ult_t, sparse.ult_t)
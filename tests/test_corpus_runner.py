@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from ustools.corpus_runner import run_jobs
+
+
+def crashing_job(directory, basename, output_file):
+    if basename == "c":
+        os._exit(1)  # as if the worker was killed, e.g., for running out of memory
+    return basename
+
+
+def failing_job(directory, basename, output_file):
+    if basename == "b":
+        raise ValueError("cannot process " + basename)
+    return basename
+
+
+def make_jobs(basenames):
+    return [{"utterance_id": basename, "directory": "", "basename": basename, "output_file": ""}
+            for basename in basenames]
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_worker_crash_is_reported(ordered):
+    basenames = list("abcdefgh")
+    results = list(run_jobs(make_jobs(basenames), crashing_job, workers=2, max_in_flight=4, ordered=ordered))
+
+    assert sorted(result["utterance_id"] for result in results) == basenames
+    statuses = {result["utterance_id"]: result["status"] for result in results}
+    assert statuses["c"] == "failed"
+    assert "worker" in next(result["error"] for result in results if result["utterance_id"] == "c")
+
+    # the other jobs in flight when the worker died are run again, not failed
+    for result in results:
+        if result["utterance_id"] != "c":
+            assert result["status"] == "done"
+            assert result["result"] == result["basename"]
+
+    if ordered:
+        assert [result["utterance_id"] for result in results] == basenames
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_failing_job_does_not_stop_the_run(ordered):
+    results = list(run_jobs(make_jobs(["a", "b"]), failing_job, workers=2, ordered=ordered))
+    assert {result["utterance_id"]: result["status"] for result in results} == {"a": "done", "b": "failed"}
+    assert "ValueError" in next(result["error"] for result in results if result["status"] == "failed")
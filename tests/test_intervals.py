@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from ustools.intervals import IntervalSet
+
+
+def random_intervals(rng, length, count):
+    # possibly overlapping, adjacent, empty or reaching beyond the end
+    starts = rng.integers(0, length + 5, size=count)
+    stops = starts + rng.integers(0, length // 4 + 2, size=count)
+    return starts, stops
+
+
+def reference_mask(starts, stops, length):
+    mask = np.zeros(length, dtype=bool)
+    for start, stop in zip(starts, stops):
+        mask[max(start, 0):max(min(stop, length), 0)] = True
+    return mask
+
+
+def assert_normalised(interval_set):
+    assert np.all(interval_set.stops > interval_set.starts)
+    assert np.all(interval_set.starts[1:] > interval_set.stops[:-1])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_set_operations_match_masks(seed):
+    rng = np.random.default_rng(seed)
+    length = int(rng.integers(1, 200))
+    a_starts, a_stops = random_intervals(rng, length, int(rng.integers(0, 8)))
+    b_starts, b_stops = random_intervals(rng, length, int(rng.integers(0, 8)))
+    a, b = IntervalSet(a_starts, a_stops), IntervalSet(b_starts, b_stops)
+    a_mask, b_mask = reference_mask(a_starts, a_stops, length), reference_mask(b_starts, b_stops, length)
+
+    results = {"a": (a, a_mask),
+               "union": (a.union(b), a_mask | b_mask),
+               "intersection": (a.intersection(b), a_mask & b_mask),
+               "complement": (a.complement(length), ~a_mask),
+               "difference": (a.difference(b, length), a_mask & ~b_mask),
+               "clip": (a.clip(length // 4, length // 2), a_mask & (np.arange(length) >= length // 4)
+                        & (np.arange(length) < length // 2))}
+
+    for name, (interval_set, mask) in results.items():
+        assert_normalised(interval_set)
+        assert np.array_equal(interval_set.to_mask(length), mask), name
+        assert IntervalSet.from_mask(mask) == interval_set.clip(0, length), name
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_apply_matches_boolean_indexing(seed):
+    rng = np.random.default_rng(seed)
+    array = rng.integers(0, 100, size=(int(rng.integers(1, 100)), 3))
+    keep = IntervalSet(*random_intervals(rng, len(array), int(rng.integers(0, 6))))
+    mask = keep.to_mask(len(array))
+
+    assert np.array_equal(keep.apply(array), array[mask])
+    assert np.array_equal(keep.apply(array.T, axis=1), array.T[:, mask])
+    assert keep.clip(0, len(array)).size() == int(mask.sum())
+
+
+def test_apply_single_range_is_a_view():
+    array = np.arange(10)
+    kept = IntervalSet([2, 4], [5, 7]).apply(array)
+    assert np.array_equal(kept, np.arange(2, 7))
+    assert np.shares_memory(kept, array)
+
+
+def test_from_inclusive_matches_np_delete():
+    signal = np.arange(50)
+    regions = [(3, 7), (5, 9), (20, 20), (45, 60)]
+
+    removed = np.concatenate([np.arange(start, min(end, len(signal) - 1) + 1) for start, end in regions])
+    expected = np.delete(signal, np.unique(removed))
+
+    zeros = IntervalSet.from_inclusive(regions)
+    assert np.array_equal(zeros.complement(len(signal)).apply(signal), expected)
+
+
+def test_convert_rate():
+    # the last sample of each interval is mapped to the nearest sample at the new rate
+    assert IntervalSet([0, 20], [10, 30]).convert_rate(10, 5) == IntervalSet([0, 10], [5, 15])
+    assert IntervalSet([0], [480]).convert_rate(48000, 100) == IntervalSet([0], [2])
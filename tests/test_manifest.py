@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from ustools.manifest import CorpusManifest
+from ustools.synthetic import write_synthetic_corpus, write_synthetic_utterance
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    root = str(tmp_path / "data")
+    utterances = write_synthetic_corpus(root, num_speakers=2, num_utterances=2, duration=0.5)
+    return root, utterances
+
+
+def test_round_trip(tmp_path, corpus):
+    root, utterances = corpus
+    manifest_file = str(tmp_path / "manifest.db")
+
+    with CorpusManifest(manifest_file) as manifest:
+        assert manifest.update(root) == {"added": 4, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0}
+
+    # the manifest persists
+    with CorpusManifest(manifest_file) as manifest:
+        assert len(manifest) == 4
+
+        df = manifest.query(speaker="01M")
+        assert list(df["basename"]) == ["001A", "002A"]
+        assert set(df["dataset"]) == {"uxtd"}
+        assert set(df["prompt"]) == {"synthetic utterance"}
+        assert all(abs(duration - 0.5) < 0.05 for duration in df["duration"])
+
+        assert len(manifest.query(dataset=["uxtd", "uxssd"], min_duration=0.4)) == 4
+        assert len(manifest.query(max_duration=0.4)) == 0
+        assert len(manifest.query(where="speaker = ?", params=("02M",))) == 2
+
+        # the directories are absolute, so that the files can be found from any working directory
+        files = manifest.get_utterance_files()
+        assert files == sorted((os.path.abspath(directory), basename + ".ult") for directory, basename in utterances)
+        assert all(os.path.isfile(os.path.join(directory, filename)) for directory, filename in files)
+
+
+def test_relative_root(tmp_path, corpus, monkeypatch):
+    root, utterances = corpus
+    monkeypatch.chdir(str(tmp_path))
+
+    with CorpusManifest("manifest.db") as manifest:
+        manifest.update("data")
+        monkeypatch.chdir("/")
+        assert all(os.path.isabs(directory) and os.path.isfile(os.path.join(directory, filename))
+                   for directory, filename in manifest.get_utterance_files())
+
+
+def test_incremental_update(tmp_path, corpus):
+    root, utterances = corpus
+
+    with CorpusManifest(str(tmp_path / "manifest.db")) as manifest:
+        manifest.update(root)
+        assert manifest.update(root) == {"added": 0, "updated": 0, "unchanged": 4, "removed": 0, "failed": 0}
+
+        # a changed utterance is re-read, a new one added and a deleted one removed
+        directory, basename = utterances[0]
+        write_synthetic_utterance(directory, basename, duration=1.0, seed=10)
+        write_synthetic_utterance(directory, "003A", duration=0.5, seed=11)
+        directory, basename = utterances[-1]
+        os.remove(os.path.join(directory, basename + ".ult"))
+
+        assert manifest.update(root) == {"added": 1, "updated": 1, "unchanged": 2, "removed": 1, "failed": 0}
+        assert len(manifest) == 4
+        df = manifest.query(speaker="01M")
+        assert list(df["basename"]) == ["001A", "002A", "003A"]
+        assert abs(df["duration"][0] - 1.0) < 0.05
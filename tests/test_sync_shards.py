@@ -0,0 +1,43 @@
+import numpy as np
+
+from ustools.sync_shards import SyncShardWriter, SyncShardDataset
+
+
+def append(writer, utterance_id, value, num_chunks):
+    writer.append(utterance_id,
+                  {"raw_ult": np.full((num_chunks, 2, 3), value, dtype=np.uint8),
+                   "raw_wav": np.full((num_chunks, 4), value, dtype=np.int16)},
+                  ult_ranges=[(i * 2, (i + 1) * 2) for i in range(num_chunks)],
+                  wav_ranges=[(i * 4, (i + 1) * 4) for i in range(num_chunks)])
+
+
+def test_round_trip(tmp_path):
+    with SyncShardWriter(str(tmp_path), chunks_per_shard=2) as writer:
+        append(writer, "a", 1, 3)
+        append(writer, "b", 2, 2)
+
+    dataset = SyncShardDataset(str(tmp_path))
+    assert len(dataset) == 5
+    assert [dataset.get_info(i)["utterance_id"] for i in range(5)] == ["a", "a", "a", "b", "b"]
+    assert [int(dataset[i]["raw_ult"][0, 0]) for i in range(5)] == [1, 1, 1, 2, 2]
+    assert dataset.get_info(2) == {"utterance_id": "a", "chunk_id": "ch_2", "ult_range": (4, 6), "wav_range": (8, 12)}
+    assert list(dataset.get_utterance_chunks("b")) == [3, 4]
+
+
+def test_reopen_after_interrupted_append(tmp_path):
+    with SyncShardWriter(str(tmp_path)) as writer:
+        append(writer, "a", 1, 3)
+
+    # a writer which is interrupted after writing chunks, but before flushing the index
+    crashed = SyncShardWriter(str(tmp_path))
+    append(crashed, "b", 99, 2)
+    crashed._close_files()
+
+    with SyncShardWriter(str(tmp_path)) as writer:
+        append(writer, "c", 3, 2)
+
+    dataset = SyncShardDataset(str(tmp_path))
+    assert [dataset.get_info(i)["utterance_id"] for i in range(len(dataset))] == ["a", "a", "a", "c", "c"]
+    for i, value in enumerate([1, 1, 1, 3, 3]):
+        assert np.all(dataset[i]["raw_ult"] == value)
+        assert np.all(dataset.get_modality(i, "raw_wav") == value)
@@ -6,68 +6,162 @@ Author: Aciel Eshky
 
 """
 
+import itertools
 import os
 import shutil
 import subprocess
+import tempfile
 
-import matplotlib.pyplot as plt
-
+from ustools.frame_renderer import FrameRenderer, write_png
 from ustools.read_core_files import *
 from ustools.ultrasound_utils import reduce_frame_rate
 from ustools.transform_ultrasound import transform_ultrasound
 
 
-def write_images_to_disk(ult_3d, directory, title=None, aspect='auto'):
+def write_images_to_disk(ult_3d, directory, title=None, aspect='auto', dpi=300, figsize=(5, 5)):
     """
-    A function to write the ultrasound frames as images to a directory. The images are generated as plots without axes.
+    A function to write the ultrasound frames as images to a directory. The images are rendered without axes.
     :param ult_3d: input ultrasound object as a 3d numpy array
     :param directory: the directory to write the images to
     :param title: an optional title for the image
+    :param aspect:
+    :param dpi: the image size in pixels is figsize * dpi
+    :param figsize: in inches
     :return:
     """
     print("writing image frames to disk...")
 
-    plt.figure(dpi=300, figsize=(5, 5))
+    for i, image in enumerate(render_frames(ult_3d, title=title, aspect=aspect, dpi=dpi, figsize=figsize)):
+        write_png(directory + "/%07d.png" % i, image, compression=1)
+
+
+def render_frames(ult_3d, title=None, aspect='auto', dpi=100, figsize=(5, 5)):
+    """
+    Render the ultrasound frames as RGB images in memory, oriented as imshow(frame.T, origin='lower') draws them.
+    :param ult_3d: input ultrasound as a 3d numpy array
+    :param title: an optional title, burnt in above the frames
+    :param aspect:
+    :param dpi: the image size in pixels is figsize * dpi, rounded down to even numbers, which most video codecs need
+    :param figsize: in inches
+    :return: a generator of uint8 arrays of shape (height, width, 3)
+    """
+    width, height = int(figsize[0] * dpi) // 2 * 2, int(figsize[1] * dpi) // 2 * 2
+    renderer = FrameRenderer(ult_3d.shape[1:], size=(width, height), aspect=aspect, title=title,
+                             fontsize=12 * dpi / 100)
+    return renderer.iter_frames(ult_3d)
+
 
-    if title is not None:
-        plt.title(title)
+def get_ffmpeg_command(output_video_file, width, height, frame_rate, audio_file=None, audio_offset=0,
+                       video_codec="mpeg4", quality=5, audio_codec=None):
+    """
+    The ffmpeg command which encodes raw RGB frames read from stdin, and optionally muxes in audio.
+    :param output_video_file:
+    :param width: of the frames in pixels
+    :param height: of the frames in pixels
+    :param frame_rate:
+    :param audio_file: optionally, an audio file to mux in
+    :param audio_offset: the time in seconds in the audio file at which the first frame starts, e.g.,
+     'TimeInSecsOfFirstFrame' from the ultrasound parameter file. The audio before it is skipped.
+    :param video_codec:
+    :param quality: the -q:v value of the video codec, lower is better
+    :param audio_codec: defaults to the default of ffmpeg for the output container
+    :return: list of arguments
+    """
+    command = ["ffmpeg", "-y", "-loglevel", "error",
+               "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", "%dx%d" % (width, height), "-r", str(frame_rate),
+               "-i", "-"]
 
-    c = ult_3d[0]
-    im = plt.imshow(c.T, aspect=aspect, origin='lower', cmap='gray')
-    for i in range(1, ult_3d.shape[0]):
-        c = ult_3d[i]
-        im.set_data(c.T)
-        plt.axis("off")
-        plt.savefig(directory + "/%07d.jpg" % i, bbox_inches='tight', transparent=True)
+    if audio_file is not None:
+        command += ["-ss", str(audio_offset), "-i", audio_file, "-map", "0:v", "-map", "1:a", "-shortest"]
+        if audio_codec is not None:
+            command += ["-c:a", audio_codec]
 
+    command += ["-c:v", video_codec, "-q:v", str(quality), "-pix_fmt", "yuv420p", output_video_file]
+    return command
 
-def create_video(ult_3d, frame_rate, output_video_file, title=None, aspect='auto'):
+
+def encode_frames(frames, frame_rate, output_video_file, audio_file=None, audio_offset=0, **encoder_kwargs):
+    """
+    Stream frames into ffmpeg through a pipe. Nothing is written to disk but the output video.
+    :param frames: an iterable of uint8 RGB arrays of shape (height, width, 3), e.g., from render_frames
+    :param frame_rate:
+    :param output_video_file:
+    :param audio_file: see get_ffmpeg_command
+    :param audio_offset: see get_ffmpeg_command
+    :param encoder_kwargs: see get_ffmpeg_command
+    :return: the number of frames encoded
+    """
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        raise ValueError("no frames to encode")
+    height, width = first.shape[:2]
+
+    command = get_ffmpeg_command(output_video_file, width, height, frame_rate, audio_file=audio_file,
+                                 audio_offset=audio_offset, **encoder_kwargs)
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    num_frames = 0
+    try:
+        for frame in itertools.chain([first], frames):
+            if frame.shape[:2] != (height, width):
+                raise ValueError("All frames must have the same size")
+            process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+            num_frames += 1
+    except BrokenPipeError:  # ffmpeg exited early, its error is reported below
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        return_code = process.wait()
+
+    if return_code != 0:
+        raise subprocess.CalledProcessError(return_code, command)
+
+    return num_frames
+
+
+def create_video(ult_3d, frame_rate, output_video_file, title=None, aspect='auto', audio_file=None, audio_offset=0,
+                 streaming=True, dpi=100, **encoder_kwargs):
     """
     A function to animate an ultrasound utterance.
     :param ult_3d: input ultrasound as a 3d numpy array. Can be raw or transformed.
     :param frame_rate: which can be found in the ultrasound parameter file.
     :param output_video_file: the path/name of the output video
     :param title: an optional title for the video
+    :param aspect:
+    :param audio_file: optionally, an audio file to mux into the video
+    :param audio_offset: the time in seconds in the audio file of the first frame, see get_ffmpeg_command
+    :param streaming: if True, the frames are piped to ffmpeg. Otherwise they are written as images to a temporary
+     directory first, at 300 dpi, and the audio is not muxed.
+    :param dpi: the resolution of the streamed frames
+    :param encoder_kwargs: when streaming, passed to get_ffmpeg_command, e.g., video_codec="libx264"
     :return:
     """
+    if streaming:
+        print("encoding video frames with ffmpeg...")
+        encode_frames(render_frames(ult_3d, title=title, aspect=aspect, dpi=dpi), frame_rate, output_video_file,
+                      audio_file=audio_file, audio_offset=audio_offset, **encoder_kwargs)
+        print("video saved.")
+        return
+
     print("creating temporary directory...")
-    directory = '.temp'
-    if os.path.exists(directory):
+    directory = tempfile.mkdtemp(prefix="ustools-frames-")
+
+    try:
+        write_images_to_disk(ult_3d=ult_3d, directory=directory, title=title, aspect=aspect)
+
+        print("creating video from images frames using ffmpeg...")
+        subprocess.call(
+            ["ffmpeg", "-y", "-r", str(frame_rate),
+             "-i", directory + "/%07d.png", "-vcodec", "mpeg4", "-qscale", "5", "-r",
+             str(frame_rate), output_video_file])
+        print("video saved.")
+    finally:
         shutil.rmtree(directory)
-
-    os.makedirs(directory)
-
-    write_images_to_disk(ult_3d=ult_3d, directory=directory, title=title, aspect=aspect)
-
-    print("creating video from images frames using ffmpeg...")
-    subprocess.call(
-        ["ffmpeg", "-y", "-r", str(frame_rate),
-         "-i", directory + "/%07d.jpg", "-vcodec", "mpeg4", "-qscale", "5", "-r",
-         str(frame_rate), output_video_file])
-    print("video saved.")
-
-    shutil.rmtree(directory)
-    print("image frames files deleted from disk.")
+        print("image frames files deleted from disk.")
 
 
 def crop_audio(audio_start_time, input_audio_file, output_audio_file):
@@ -116,21 +210,12 @@ def animate_utterance(prompt_file, wave_file, ult_file, param_file, output_video
     :return:
     """
 
-    # temp file names
-    temp_audio_file = "cropped_audio.wav"
-    temp_video_file = "video_only.avi"
-
     # prompt file is used for a video caption
     video_caption = parse_prompt_file(prompt_file)[0]
 
     # read parameter file
     param_df = parse_parameter_file(param_file=param_file)
 
-    # use offset parameter to crop audio
-    crop_audio(audio_start_time=param_df['TimeInSecsOfFirstFrame'].value,
-               input_audio_file=wave_file,
-               output_audio_file=temp_audio_file)
-
     # read ultrasound, reshape it, reduce the frame rate for efficiency, and transform it
     ult = read_ultrasound_file(ult_file=ult_file)
 
@@ -144,15 +229,9 @@ def animate_utterance(prompt_file, wave_file, ult_file, param_file, output_video
                              size_scanline=int(param_df['PixPerVector'].value), angle=float(param_df['Angle'].value),
                              zero_offset=int(param_df['ZeroOffset'].value), pixels_per_mm=3)
 
-    # create video without audio
-    create_video(y, fps, temp_video_file, title=video_caption, aspect=aspect)
-
-    # append audio and video
-    append_audio_and_video(temp_audio_file, temp_video_file, output_video_filename)
-
-    # remove temporary files
-    os.remove(temp_audio_file)
-    os.remove(temp_video_file)
+    # create the video, using the offset parameter to skip the audio before the first frame
+    create_video(y, fps, output_video_filename, title=video_caption, aspect=aspect, audio_file=wave_file,
+                 audio_offset=param_df['TimeInSecsOfFirstFrame'].value)
 
     print("Creation of video", output_video_filename, "complete.")
 
@@ -165,26 +244,18 @@ def animate_core_utterance(core, output_video_filename="out.avi", aspect='equal'
     :param aspect:
     :return:
     """
-    # temp file names
-    temp_audio_file = "cropped_audio.wav"
-    temp_video_file = "video_only.avi"
-
     # prompt file is used for a video caption
     video_caption = core.prompt
 
-    # use offset parameter to crop audio
-    wavfile.write(data=core.wav, rate=core.params['wav_fps'], filename=temp_audio_file)
+    ult = core.ult_t if core.params['ult_transformed'] else core.ult
 
-    # create video without audio
-    if core.params['ult_transformed']:
-        create_video(core.ult_t, core.params['ult_fps'], temp_video_file, title=video_caption, aspect=aspect)
-    else:
-        create_video(core.ult, core.params['ult_fps'], temp_video_file, title=video_caption, aspect=aspect)
-    # append audio and video
-    append_audio_and_video(temp_audio_file, temp_video_file, output_video_filename)
+    # the audio may have been processed, so it is written to a temporary file of its own, which ffmpeg reads while
+    # the frames are streamed
+    with tempfile.TemporaryDirectory(prefix="ustools-audio-") as directory:
+        audio_file = os.path.join(directory, "audio.wav")
+        wavfile.write(data=core.wav, rate=core.params['wav_fps'], filename=audio_file)
 
-    # remove temporary files
-    os.remove(temp_audio_file)
-    os.remove(temp_video_file)
+        create_video(ult, core.params['ult_fps'], output_video_filename, title=video_caption, aspect=aspect,
+                     audio_file=audio_file)
 
     print("Creation of video", output_video_filename, "complete.")
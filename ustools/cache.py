@@ -0,0 +1,200 @@
+"""
+A content-addressed on-disk cache for derived arrays, e.g., transformed ultrasound, voice activity and speech features.
+
+An entry is keyed on a digest of the contents of the input arrays (and so of the source files they were read from and
+every processing step applied since) together with all the parameters that affect the result. Entries are stored as
+.npy files, which are loaded as read-only memory maps.
+
+Writers build each entry in a temporary directory and move it into place with a single rename, so readers never see a
+partial entry and concurrent writers of the same entry are harmless: the first rename wins. Reading an entry updates its
+modification time, and when the cache grows beyond its size cap the least recently used entries are evicted.
+
+The layout of a cache directory is:
+
+    ab/abcdef.../ult_t.npy              one directory per entry, fanned out by the first two characters of the key
+
+Date: Oct 2026
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# the default cache directory. If it is not set, nothing is cached unless a cache is given explicitly.
+CACHE_DIR = os.environ.get("USTOOLS_CACHE_DIR")
+
+# the default size cap in bytes, or None for no cap
+CACHE_MAX_BYTES = int(float(os.environ["USTOOLS_CACHE_MAX_BYTES"])) if os.environ.get("USTOOLS_CACHE_MAX_BYTES") \
+    else None
+
+
+def get_array_digest(a):
+    """
+    A digest of the type, shape and contents of an array.
+    :param a: numpy array, e.g., a memmap
+    :return: hex string
+    """
+    a = np.ascontiguousarray(a)
+    digest = hashlib.sha256((a.dtype.str + str(a.shape)).encode())
+    digest.update(memoryview(a).cast('B'))
+    return digest.hexdigest()
+
+
+def make_key(namespace, arrays=(), **params):
+    """
+    Make a cache key.
+    :param namespace: the name of the computation, e.g., "transform_ult". Include a version number to invalidate old
+     entries when the computation changes.
+    :param arrays: the input arrays, which are digested
+    :param params: every parameter which affects the result. Values must be JSON serialisable or numpy types.
+    :return: hex string
+    """
+    description = json.dumps({"namespace": namespace,
+                              "arrays": [get_array_digest(a) for a in arrays],
+                              "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def load_array(filename):
+    """
+    Load a .npy file as a read-only memory map, or into memory if it is empty, since empty files cannot be mapped.
+    """
+    try:
+        return np.load(filename, mmap_mode='r')
+    except ValueError:
+        return np.load(filename)
+
+
+class ArrayCache:
+
+    def __init__(self, directory, max_bytes=None):
+        """
+        Open (or create) a cache.
+        :param directory:
+        :param max_bytes: the size cap. When the cache grows beyond it, the least recently used entries are evicted.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _get_entry_dir(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def load(self, key):
+        """
+        Load an entry.
+        :param key:
+        :return: a dictionary of read-only memory-mapped arrays, or None if the entry is not in the cache
+        """
+        entry_dir = self._get_entry_dir(key)
+        try:
+            names = [name for name in os.listdir(entry_dir) if name.endswith(".npy")]
+            arrays = {name[:-len(".npy")]: load_array(os.path.join(entry_dir, name)) for name in names}
+            os.utime(entry_dir)  # mark as recently used
+        except (FileNotFoundError, NotADirectoryError):  # not cached, or evicted while loading
+            return None
+        return arrays
+
+    def save(self, key, arrays):
+        """
+        Save an entry, atomically. If another writer saved the same entry first, theirs is kept.
+        :param key:
+        :param arrays: a dictionary mapping names to arrays
+        :return: the entry, loaded as with load
+        """
+        entry_dir = self._get_entry_dir(key)
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+
+        temp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            for name, a in arrays.items():
+                np.save(os.path.join(temp_dir, name + ".npy"), np.asarray(a))
+            try:
+                os.rename(temp_dir, entry_dir)
+            except OSError:
+                if not os.path.isdir(entry_dir):
+                    raise
+        finally:
+            if os.path.isdir(temp_dir):
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+        return self.load(key) or {name: np.asarray(a) for name, a in arrays.items()}
+
+    def get_or_compute(self, key, func):
+        """
+        Load an entry, or compute and save it if it is not in the cache.
+        :param key: see make_key
+        :param func: called without arguments to compute the entry, returning a dictionary of arrays
+        :return: the entry, as read-only memory-mapped arrays
+        """
+        arrays = self.load(key)
+        if arrays is None:
+            arrays = self.save(key, func())
+        return arrays
+
+    def get_entries(self):
+        """
+        List the entries.
+        :return: a list of (last used time, size in bytes, entry directory) tuples
+        """
+        entries = []
+        for fan_out in os.scandir(self.directory):
+            if not fan_out.is_dir() or fan_out.name.startswith("."):
+                continue
+            for entry in os.scandir(fan_out.path):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except FileNotFoundError:  # evicted by another process
+                    continue
+        return entries
+
+    def get_size(self):
+        return sum(size for _, size, _ in self.get_entries())
+
+    def evict(self, max_bytes):
+        """
+        Evict the least recently used entries until the cache is no larger than max_bytes. Readers which have already
+        loaded an evicted entry keep their memory maps, which stay valid until they are closed.
+        :param max_bytes:
+        :return: the number of entries evicted
+        """
+        entries = sorted(self.get_entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            # move the entry out of the way first, so that it disappears for readers in a single step
+            doomed = os.path.join(self.directory, ".evicted-" + os.path.basename(path) + "-" + str(os.getpid()))
+            try:
+                os.rename(path, doomed)
+            except OSError:  # already evicted by another process
+                continue
+            shutil.rmtree(doomed, ignore_errors=True)
+            total -= size
+            evicted += 1
+
+        return evicted
+
+    def clear(self):
+        return self.evict(0)
+
+
+def get_default_cache():
+    """
+    The cache in USTOOLS_CACHE_DIR, capped at USTOOLS_CACHE_MAX_BYTES, if the environment variable is set.
+    :return: an ArrayCache, or None
+    """
+    if CACHE_DIR:
+        return ArrayCache(CACHE_DIR, max_bytes=CACHE_MAX_BYTES)
+    return None
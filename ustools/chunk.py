@@ -6,13 +6,21 @@ Author: Aciel Eshky
 """
 
 import numpy as np
-from ustools.speech_features import get_mfcc_feat, get_logfbank_feat
+from ustools.cache import get_default_cache, make_key
+from ustools.instrumentation import Instrumentation, track_stage
+from ustools.memory import MemoryTracker, get_memory_usage
+from ustools.segment_signal import get_windows, get_num_windows
+from ustools.speech_features import get_speech_features, get_frame_size, get_num_feature_frames, \
+    get_preemphasised_segment
+from ustools.transform_ultrasound import transform_ultrasound
 
 IDEAL_ULT_FPS = 121.5 / 5
 
 
 class Chunk:
-    def __init__(self, core, ult_chunk_size=5, mfcc_feat=False, drop_first_mfcc=False, fbank_feat=False, transform_ult=False):
+    def __init__(self, core, ult_chunk_size=5, mfcc_feat=False, drop_first_mfcc=False, fbank_feat=False, transform_ult=False,
+                 transform_dtype=np.float64, track_memory=False, instrumentation=None, feature_dtype=np.float64,
+                 cache=None):
 
         if (core.ult.size != 0 and core.wav.size != 0 and core.params != {} and core.params['ult_fps'] != ""
                 and core.params['wav_fps'] != "" and core.params['ult_transformed'] != ""):
@@ -24,6 +32,12 @@ class Chunk:
             self.speech_feature_time_window = self.time_window / (self.ult_chunk_size * 2)
             self.speech_feature_time_step = self.time_window / (self.ult_chunk_size * 4)
             self.drop_first_mfcc = drop_first_mfcc
+            self.transform_dtype = transform_dtype
+            self.feature_dtype = feature_dtype  # the spectrum is computed in float32 either way
+            self.mfcc_feat = mfcc_feat
+            self.fbank_feat = fbank_feat
+            self.speech_features = {}  # the mfcc and fbank features of the whole wav, see get_speech_features
+            self.cache = cache or get_default_cache()  # a cache.ArrayCache for the speech features, or None
 
             self.ult_chunks = np.zeros(0)
             self.wav_chunks = np.zeros(0)
@@ -32,46 +46,162 @@ class Chunk:
             self.ult_t_chunks = np.zeros(0)
             self.chunk_ids = np.zeros(0)
 
-            self.get_wav_chunks()
-            self.get_ult_chunks()
+            # records the peak memory of each stage, see memory.MemoryTracker
+            self.memory_tracker = MemoryTracker(enabled=track_memory)
+            # records the time and data sizes of each stage, see instrumentation.Instrumentation
+            self.instrumentation = instrumentation or Instrumentation(enabled=False)
+
+            with self._stage("wav_chunks"):
+                self.get_wav_chunks()
+            with self._stage("ult_chunks"):
+                self.get_ult_chunks()
             self.generate_chunk_ids()
 
             if mfcc_feat:
-                self.get_mfcc_chunks()
+                with self._stage("mfcc_chunks"):
+                    self.get_mfcc_chunks()
 
             if fbank_feat:
-                self.get_fbank_chunks()
+                with self._stage("fbank_chunks"):
+                    self.get_fbank_chunks()
 
             if transform_ult:
-                self.get_transformed_ult_chunks()
+                with self._stage("ult_t_chunks"):
+                    self.get_transformed_ult_chunks()
 
             self.force_shortest_size()
 
+    def _stage(self, name):
+        return track_stage(name, self.memory_tracker, self.instrumentation, self.memory_usage)
+
+    def memory_usage(self):
+        """
+        The memory held by the chunks and by the signals of the core they were taken from. Chunks which are views of
+        the core's signals are reported as shared with them.
+        :return: see memory.get_memory_usage
+        """
+        return get_memory_usage({"core.wav": self.core.wav,
+                                 "core.ult": self.core.ult,
+                                 "core.ult_t": self.core.ult_t,
+                                 "wav_chunks": self.wav_chunks,
+                                 "ult_chunks": self.ult_chunks,
+                                 "ult_t_chunks": self.ult_t_chunks,
+                                 "mfcc_chunks": self.mfcc_chunks,
+                                 "fbank_chunks": self.fbank_chunks})
+
     @staticmethod
-    def chunk_array(a, step_size, window_length=None):
+    def get_wav_step_and_window(params, ult_chunk_size):
+        """
+        The wav step size and window length in samples. See get_wav_chunks.
+        :param params: the core parameters
+        :param ult_chunk_size:
+        :return: step size, window length
         """
+        # The step size is utterance-specific
+        step_size = ult_chunk_size * int(round(params["wav_fps"] / params["ult_fps"]))
 
-        :param a:
+        # The window length should be the same for all utterances
+        window_length = ult_chunk_size * int(round(params["wav_fps"] / IDEAL_ULT_FPS))
+
+        return step_size, window_length
+
+    @staticmethod
+    def get_num_chunks(length, step_size, window_length=None):
+        """
+        The number of chunks chunk_array returns for an array of a given length.
+        :param length:
         :param step_size:
         :param window_length:
         :return:
         """
-        if not window_length:
-            window_length = step_size
+        return get_num_windows(length, window_length or step_size, step=step_size)
 
-        chunks = []  # list of chunks
-        for i in range(0, len(a), step_size):
-            item = a[i:i + window_length]
-            if len(item) < window_length:
-                break
-            else:
-                chunks.append(item)
+    @staticmethod
+    def iter_chunks(core, ult_chunk_size=5, mfcc_feat=False, drop_first_mfcc=False, fbank_feat=False,
+                    transform_ult=False, transform_dtype=np.float64, feature_dtype=np.float64):
+        """
+        A generator version of Chunk, which computes each modality for one chunk at a time, so that memory is bounded by
+        the size of a chunk rather than the whole utterance. The chunks are identical to the ones Chunk produces, except
+        that the number of chunks is the minimum over all requested modalities.
+
+        :param core: an UltraSuiteCore object
+        :param ult_chunk_size:
+        :param mfcc_feat:
+        :param drop_first_mfcc:
+        :param fbank_feat:
+        :param transform_ult: transform each ult chunk. If the core has already been transformed, core.ult_t is used.
+        :param transform_dtype: the type of the transformed ult chunks
+        :param feature_dtype: the type of the mfcc and fbank chunks
+        :return: (chunk_id, ult, ult_t, wav, mfcc, fbank) tuples, with None for the modalities not requested
+        """
+        if core.ult.size == 0 or core.wav.size == 0 or core.params == {}:
+            return
+
+        params = core.params
+        time_window = ult_chunk_size / params['ult_fps']
+        winlen = time_window / (ult_chunk_size * 2)
+        winstep = time_window / (ult_chunk_size * 4)
+        feat_chunk_size = ult_chunk_size * 4
+
+        wav_step, wav_window = Chunk.get_wav_step_and_window(params, ult_chunk_size)
+        frame_len, frame_step = get_frame_size(params['wav_fps'], winlen, winstep)
+
+        counts = [Chunk.get_num_chunks(len(core.ult), ult_chunk_size),
+                  Chunk.get_num_chunks(len(core.wav), wav_step, wav_window)]
+        if mfcc_feat or fbank_feat:
+            num_frames = get_num_feature_frames(len(core.wav), params['wav_fps'], winlen, winstep)
+            counts.append(Chunk.get_num_chunks(num_frames, feat_chunk_size))
+        if transform_ult and params['ult_transformed']:
+            counts.append(Chunk.get_num_chunks(len(core.ult_t), ult_chunk_size))
+
+        num_chunks = min(counts)
+        if num_chunks == 0:
+            print("Warning: empty chunks.")
 
-        # now all of them should be the same length unless there was an error
-        if not all(len(item) == window_length for item in chunks):
-            raise ValueError("Unequal array lengths")
+        for i in range(num_chunks):
+            ult_start = i * ult_chunk_size
+            ult = core.ult[ult_start:ult_start + ult_chunk_size]
+            wav = np.expand_dims(core.wav[i * wav_step:i * wav_step + wav_window], axis=0)
 
-        return np.array(chunks)
+            ult_t = None
+            if transform_ult:
+                if params['ult_transformed']:
+                    ult_t = core.ult_t[ult_start:ult_start + ult_chunk_size]
+                else:
+                    ult_t = transform_ultrasound(ult, num_scanlines=params['num_scanlines'],
+                                                 size_scanline=params['size_scanline'], angle=params['angle'],
+                                                 zero_offset=params['zero_offset'], pixels_per_mm=3,
+                                                 dtype=transform_dtype)
+
+            mfcc = None
+            fbank = None
+            if mfcc_feat or fbank_feat:
+                # the samples covering this chunk's feature frames, pre-emphasised as part of the whole wav
+                start = i * feat_chunk_size * frame_step
+                end = start + (feat_chunk_size - 1) * frame_step + frame_len
+                segment = get_preemphasised_segment(core.wav, start, end)
+
+                features = get_speech_features(wav=segment, samplerate=params['wav_fps'], winlen=winlen,
+                                               winstep=winstep, mfcc=mfcc_feat, fbank=fbank_feat,
+                                               drop_first_mfcc=drop_first_mfcc, preemph=0)
+                if mfcc_feat:
+                    mfcc = np.expand_dims(features["mfcc"][:feat_chunk_size].astype(feature_dtype), axis=0)
+                if fbank_feat:
+                    fbank = np.expand_dims(features["logfbank"][:feat_chunk_size].astype(feature_dtype), axis=0)
+
+            yield "ch_" + str(i), ult, ult_t, wav, mfcc, fbank
+
+    @staticmethod
+    def chunk_array(a, step_size, window_length=None):
+        """
+        Split an array into chunks along its first axis. Only complete chunks are kept.
+        :param a:
+        :param step_size:
+        :param window_length: defaults to step_size
+        :return: the chunks as a read-only strided view of a, of shape (number of chunks, window_length) + a.shape[1:].
+         Nothing is copied until the chunks are saved or otherwise copied.
+        """
+        return get_windows(a, window_length or step_size, step=step_size)
 
     def get_wav_chunks(self):
         """
@@ -82,11 +212,7 @@ class Chunk:
 
         :return:
         """
-        # The step size is utterance-specific
-        step_size = self.ult_chunk_size * int(round(self.core.params["wav_fps"] / self.core.params["ult_fps"]))
-
-        # The window length should be the same for all utterances
-        window_length = self.ult_chunk_size * int(round(self.core.params["wav_fps"] / IDEAL_ULT_FPS))
+        step_size, window_length = self.get_wav_step_and_window(self.core.params, self.ult_chunk_size)
 
         self.wav_chunks = self.chunk_array(self.core.wav, step_size=step_size, window_length=window_length)
         self.wav_chunks = np.expand_dims(self.wav_chunks, axis=1)
@@ -106,14 +232,46 @@ class Chunk:
         length = max([len(self.wav_chunks), len(self.ult_chunks)])
         self.chunk_ids = np.array(["ch_" + str(i) for i in range(0, length)])
 
+    def get_speech_features(self, mfcc=True, fbank=True):
+        """
+        The mfcc and log filterbank features of the whole wav. Features which are requested together share a single
+        power spectrum. Each is computed the first time it is needed, or loaded from the cache.
+        :param mfcc: whether the mfcc features are needed
+        :param fbank: whether the log filterbank features are needed
+        :return: see speech_features.get_speech_features
+        """
+        mfcc = mfcc and "mfcc" not in self.speech_features
+        fbank = fbank and "logfbank" not in self.speech_features
+
+        if mfcc or fbank:
+            feature_params = {"samplerate": self.core.params['wav_fps'],
+                              "winlen": self.speech_feature_time_window,
+                              "winstep": self.speech_feature_time_step,
+                              "mfcc": mfcc,
+                              "fbank": fbank,
+                              "drop_first_mfcc": self.drop_first_mfcc}
+
+            def compute():
+                return get_speech_features(wav=self.core.wav, **feature_params)
+
+            if self.cache is None:
+                features = compute()
+            else:
+                key = make_key("speech_features/1", [self.core.wav], **feature_params)
+                features = self.cache.get_or_compute(key, compute)
+
+            self.speech_features = dict(self.speech_features, **features)
+
+        return self.speech_features
+
     def get_mfcc_chunks(self):
         """
 
         :return:
         """
-        mfcc_feat = get_mfcc_feat(wav=self.core.wav, samplerate=self.core.params['wav_fps'],
-                                  winlen=self.speech_feature_time_window, winstep=self.speech_feature_time_step,
-                                  drop_first_mfcc=self.drop_first_mfcc)
+        # the filterbank features are computed at the same time if they are also requested
+        features = self.get_speech_features(mfcc=True, fbank=self.fbank_feat)
+        mfcc_feat = features["mfcc"].astype(self.feature_dtype, copy=False)
         self.mfcc_chunks = self.chunk_array(mfcc_feat, step_size=self.ult_chunk_size * 4)
         self.mfcc_chunks = np.expand_dims(self.mfcc_chunks, axis=1)
 
@@ -122,8 +280,8 @@ class Chunk:
 
         :return:
         """
-        fbank_feat = get_logfbank_feat(wav=self.core.wav, samplerate=self.core.params['wav_fps'],
-                                       winlen=self.speech_feature_time_window, winstep=self.speech_feature_time_step)
+        features = self.get_speech_features(mfcc=self.mfcc_feat, fbank=True)
+        fbank_feat = features["logfbank"].astype(self.feature_dtype, copy=False)
         self.fbank_chunks = self.chunk_array(fbank_feat, step_size=self.ult_chunk_size * 4)
         self.fbank_chunks = np.expand_dims(self.fbank_chunks, axis=1)
 
@@ -133,7 +291,7 @@ class Chunk:
         :return:
         """
         if not self.core.params['ult_transformed']:
-            self.core.transform_ult()
+            self.core.transform_ult(dtype=self.transform_dtype)
 
         self.ult_t_chunks = self.chunk_array(self.core.ult_t, step_size=self.ult_chunk_size)
 
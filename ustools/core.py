@@ -7,26 +7,33 @@ Author: Aciel Eshky
 
 import os
 import io
+import math
 from datetime import datetime
 
 import numpy as np
-import samplerate
 from scipy.io import wavfile
-from skimage.measure import block_reduce
-from skimage.transform import resize
 
-from ustools.segment_signal import get_segment, get_zero_regions
-from ustools.transform_ultrasound import transform_ultrasound
-from ustools.voice_activity_detection import detect_voice_activity, separate_silence_and_speech
+from ustools.cache import get_default_cache, make_key
+from ustools.instrumentation import Instrumentation, track_stage
+from ustools.intervals import IntervalSet
+from ustools.memory import MemoryTracker, get_memory_usage, is_memory_mapped, format_bytes
+from ustools.read_core_files import read_wav_header
+from ustools.segment_signal import get_zero_regions
+from ustools.transform_ultrasound import transform_ultrasound, get_output_shape
+from ustools.ultrasound_utils import resample_frame_rate, block_reduce_frames, resize_frames
+from ustools.voice_activity_detection import get_voice_activity, VoiceActivity
 
 
 class UltraSuiteCore:
 
-    def __init__(self, directory=None, file_basename=None):
+    def __init__(self, directory=None, file_basename=None, mmap=False, lazy=False):
         """
         Initialise new object
         :param directory: the directory containing the files
         :param file_basename: base file name without extension
+        :param mmap: memory-map the wav and ult files instead of reading them into memory
+        :param lazy: only read the prompt and parameter files (and the wav header). The wav and ult are read on first
+         access to the wav and ult attributes.
         """
 
         self.basename = ""
@@ -34,24 +41,92 @@ class UltraSuiteCore:
         self.prompt = ""
         self.datetime = datetime(1900, 1, 1)
 
+        self.mmap = mmap
+        self._wav_file = None  # set while the wav is waiting to be lazily read
+        self._ult_file = None  # set while the ult is waiting to be lazily read
+
         self.wav = np.zeros(0)
         self.ult = np.zeros(0)
         self.ult_t = np.zeros(0)
         self.params = {}
+        self.memory_tracker = MemoryTracker(enabled=False)
 
         if directory and file_basename:
             self.basename = file_basename
+            wav_file = os.path.join(directory, file_basename + ".wav")
+            ult_file = os.path.join(directory, file_basename + ".ult")
+
             self.read_prompt(os.path.join(directory, file_basename + ".txt"))
-            self.read_wav(os.path.join(directory, file_basename + ".wav"))
             self.read_param(os.path.join(directory, file_basename + ".param"))
-            self.read_ult(os.path.join(directory, file_basename + ".ult"))
+
+            if lazy:
+                self.params['wav_fps'] = read_wav_header(wav_file)['sample_rate']
+                self._wav_file = wav_file
+                self._ult_file = ult_file
+            else:
+                self.read_wav(wav_file, mmap=mmap)
+                self.read_ult(ult_file, mmap=mmap)
+
+    @property
+    def wav(self):
+        """
+        The wav samples. In lazy mode, the wav file is read on first access.
+        :return:
+        """
+        if self._wav_file is not None:
+            self.read_wav(self._wav_file, mmap=self.mmap)
+        return self._wav
+
+    @wav.setter
+    def wav(self, value):
+        self._wav_file = None
+        self._wav = value
+
+    @property
+    def ult(self):
+        """
+        The ultrasound frames. In lazy mode, the ult file is read on first access.
+        :return:
+        """
+        if self._ult_file is not None:
+            self.read_ult(self._ult_file, mmap=self.mmap)
+        return self._ult
+
+    @ult.setter
+    def ult(self, value):
+        self._ult_file = None
+        self._ult = value
+
+    def estimate_duration(self):
+        """
+        Estimate the duration of the wav and ult. If they have not been read yet, the estimate comes from the wav header
+        and the size of the ult file, without reading either signal.
+        :return: a dictionary containing the number of wav samples and ult frames and their durations in seconds
+        """
+        if self._wav_file is not None:
+            num_wav_samples = read_wav_header(self._wav_file)['num_samples']
+        else:
+            num_wav_samples = self._wav.shape[0]
+
+        if self._ult_file is not None:
+            num_ult_frames = (os.path.getsize(self._ult_file) //
+                              (self.params['num_scanlines'] * self.params['size_scanline']))
+        else:
+            num_ult_frames = self._ult.shape[0]
+
+        return {"num_wav_samples": num_wav_samples,
+                "num_ult_frames": num_ult_frames,
+                "wav_duration": num_wav_samples / self.params['wav_fps'],
+                "ult_duration": num_ult_frames / self.params['ult_fps']}
 
     def process(self,
                 skip_ult_frames=False, stride=None,
                 change_frame_rate=False, new_frame_rate=None,
                 apply_sync=False, remove_zero_regions=False, apply_vad=False, transform_ult=False,
                 resize_ult_frames_by_ratio=False, ratio=None,
-                resize_ult_frames_by_size=False, new_frame_size=None
+                resize_ult_frames_by_size=False, new_frame_size=None,
+                transform_dtype=np.float64, memory_budget=None, track_memory=False, instrumentation=None,
+                cache=None
                 ):
         """
 
@@ -67,44 +142,206 @@ class UltraSuiteCore:
         :param ratio: e.g., (1, 3)
         :param resize_ult_frames_by_size: second alternative for changing the ult frame sizes by specifying a size
         :param new_frame_size: e.g., (63, 138)
+        :param transform_dtype: the type of the transformed ultrasound, e.g., np.uint8 to use 1/8 of the memory
+        :param memory_budget: optionally, the maximum number of bytes processing may use. If the estimated peak (see
+         estimate_process_memory) exceeds it, the frame rate, transform and resize stages work in blocks of frames
+         small enough to fit, and a MemoryError is raised before anything is processed if no block size fits.
+        :param track_memory: record the peak memory of each stage with tracemalloc in self.memory_tracker
+        :param instrumentation: an instrumentation.Instrumentation object, which records the time and data sizes of
+         each stage and runs its hooks around them
+        :param cache: a cache.ArrayCache for the transformed ultrasound and the voice activity. Defaults to the cache in
+         USTOOLS_CACHE_DIR, if set.
         :return:
         """
+        if not stride:  # if the stride has not been specified then it defaults to 5
+            stride = 5
+        if not new_frame_rate:
+            new_frame_rate = 24
+        if not ratio:
+            ratio = (1, 3)
+        if not new_frame_size:
+            new_frame_size = (63, 138)
+
+        block_size = None
+        if memory_budget is not None:
+            block_size = self.fit_memory_budget(
+                memory_budget, skip_ult_frames=skip_ult_frames, stride=stride, change_frame_rate=change_frame_rate,
+                new_frame_rate=new_frame_rate, apply_sync=apply_sync, remove_zero_regions=remove_zero_regions,
+                apply_vad=apply_vad, transform_ult=transform_ult, resize_ult_frames_by_ratio=resize_ult_frames_by_ratio,
+                ratio=ratio, resize_ult_frames_by_size=resize_ult_frames_by_size, new_frame_size=new_frame_size,
+                transform_dtype=transform_dtype)
+
+        self.memory_tracker = MemoryTracker(enabled=track_memory)
+        instrumentation = instrumentation or Instrumentation(enabled=False)
+
+        def stage(name):
+            return track_stage(name, self.memory_tracker, instrumentation, self.memory_usage)
 
         # two alternatives for changing the frame rate
         if skip_ult_frames:
-            if not stride:  # if the stride has not been specified then it defaults to 5
-                stride = 5
-            self.skip_ult_frames(stride=stride)
+            with stage("skip_ult_frames"):
+                self.skip_ult_frames(stride=stride)
 
         elif change_frame_rate:
-            if not new_frame_rate:
-                new_frame_rate = 24
-            self.change_ult_frame_rate(new_frame_rate=new_frame_rate)
+            with stage("change_ult_frame_rate"):
+                self.change_ult_frame_rate(new_frame_rate=new_frame_rate, block_size=block_size)
 
         # ultrasound transformation should apply to original ultrasound size
         if transform_ult:
-            self.transform_ult()
+            with stage("transform_ult"):
+                self.transform_ult(dtype=transform_dtype, block_size=block_size, cache=cache)
 
         # two alternatives for changing the size of the ultrasound frames
         if resize_ult_frames_by_ratio:
-            if not ratio:
-                ratio = (1, 3)
-            self.resize_ult_frames_by_ratio(ratio=ratio)
+            with stage("resize_ult_frames_by_ratio"):
+                self.resize_ult_frames_by_ratio(ratio=ratio, block_size=block_size)
 
         elif resize_ult_frames_by_size:
-            if not new_frame_size:
-                new_frame_size=(63, 138)
-            self.resize_ult_frames(output_size=new_frame_size)
+            with stage("resize_ult_frames"):
+                self.resize_ult_frames(output_size=new_frame_size, block_size=block_size)
 
         # applying sync
         if apply_sync:
-            self.apply_sync()
+            with stage("apply_sync"):
+                self.apply_sync()
 
             if remove_zero_regions:  # should be applied only to synchronised signals
-                self.remove_zero_regions()
+                with stage("remove_zero_regions"):
+                    self.remove_zero_regions()
 
             if apply_vad:  # should be applied only to synchronised signals
-                self.apply_vad()
+                with stage("apply_vad"):
+                    self.apply_vad(cache=cache)
+
+    def memory_usage(self):
+        """
+        The memory held by the wav, ult and ult_t. Signals which have not been read yet (in lazy mode) hold none.
+        :return: see memory.get_memory_usage
+        """
+        return get_memory_usage({"wav": self._wav, "ult": self._ult, "ult_t": self.ult_t})
+
+    def estimate_process_memory(self, skip_ult_frames=False, stride=5, change_frame_rate=False, new_frame_rate=24,
+                                apply_sync=False, remove_zero_regions=False, apply_vad=False, transform_ult=False,
+                                resize_ult_frames_by_ratio=False, ratio=(1, 3), resize_ult_frames_by_size=False,
+                                new_frame_size=(63, 138), transform_dtype=np.float64, block_size=None):
+        """
+        Estimate the peak memory of each stage of process, from the shapes of the signals alone, so that nothing needs
+        to be read. The estimates count the signals held plus the largest temporary arrays of each stage, and are upper
+        bounds for the stages which crop (the sync, zero region and vad stages may copy the signals they keep).
+        Memory-mapped signals only count once they are copied into memory.
+
+        :param block_size: the block size passed to the frame rate, transform and resize stages, see process
+        :return: a dictionary mapping each stage to its estimated peak in bytes
+        """
+        durations = self.estimate_duration()
+        num_frames = durations['num_ult_frames']
+        num_samples = durations['num_wav_samples']
+        frame_shape = (self.params['num_scanlines'], self.params['size_scanline'])
+
+        if self._wav_file is not None:
+            # the sample size also counts for the in-memory copies made by the sync, zero region and vad stages
+            wav_itemsize = read_wav_header(self._wav_file)['bits_per_sample'] // 8
+            wav_bytes = 0 if self.mmap else num_samples * wav_itemsize
+        else:
+            wav_itemsize = self._wav.dtype.itemsize
+            wav_bytes = 0 if is_memory_mapped(self._wav) else self._wav.nbytes
+
+        if self._ult_file is not None:
+            ult_itemsize = 1
+            ult_bytes = 0 if self.mmap else num_frames * int(np.prod(frame_shape))
+        else:
+            ult_itemsize = self._ult.dtype.itemsize
+            ult_bytes = 0 if is_memory_mapped(self._ult) else self._ult.nbytes
+
+        ult_t_bytes = self.ult_t.nbytes
+        transform_itemsize = np.dtype(transform_dtype).itemsize
+        peaks = {}
+
+        def frame_bytes(shape, itemsize=ult_itemsize):
+            return int(np.prod(shape)) * itemsize
+
+        if skip_ult_frames and not self.params['ult_frame_rate_changed']:
+            num_frames = -(-num_frames // stride)  # a view, which keeps the original frames alive
+            peaks["skip_ult_frames"] = wav_bytes + ult_bytes + ult_t_bytes
+
+        elif change_frame_rate and not self.params['ult_frame_rate_changed']:
+            new_num_frames = int(math.ceil(num_frames * new_frame_rate / self.params['ult_fps']))
+            output = new_num_frames * frame_bytes(frame_shape)
+            if not block_size or block_size >= num_frames:
+                # the frames as float32, the re-sampled float32 frames, and the rounded and clipped copies
+                temporary = (num_frames + 3 * new_num_frames) * frame_bytes(frame_shape, 4)
+            else:
+                new_block_size = int(math.ceil(block_size * new_frame_rate / self.params['ult_fps']))
+                temporary = (block_size + 3 * new_block_size) * frame_bytes(frame_shape, 4) + output
+            peaks["change_ult_frame_rate"] = wav_bytes + ult_bytes + ult_t_bytes + temporary + output
+            num_frames = new_num_frames
+            ult_bytes = output
+
+        if transform_ult and not self.params['ult_frame_resized'] and not self.params['ult_transformed']:
+            output_shape = get_output_shape(num_scanlines=frame_shape[0], size_scanline=frame_shape[1],
+                                            zero_offset=self.params['zero_offset'], pixels_per_mm=3)
+            ult_t_bytes = num_frames * frame_bytes(output_shape, transform_itemsize)
+            # one frame at a time: the interpolated float64 frame and its rounded and clipped copies
+            temporary = 3 * frame_bytes(output_shape, 8)
+            peaks["transform_ult"] = wav_bytes + ult_bytes + ult_t_bytes + temporary
+
+        if (resize_ult_frames_by_ratio or resize_ult_frames_by_size) and not self.params['ult_frame_resized']:
+            block = min(num_frames, block_size or 256)
+            if resize_ult_frames_by_ratio:
+                new_frame_shape = (-(-frame_shape[0] // ratio[0]), -(-frame_shape[1] // ratio[1]))
+                # the padded block, its float64 reduction and the rounded copy
+                temporary = block * (frame_bytes(frame_shape) + 2 * frame_bytes(new_frame_shape, 8))
+                name = "resize_ult_frames_by_ratio"
+            else:
+                new_frame_shape = tuple(new_frame_size)
+                temporary = block * (frame_bytes(frame_shape) + frame_bytes(new_frame_shape))
+                name = "resize_ult_frames"
+            output = num_frames * frame_bytes(new_frame_shape)
+            peaks[name] = wav_bytes + ult_bytes + ult_t_bytes + temporary + output
+            ult_bytes = output
+            frame_shape = new_frame_shape
+
+        if apply_sync:
+            # the zero regions, if any, are removed with a copy of each signal
+            ult_copy = num_frames * frame_bytes(frame_shape)
+            wav_copy = num_samples * wav_itemsize
+            held = wav_bytes + ult_bytes + ult_t_bytes
+            peaks["apply_sync"] = held + wav_copy + ult_copy + ult_t_bytes
+            wav_bytes = max(wav_bytes, wav_copy)
+            ult_bytes = max(ult_bytes, ult_copy)
+
+            if remove_zero_regions:
+                peaks["remove_zero_regions"] = wav_bytes + ult_bytes + 2 * ult_t_bytes + wav_copy + ult_copy
+
+            if apply_vad:
+                # the wav as float64, its polyphase re-sampling and the int16 copy webrtcvad reads
+                temporary = num_samples * (8 + 8 + 2)
+                peaks["apply_vad"] = wav_bytes + ult_bytes + 2 * ult_t_bytes + wav_copy + ult_copy + temporary
+
+        return peaks
+
+    def fit_memory_budget(self, memory_budget, **process_kwargs):
+        """
+        Find a block size for which the estimated peak of every stage of process fits in a memory budget.
+        :param memory_budget: in bytes
+        :param process_kwargs: the arguments to process, see estimate_process_memory
+        :return: None if processing everything at once fits, otherwise the largest power of two block size that fits
+        """
+        peaks = self.estimate_process_memory(block_size=None, **process_kwargs)
+        if max(peaks.values() or [0]) <= memory_budget:
+            return None
+
+        block_size = 256
+        while block_size >= 1:
+            peaks = self.estimate_process_memory(block_size=block_size, **process_kwargs)
+            if max(peaks.values()) <= memory_budget:
+                return block_size
+            block_size //= 2
+
+        stage, peak = max(peaks.items(), key=lambda item: item[1])
+        raise MemoryError("The estimated peak memory of " + stage + " (" + format_bytes(peak) + ") exceeds the memory "
+                          "budget (" + format_bytes(memory_budget) + "), even in blocks of one frame. Consider "
+                          "transform_dtype=np.uint8, mmap=True, or Chunk.iter_chunks.")
 
     def read_prompt(self, file):
         """
@@ -129,13 +366,17 @@ class UltraSuiteCore:
             prompt_f.write(self.datetime.strftime('%d/%m/%Y %H:%M:%S') + '\n')
             prompt_f.write(self.speaker_id)
 
-    def read_wav(self, file):
+    def read_wav(self, file, mmap=False):
         """
         Read wave file into numpy array and store sampling rate in parameter dictionay.
         :param file:
+        :param mmap: if True, the samples are a read-only memory-mapped view of the file, as the ult frames are in
+         read_ult. scipy maps the file copy-on-write, so writes would otherwise succeed but never reach the file.
         :return:
         """
-        self.params['wav_fps'], self.wav = wavfile.read(file)
+        self.params['wav_fps'], self.wav = wavfile.read(file, mmap=mmap)
+        if mmap:
+            self.wav.flags.writeable = False
 
     def write_wav(self, directory):
         """
@@ -191,12 +432,23 @@ class UltraSuiteCore:
             param_file.write('FramesPerSec=' + str(self.params['ult_fps']) + '\n')
             param_file.write('TimeInSecsOfFirstFrame=' + str(self.params['sync']))
 
-    def read_ult(self, file):
+    def read_ult(self, file, mmap=False):
         """
         Read ultrasound file into a numpy array and reshape it
         :param file:
+        :param mmap: if True, the frames are a read-only np.memmap of shape (frames, num_scanlines, size_scanline)
         :return:
         """
+        if mmap:
+            frame_size = self.params['num_scanlines'] * self.params['size_scanline']
+            num_frames = os.path.getsize(file) // frame_size
+            if num_frames > 0:
+                self.ult = np.memmap(file, dtype=np.uint8, mode='r',
+                                     shape=(num_frames, self.params['num_scanlines'], self.params['size_scanline']))
+            else:  # np.memmap cannot map an empty file
+                self.ult = np.zeros((0, self.params['num_scanlines'], self.params['size_scanline']), dtype=np.uint8)
+            return
+
         with open(file, "rb") as f:
             self.ult = np.fromfile(f, dtype=np.uint8)
             self.ult = self.ult.reshape(-1, self.params['num_scanlines'], self.params['size_scanline'])
@@ -210,6 +462,33 @@ class UltraSuiteCore:
         with open(os.path.join(directory, self.basename + ".ult"), "wb") as f:
             self.ult.astype(np.uint8).tofile(f)
 
+    def slice_time(self, start_time=0, end_time=None):
+        """
+        Get the wav and ult between two points in time, without reading anything outside the range when the signals
+        are memory-mapped. Times are in seconds relative to the first ultrasound frame. If the sync has not been
+        applied yet, the sync offset is taken into account so that the two segments are synchronised.
+        :param start_time: in seconds
+        :param end_time: in seconds. If None, the segments run to the end of the signals.
+        :return: two numpy arrays (views): the wav segment and the ult segment
+        """
+        wav_offset = 0
+        ult_offset = 0
+        if not self.params['sync_applied']:
+            # a positive sync means the wav is leading, a negative sync means the ult is leading
+            wav_offset = max(self.params['sync'], 0)
+            ult_offset = max(-self.params['sync'], 0)
+
+        wav_start = max(int(round((start_time + wav_offset) * self.params['wav_fps'])), 0)
+        ult_start = max(int(round((start_time + ult_offset) * self.params['ult_fps'])), 0)
+
+        if end_time is None:
+            return self.wav[wav_start:], self.ult[ult_start:]
+
+        wav_end = max(int(round((end_time + wav_offset) * self.params['wav_fps'])), wav_start)
+        ult_end = max(int(round((end_time + ult_offset) * self.params['ult_fps'])), ult_start)
+
+        return self.wav[wav_start:wav_end], self.ult[ult_start:ult_end]
+
     def skip_ult_frames(self, stride=5):
         """
         Skip some ultrasound frames to reduce the frame rate.
@@ -218,69 +497,88 @@ class UltraSuiteCore:
         """
         if not self.params['ult_frame_rate_changed']:
             self.ult = self.ult[0::stride]
-            self.params['ult_fps'] /= 5
+            self.params['ult_fps'] /= stride
             self.params['ult_frame_rate_changed'] = True
 
-    def change_ult_frame_rate(self, new_frame_rate):
+    def change_ult_frame_rate(self, new_frame_rate, block_size=None):
+        """
+        Reduce the ultrasound frame rate by re-sampling and interpolating.
+        :param new_frame_rate: e.g., 24 fps
+        :param block_size: optionally re-sample in blocks of this many frames to bound memory on long utterances
+        :return:
+        """
         if not self.params['ult_frame_rate_changed']:
             ratio = new_frame_rate / self.params['ult_fps']
-            temp = np.apply_along_axis(lambda x: samplerate.resample(x, ratio, 'linear'), 0, self.ult)
-            self.ult = temp.round().astype(int)
+            self.ult = resample_frame_rate(self.ult, ratio, 'linear', block_size=block_size)
             self.params['ult_fps'] = new_frame_rate
             self.params['ult_frame_rate_changed'] = True
 
-    def transform_ult(self):
+    def transform_ult(self, dtype=np.float64, out=None, method="map_coordinates", workers=1, block_size=None,
+                      cache=None, order=None):
         """
         Transform the ultrasound.
+        :param dtype: the type of ult_t, e.g., np.uint8 or np.float32
+        :param out: an optional preallocated array to write ult_t into, e.g., a memmap. The cache is not used.
+        :param method: "map_coordinates" or "sparse", see transform_ultrasound
+        :param order: the spline interpolation order. Defaults to 2 for map_coordinates and 1 for sparse, which only
+         supports orders 0 and 1.
+        :param workers: the number of threads transforming frames in parallel
+        :param block_size: the number of frames per block, which bounds the temporary memory
+        :param cache: a cache.ArrayCache, keyed on the frames and the transform parameters. Defaults to the cache in
+         USTOOLS_CACHE_DIR, if set. Cached ult_t is a read-only memory map.
         :return:
         """
         if self.params['ult_frame_resized'] and not self.params['ult_transformed']:
             print("ultrasound has been down-sampled. No transform applied.")
 
         elif not self.params['ult_frame_resized'] and not self.params['ult_transformed']:
-            self.ult_t = transform_ultrasound(self.ult, num_scanlines=self.params['num_scanlines'],
-                                              size_scanline=self.params['size_scanline'], angle=self.params['angle'],
-                                              zero_offset=self.params['zero_offset'], pixels_per_mm=3)
+            if order is None:
+                order = 1 if method == "sparse" else 2
+            geometry = {"num_scanlines": self.params['num_scanlines'], "size_scanline": self.params['size_scanline'],
+                        "angle": self.params['angle'], "zero_offset": self.params['zero_offset'], "pixels_per_mm": 3}
+
+            def transform():
+                return transform_ultrasound(self.ult, spline_interpolation_order=order, method=method, dtype=dtype,
+                                            out=out, workers=workers, block_size=block_size, **geometry)
+
+            cache = cache or get_default_cache()
+            if cache is None or out is not None:
+                self.ult_t = transform()
+            else:
+                key = make_key("transform_ult/1", [self.ult], method=method, order=order, dtype=np.dtype(dtype).str,
+                               **geometry)
+                self.ult_t = cache.get_or_compute(key, lambda: {"ult_t": transform()})["ult_t"]
+
             self.params['ult_transformed'] = True
 
-    def resize_ult_frames_by_ratio(self, ratio=(1, 3), func=np.mean):
+    def resize_ult_frames_by_ratio(self, ratio=(1, 3), func=np.mean, block_size=None):
         """
-        down-sample the ultrasound frames
+        down-sample the ultrasound frames, all at once. Frames are padded with zeros to a multiple of the ratio, as with
+        skimage.measure.block_reduce, and integer frames keep their type.
         :param ratio:
-        :param func:
+        :param func: a reduction which accepts an axis argument, e.g., np.mean
+        :param block_size: the number of frames reduced at once, which bounds the temporary memory
         :return:
         """
 
         if not self.params['ult_frame_resized']:
 
-            resized = []
-            for i, image in enumerate(self.ult):
-                temp = block_reduce(image, block_size=ratio, func=func)
-                temp = temp.round().astype(int)
-                resized.append(temp)
-
-            self.ult = np.array(resized)
+            self.ult = block_reduce_frames(self.ult, ratio=ratio, func=func, frames_per_block=block_size or 256)
             self.params['num_scanlines'] = self.ult.shape[1]
             self.params['size_scanline'] = self.ult.shape[2]
             self.params['ult_frame_resized'] = True
 
-    def resize_ult_frames(self, output_size=(63, 138)):
+    def resize_ult_frames(self, output_size=(63, 138), block_size=None):
         """
-        down-sample the ultrasound frames
+        down-sample the ultrasound frames with nearest neighbour interpolation, all at once. The frames keep their type.
         :param output_size:
+        :param block_size: the number of frames resized at once, which bounds the temporary memory
         :return:
         """
 
         if not self.params['ult_frame_resized']:
 
-            resized = []
-            for i, image in enumerate(self.ult):
-                temp = resize(image, output_shape=output_size, order=0, mode='reflect', clip=False,
-                              preserve_range=True, anti_aliasing=False)
-                temp = temp.round().astype(int)
-                resized.append(temp)
-
-            self.ult = np.array(resized)
+            self.ult = resize_frames(self.ult, output_shape=output_size, frames_per_block=block_size or 256)
             self.params['num_scanlines'] = output_size[0]
             self.params['size_scanline'] = output_size[1]
             self.params["ult_frame_resized"] = True
@@ -288,6 +586,52 @@ class UltraSuiteCore:
             assert (self.ult.shape[1] == output_size[0])
             assert (self.ult.shape[2] == output_size[1])
 
+    def apply_intervals(self, wav_keep=None, ult_keep=None):
+        """
+        Keep only the wav samples and ult frames inside the given interval sets, with a single gather per signal.
+        If the ult has been transformed, ult_t is treated like ult.
+        :param wav_keep: an IntervalSet of wav samples, or None to leave the wav unchanged
+        :param ult_keep: an IntervalSet of ult frames, or None to leave the ult unchanged
+        :return:
+        """
+        if wav_keep is not None:
+            self.wav = wav_keep.apply(self.wav)
+
+        if ult_keep is not None:
+            self.ult = ult_keep.apply(self.ult)
+
+            if self.params['ult_transformed']:
+                self.ult_t = ult_keep.apply(self.ult_t)
+
+    def get_sync_intervals(self, crop=True):
+        """
+        The wav samples and ult frames kept when synchronising the two signals: the start of the leading signal is
+        cropped (see apply_sync), then the end of the longer of the two is trimmed.
+        :param crop: if False, only trim the end
+        :return: two IntervalSets, for the wav and the ult. Each is a single contiguous range.
+        """
+        wav_start = 0
+        ult_start = 0
+
+        if crop and self.params['sync'] > 0:
+            wav_start = int(round(self.params['wav_fps'] * self.params['sync']))
+        elif crop and self.params['sync'] < 0:
+            ult_start = int(round(self.params['ult_fps'] * abs(self.params['sync'])))
+
+        wav_length = max(self.wav.shape[0] - wav_start, 0)
+        ult_length = max(self.ult.shape[0] - ult_start, 0)
+
+        wav_dur = wav_length / self.params['wav_fps']
+        ult_dur = ult_length / self.params['ult_fps']
+
+        if wav_dur > ult_dur:
+            wav_length = int(round(self.params['wav_fps'] * ult_dur))
+        elif wav_dur < ult_dur:
+            ult_length = int(round(self.params['ult_fps'] * wav_dur))
+
+        return (IntervalSet([wav_start], [wav_start + wav_length]),
+                IntervalSet([ult_start], [ult_start + ult_length]))
+
     def apply_sync(self):
         """
         Synchronise the two signals and trim the end of the longer of the two.
@@ -298,19 +642,10 @@ class UltraSuiteCore:
         """
         if not self.params['sync_applied']:
 
-            if self.params['sync'] > 0:
-                # if it's a positive value then the wav is leading and the ult is lagging. Therefore, crop the wav.
-                self.wav = get_segment(signal=self.wav, sampling_rate=self.params['wav_fps'],
-                                       start_time=self.params['sync'])
+            # each signal keeps a single contiguous range, so these are views and nothing is copied
+            self.apply_intervals(*self.get_sync_intervals())
 
-            elif self.params['sync'] < 0:
-                # if it's a negative value then the ult is leading and the wav is lagging. Therefore, crop the ult.
-                self.ult = get_segment(signal=self.ult, sampling_rate=self.params['ult_fps'],
-                                       start_time=abs(self.params['sync']))
-
-            self.trim_signal_end()  # trim the end of the longer of the two signals
-
-            self.remove_zero_regions() #
+            self.remove_zero_regions()  # a single gather per signal
 
             self.params['sync_applied'] = True
 
@@ -319,15 +654,16 @@ class UltraSuiteCore:
         Trim the end of the longer of the two signals.
         :return:
         """
-        wav_dur = self.wav.shape[0] / self.params['wav_fps']
-        ult_dur = self.ult.shape[0] / self.params['ult_fps']
+        self.apply_intervals(*self.get_sync_intervals(crop=False))
 
-        if wav_dur > ult_dur:
-            self.wav = get_segment(signal=self.wav, sampling_rate=self.params['wav_fps'], start_time=0,
-                                   end_time=ult_dur)
-        elif wav_dur < ult_dur:
-            self.ult = get_segment(signal=self.ult, sampling_rate=self.params['ult_fps'], start_time=0,
-                                   end_time=wav_dur)
+    def get_zero_region_intervals(self):
+        """
+        The zero regions of the wav (see remove_zero_regions) and the corresponding ult frames.
+        :return: two IntervalSets, for the wav and the ult
+        """
+        wav_zero = IntervalSet.from_inclusive(get_zero_regions(self.wav, num_repetitions=100))
+        ult_zero = wav_zero.convert_rate(self.params['wav_fps'], self.params['ult_fps'])
+        return wav_zero, ult_zero
 
     def remove_zero_regions(self):
         """
@@ -336,48 +672,48 @@ class UltraSuiteCore:
         :return:
         """
         if not self.params['zero_removed']:
-            indices_of_zero_regions_wav = get_zero_regions(self.wav, num_repetitions=100)
-
-            for start, end in reversed(indices_of_zero_regions_wav):
-                self.wav = np.delete(self.wav, np.s_[start:end + 1])
-
-            indices_of_zero_regions_ult = np.multiply(indices_of_zero_regions_wav,
-                                                      self.params['ult_fps'] / self.params['wav_fps'])
-            indices_of_zero_regions_ult = np.rint(indices_of_zero_regions_ult)
-            indices_of_zero_regions_ult = indices_of_zero_regions_ult.astype(int)
+            wav_zero, ult_zero = self.get_zero_region_intervals()
 
-            for start, end in reversed(indices_of_zero_regions_ult):
-                self.ult = np.delete(self.ult, np.s_[start:end + 1], axis=0)
+            self.apply_intervals(wav_keep=wav_zero.complement(self.wav.shape[0]),
+                                 ult_keep=ult_zero.complement(self.ult.shape[0]))
 
             self.params['zero_removed'] = True
 
-    def apply_vad(self):
+    def apply_vad(self, cache=None):
         """
         Apply voice activity detection.
+        :param cache: a cache.ArrayCache, keyed on the wav and the VAD parameters. Defaults to the cache in
+         USTOOLS_CACHE_DIR, if set.
         :return:
         """
         if not self.params['vad_applied']:
 
-            # get time segments
-            time_segments = detect_voice_activity(wav=self.wav,
-                                                  sample_rate=self.params['wav_fps'],
-                                                  vad_wav_sample_rate=16000,
-                                                  aggressiveness=2,  # was 2
-                                                  window_duration=0.03,
-                                                  bytes_per_sample=2)
-
-            # apply to wav
-            silence, speech = separate_silence_and_speech(self.wav, self.params['wav_fps'], time_segments)
-            self.wav = speech
-
-            # apply to ult
-            silence, speech = separate_silence_and_speech(self.ult, self.params['ult_fps'], time_segments)
-            self.ult = speech
-
-            # if ult has been transformed, apply to ult_t
-            if self.params['ult_transformed']:
-                silence, speech = separate_silence_and_speech(self.ult_t, self.params['ult_fps'], time_segments)
-                self.ult_t = speech
+            vad_params = {"vad_wav_sample_rate": 16000,
+                          "aggressiveness": 2,  # was 2
+                          "window_duration": 0.03}
+
+            cache = cache or get_default_cache()
+            if cache is None:
+                # get voice activity
+                voice_activity = get_voice_activity(wav=self.wav, sample_rate=self.params['wav_fps'], **vad_params)
+            else:
+                def detect():
+                    activity = get_voice_activity(wav=self.wav, sample_rate=self.params['wav_fps'], **vad_params)
+                    return {"is_speech": activity.is_speech,
+                            "samples_per_window": np.array(activity.samples_per_window),
+                            "sample_rate": np.array(activity.sample_rate)}
+
+                key = make_key("voice_activity/1", [self.wav], sample_rate=self.params['wav_fps'], **vad_params)
+                cached = cache.get_or_compute(key, detect)
+                voice_activity = VoiceActivity(cached["is_speech"], int(cached["samples_per_window"]),
+                                               int(cached["sample_rate"]))
+
+            # keep everything except the runs which are not speech, in the wav, ult and ult_t
+            wav_silence = voice_activity.to_intervals(self.params['wav_fps'], is_speech=False)
+            ult_silence = voice_activity.to_intervals(self.params['ult_fps'], is_speech=False)
+
+            self.apply_intervals(wav_keep=wav_silence.complement(self.wav.shape[0]),
+                                 ult_keep=ult_silence.complement(self.ult.shape[0]))
 
             # set the vad_applied parameter to true
             self.params['vad_applied'] = True
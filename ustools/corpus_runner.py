@@ -0,0 +1,343 @@
+"""
+A parallel, resumable runner which processes a corpus with UltraSuiteCore.process and Chunk, and saves the synchronised
+chunks of each utterance with Chunk.save_sync_data.
+
+Utterances are processed in a pool of worker processes (see run_jobs, which render_farm shares). A failing utterance is
+reported and does not stop the run, the number of utterances in flight is bounded, and results can be delivered in
+input order or as soon as they are ready.
+Completed utterances are recorded in a journal file, so an interrupted run resumes where it stopped.
+
+Date: Oct 2026
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from ustools.cache import ArrayCache
+from ustools.chunk import Chunk
+from ustools.core import UltraSuiteCore
+from ustools.folder_utils import get_all_utterance_files, get_utterance_id_from_path, get_dir_info
+from ustools.instrumentation import Instrumentation, write_json
+
+JOURNAL_FILENAME = "journal.jsonl"
+
+
+def get_default_num_workers():
+    """
+    The number of CPUs available to this process.
+    :return:
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def process_utterance(directory, basename, output_file, process_kwargs=None, chunk_kwargs=None, instrument=False):
+    """
+    Process a single utterance, chunk it, and save the chunks to disk.
+    :param directory: the directory containing the files
+    :param basename: base file name without extension
+    :param output_file: the output file name, passed to Chunk.save_sync_data
+    :param process_kwargs: keyword arguments to UltraSuiteCore.process
+    :param chunk_kwargs: keyword arguments to Chunk
+    :param instrument: record the time and data sizes of each stage, see instrumentation.Instrumentation
+    :return: a dictionary containing the number of chunks, and the stage records if instrument is True
+    """
+    instrumentation = Instrumentation(enabled=instrument,
+                                      labels={"utterance_id": get_utterance_id_from_path(directory, basename),
+                                              "dataset": get_dir_info(directory)["dataset"]})
+
+    with instrumentation.stage("read"):
+        core = UltraSuiteCore(directory, basename)
+    core.process(instrumentation=instrumentation, **(process_kwargs or {}))
+
+    chunk = Chunk(core, instrumentation=instrumentation, **(chunk_kwargs or {}))
+    if not hasattr(chunk, "chunk_ids"):
+        raise ValueError("Utterance could not be chunked: " + os.path.join(directory, basename))
+
+    with instrumentation.stage("save"):
+        Chunk.save_sync_data(output_file,
+                             raw_ult=chunk.ult_chunks,
+                             trans_ult=chunk.ult_t_chunks,
+                             raw_wav=chunk.wav_chunks,
+                             logfbank_feat=chunk.fbank_chunks,
+                             mfcc_feat=chunk.mfcc_chunks)
+
+    result = {"num_chunks": len(chunk.chunk_ids)}
+    if instrument:
+        result["stages"] = instrumentation.records
+    return result
+
+
+def _run_job(func, job, kwargs):
+    """
+    Run a job in a worker, catching any exception so that one utterance cannot stop the run.
+    :return: a result dictionary
+    """
+    start = time.time()
+    result = dict(job)
+    try:
+        result["result"] = func(job["directory"], job["basename"], job["output_file"], **kwargs)
+        result["status"] = "done"
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+    result["seconds"] = time.time() - start
+    return result
+
+
+def read_journal(journal_file):
+    """
+    Read the ids of the utterances which completed in previous runs.
+    :param journal_file:
+    :return: a set of utterance ids
+    """
+    done = set()
+    if not os.path.exists(journal_file):
+        return done
+    with open(journal_file) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:  # a line cut short by an interruption
+                continue
+            if entry.get("status") == "done":
+                done.add(entry["utterance_id"])
+            else:
+                done.discard(entry["utterance_id"])
+    return done
+
+
+def make_jobs(utterances, output_dir):
+    """
+    Turn a list of utterances into jobs.
+    :param utterances: (directory, basename) tuples. The basename may include the .ult extension, as returned by
+     folder_utils.get_all_utterance_files.
+    :param output_dir:
+    :return: a list of job dictionaries
+    """
+    jobs = []
+    for directory, basename in utterances:
+        if basename.endswith(".ult"):
+            basename = basename[:-len(".ult")]
+        utterance_id = get_utterance_id_from_path(directory, basename)
+        jobs.append({"utterance_id": utterance_id,
+                     "directory": directory,
+                     "basename": basename,
+                     "output_file": os.path.join(output_dir, utterance_id.replace(os.sep, "_"))})
+    return jobs
+
+
+def run_jobs(jobs, func, kwargs=None, workers=None, max_in_flight=None, ordered=False):
+    """
+    Run jobs in a pool of worker processes. This is a generator: results are yielded as they are delivered. A failing
+    job is reported as failed and does not stop the other jobs. When a worker dies, the jobs in flight are run again,
+    one at a time, and only a job whose worker dies again is reported as failed.
+
+    :param jobs: job dictionaries with (at least) the keys directory, basename and output_file, e.g., from make_jobs
+    :param func: the function applied to each job, as func(directory, basename, output_file, **kwargs)
+    :param kwargs: keyword arguments to func
+    :param workers: the number of worker processes. Defaults to the number of available CPUs.
+    :param max_in_flight: the maximum number of jobs submitted but not yet delivered. This bounds the memory held by
+     the pool. Defaults to twice the number of workers.
+    :param ordered: if True, results are delivered in the order of the jobs, otherwise as soon as they are ready
+    :return: result dictionaries: the job, with the keys status, seconds and either result or error added
+    """
+    workers = workers or get_default_num_workers()
+    max_in_flight = max(max_in_flight or 2 * workers, 1)
+    kwargs = kwargs or {}
+    pending = deque(jobs)
+    suspects = deque()  # (job, result or None) of the jobs in flight when a worker died, in submission order
+
+    while pending or suspects:
+        # after a worker dies, the jobs which were in flight are run again one at a time, so that only a job which
+        # kills its worker on its own is reported as failed
+        isolate = bool(suspects)
+        in_flight = deque()  # (job, future) in submission order
+        try:
+            with ProcessPoolExecutor(max_workers=1 if isolate else workers) as pool:
+                while (suspects if isolate else pending) or in_flight:
+                    if isolate:
+                        while suspects and not in_flight:
+                            job, result = suspects.popleft()
+                            if result is not None:  # completed before the worker died
+                                yield result
+                            else:
+                                in_flight.append((job, pool.submit(_run_job, func, job, kwargs)))
+                        if not in_flight:
+                            break
+                    else:
+                        while pending and len(in_flight) < max_in_flight:
+                            job = pending.popleft()
+                            in_flight.append((job, pool.submit(_run_job, func, job, kwargs)))
+
+                    if ordered or isolate:
+                        in_flight[0][1].result()
+                        while in_flight and in_flight[0][1].done():
+                            result = in_flight[0][1].result()  # before removing it, in case its worker died
+                            in_flight.popleft()
+                            yield result
+                    else:
+                        finished, _ = wait([future for _, future in in_flight], return_when=FIRST_COMPLETED)
+                        for item in [item for item in in_flight if item[1] in finished]:
+                            result = item[1].result()  # before removing it, in case its worker died
+                            in_flight.remove(item)
+                            yield result
+
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for running out of memory)
+            if isolate:
+                for job, future in in_flight:
+                    yield dict(job, status="failed", error="worker process terminated abruptly", seconds=0)
+            else:
+                for job, future in in_flight:
+                    completed = future.done() and not future.cancelled() and future.exception() is None
+                    suspects.append((job, future.result() if completed else None))
+
+
+def run_corpus(utterances, output_dir, process_kwargs=None, chunk_kwargs=None, workers=None, max_in_flight=None,
+               ordered=False, resume=True, func=process_utterance, instrument=False):
+    """
+    Process a corpus in parallel. This is a generator: results are yielded as they are delivered.
+
+    :param utterances: (directory, basename) tuples
+    :param output_dir: the directory to write the outputs and the journal to
+    :param process_kwargs: keyword arguments to UltraSuiteCore.process
+    :param chunk_kwargs: keyword arguments to Chunk
+    :param workers: the number of worker processes. Defaults to the number of available CPUs.
+    :param max_in_flight: the maximum number of utterances submitted but not yet delivered. This bounds the memory
+     held by the pool. Defaults to twice the number of workers.
+    :param ordered: if True, results are delivered in the order of the input, otherwise as soon as they are ready
+    :param resume: if True, utterances recorded as done in the journal are skipped
+    :param func: the function applied to each utterance, with the signature of process_utterance
+    :param instrument: passed to func, so that each result includes the stage records of its utterance
+    :return: result dictionaries with the keys utterance_id, directory, basename, output_file, status, seconds and
+     either result or error
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    kwargs = {"process_kwargs": process_kwargs, "chunk_kwargs": chunk_kwargs}
+    if instrument:
+        kwargs["instrument"] = True
+
+    journal_file = os.path.join(output_dir, JOURNAL_FILENAME)
+    done = read_journal(journal_file) if resume else set()
+    jobs = [job for job in make_jobs(utterances, output_dir) if job["utterance_id"] not in done]
+
+    with open(journal_file, "a") as journal:
+        for result in run_jobs(jobs, func, kwargs, workers=workers, max_in_flight=max_in_flight, ordered=ordered):
+            journal.write(json.dumps({"utterance_id": result["utterance_id"], "status": result["status"]}) + "\n")
+            journal.flush()
+            yield result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process and chunk UltraSuite utterances in parallel.")
+    parser.add_argument("input", help="the root directory of the data, or a manifest file if --manifest is given")
+    parser.add_argument("output_dir", help="the directory to write the chunks and the journal to")
+    parser.add_argument("--manifest", action="store_true", help="read the utterances from a corpus manifest")
+    parser.add_argument("--dataset", nargs="+", help="only process these datasets (requires --manifest)")
+    parser.add_argument("--speaker", nargs="+", help="only process these speakers (requires --manifest)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="maximum number of utterances in flight")
+    parser.add_argument("--ordered", action="store_true", help="deliver results in input order")
+    parser.add_argument("--no-resume", action="store_true", help="ignore the journal and process every utterance")
+    parser.add_argument("--stats", metavar="FILE",
+                        help="write the time and data sizes of each stage of each utterance, and their summary per "
+                             "dataset and stage, to a JSON file")
+
+    group = parser.add_argument_group("processing")
+    group.add_argument("--skip-ult-frames", type=int, metavar="STRIDE", help="reduce the frame rate by skipping frames")
+    group.add_argument("--new-frame-rate", type=float, help="reduce the frame rate by re-sampling")
+    group.add_argument("--apply-sync", action="store_true")
+    group.add_argument("--remove-zero-regions", action="store_true")
+    group.add_argument("--apply-vad", action="store_true")
+    group.add_argument("--transform-ult", action="store_true")
+    group.add_argument("--resize-ratio", type=int, nargs=2, help="down-sample the ult frames by a ratio, e.g., 1 3")
+    group.add_argument("--resize-size", type=int, nargs=2, help="resize the ult frames to a size, e.g., 63 138")
+    group.add_argument("--memory-budget", type=float, metavar="MIB",
+                       help="process in blocks to stay within this many MiB per utterance, or fail the utterance if "
+                            "it cannot fit")
+
+    group = parser.add_argument_group("caching")
+    group.add_argument("--cache-dir", help="cache the transformed ult, voice activity and speech features here")
+    group.add_argument("--cache-size", type=float, metavar="MIB", help="evict the least recently used cache entries "
+                                                                       "beyond this size")
+
+    group = parser.add_argument_group("chunking")
+    group.add_argument("--ult-chunk-size", type=int, default=5)
+    group.add_argument("--mfcc", action="store_true")
+    group.add_argument("--drop-first-mfcc", action="store_true")
+    group.add_argument("--fbank", action="store_true")
+    group.add_argument("--transform-chunks", action="store_true", help="include transformed ult chunks")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    :param argv:
+    :return: the exit status
+    """
+    args = parse_args(argv)
+
+    if args.manifest:
+        from ustools.manifest import CorpusManifest
+        with CorpusManifest(args.input) as manifest:
+            utterances = manifest.get_utterance_files(dataset=args.dataset, speaker=args.speaker)
+    else:
+        utterances = get_all_utterance_files(args.input)
+
+    process_kwargs = {"skip_ult_frames": args.skip_ult_frames is not None, "stride": args.skip_ult_frames,
+                      "change_frame_rate": args.new_frame_rate is not None, "new_frame_rate": args.new_frame_rate,
+                      "apply_sync": args.apply_sync, "remove_zero_regions": args.remove_zero_regions,
+                      "apply_vad": args.apply_vad, "transform_ult": args.transform_ult,
+                      "resize_ult_frames_by_ratio": args.resize_ratio is not None,
+                      "ratio": tuple(args.resize_ratio) if args.resize_ratio else None,
+                      "resize_ult_frames_by_size": args.resize_size is not None,
+                      "new_frame_size": tuple(args.resize_size) if args.resize_size else None,
+                      "memory_budget": args.memory_budget * 2 ** 20 if args.memory_budget else None}
+
+    chunk_kwargs = {"ult_chunk_size": args.ult_chunk_size, "mfcc_feat": args.mfcc,
+                    "drop_first_mfcc": args.drop_first_mfcc, "fbank_feat": args.fbank,
+                    "transform_ult": args.transform_chunks}
+
+    if args.cache_dir:
+        cache = ArrayCache(args.cache_dir, max_bytes=args.cache_size * 2 ** 20 if args.cache_size else None)
+        process_kwargs["cache"] = cache
+        chunk_kwargs["cache"] = cache
+
+    start = time.time()
+    num_done = 0
+    failed = []
+    records = []
+
+    for result in run_corpus(utterances, args.output_dir, process_kwargs=process_kwargs, chunk_kwargs=chunk_kwargs,
+                             workers=args.workers, max_in_flight=args.max_in_flight, ordered=args.ordered,
+                             resume=not args.no_resume, instrument=args.stats is not None):
+        if result["status"] == "done":
+            num_done += 1
+            records.extend(result["result"].get("stages", []))
+            print(result["utterance_id"], "done in %.1f s" % result["seconds"])
+        else:
+            failed.append(result)
+            print(result["utterance_id"], "FAILED:", result["error"].strip().splitlines()[-1], file=sys.stderr)
+
+    print("%d utterances processed, %d failed, in %.1f s" % (num_done, len(failed), time.time() - start))
+
+    if args.stats:
+        write_json(args.stats, records, by=("dataset", "stage"))
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,11 +8,12 @@ Author: Aciel Eshky
 import os
 
 
-def get_all_utterance_dirs(root_dir):
+def get_all_utterance_dirs(root_dir, verbose=False):
     list_of_utterance_dirs = []
     for dirpath, dirnames, filenames in os.walk(root_dir):
         if any(fname.endswith('.ult') for fname in filenames):
-            print(dirpath)
+            if verbose:
+                print(dirpath)
             list_of_utterance_dirs.append(dirpath)
     return list_of_utterance_dirs
 
@@ -30,6 +31,8 @@ def get_all_utterance_files(root_dir):
 def get_dir_info(path):
     items = path.split("/")
 
+    dataset = speaker = session = None  # not an UltraSuite directory
+
     for i in items:
         if "uxtd" in i:
             dataset = "uxtd"
@@ -67,3 +70,17 @@ def get_extended_dir_info(path, filename):
 
 def get_utterance_id(dataset, speaker, session, utterance):
     return dataset + "-" + speaker + "-" + session + "-" + utterance
+
+
+def get_utterance_id_from_path(path, basename):
+    """
+    Get the utterance id of an utterance from its directory. Falls back to the path of the utterance when the
+    directory is not part of an UltraSuite dataset.
+    :param path: the directory containing the utterance
+    :param basename: base file name without extension
+    :return:
+    """
+    x = get_dir_info(path)
+    if x["dataset"] is None:
+        return os.path.join(path, basename)
+    return get_utterance_id(x["dataset"], x["speaker"], x["session"], basename)
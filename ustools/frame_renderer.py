@@ -0,0 +1,229 @@
+"""
+A fast renderer of ultrasound frames as RGB images, for videos and thumbnails, which does not draw a matplotlib figure
+per frame.
+
+Frames are drawn as imshow(frame.T, origin='lower') draws them: the scanlines run left to right and the depth bottom to
+top. The transposition, the flip and the scaling to the output size are folded into a single precomputed index map, so
+that rendering a frame is a gather of its pixels followed by a colormap lookup. A caption (e.g., the prompt) is
+rasterised once with matplotlib and reused for every frame.
+
+    renderer = FrameRenderer(ult_3d.shape[1:], size=(500, 500), title=prompt)
+    for image in renderer.iter_frames(ult_3d):
+        ...
+
+Date: Oct 2026
+
+"""
+
+import struct
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=32)
+def get_colormap_lut(cmap="gray", vmin=0.0, vmax=255.0):
+    """
+    A lookup table from uint8 pixel values to RGB colours, with the normalisation of vmin and vmax applied as imshow
+    applies it.
+    :param cmap: a matplotlib colormap name
+    :param vmin: the value mapped to the lowest colour
+    :param vmax: the value mapped to the highest colour
+    :return: read-only uint8 array of shape (256, 3)
+    """
+    from matplotlib import colormaps
+
+    values = np.arange(256, dtype=np.float64)
+    normalised = np.clip((values - vmin) / max(vmax - vmin, np.finfo(np.float64).eps), 0, 1)
+    lut = colormaps[cmap](normalised, bytes=True)[:, :3].copy()
+    lut.setflags(write=False)
+    return lut
+
+
+@lru_cache(maxsize=32)
+def get_frame_index_map(frame_shape, output_shape, aspect="auto"):
+    """
+    A map from each pixel of the scaled frame to the (flattened) frame pixel it shows, with nearest neighbour scaling.
+    :param frame_shape: (number of scanlines, number of samples per scanline), or (width, height) of a transformed frame
+    :param output_shape: (height, width) of the image area in pixels
+    :param aspect: 'auto' stretches the frame to fill the image area. 'equal' keeps square pixels and centres the frame.
+    :return: (index map of shape (scaled height, scaled width), read-only, and the (top, left) offset of the scaled
+     frame in the image area)
+    """
+    width, height = frame_shape  # the frame is shown transposed
+    out_height, out_width = output_shape
+
+    if aspect == "equal":
+        scale = min(out_height / height, out_width / width)
+        scaled_height, scaled_width = max(int(round(height * scale)), 1), max(int(round(width * scale)), 1)
+    else:
+        scaled_height, scaled_width = out_height, out_width
+
+    rows = ((np.arange(scaled_height) + 0.5) * height / scaled_height).astype(np.int64)
+    cols = ((np.arange(scaled_width) + 0.5) * width / scaled_width).astype(np.int64)
+
+    # with origin='lower', image row r shows frame.T[height - 1 - r], i.e., frame[:, height - 1 - r]
+    rows = height - 1 - rows
+    index_map = cols[np.newaxis, :] * height + rows[:, np.newaxis]
+    index_map.setflags(write=False)
+
+    return index_map, ((out_height - scaled_height) // 2, (out_width - scaled_width) // 2)
+
+
+@lru_cache(maxsize=32)
+def get_caption_bitmap(text, width, height, fontsize=12):
+    """
+    Rasterise a caption once, centred in a band of the given size.
+    :param text:
+    :param width: in pixels
+    :param height: in pixels
+    :param fontsize: in points, at 100 dpi
+    :return: read-only float32 array of shape (height, width): the coverage of each pixel by the text, from 0 to 1
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    dpi = 100
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi, facecolor="white")
+    canvas = FigureCanvasAgg(fig)
+    fig.text(0.5, 0.5, text, ha="center", va="center", fontsize=fontsize, color="black")
+    canvas.draw()
+
+    rgba = np.asarray(canvas.buffer_rgba())[:height, :width]
+    coverage = 1 - rgba[..., 0].astype(np.float32) / 255
+    coverage.setflags(write=False)
+    return coverage
+
+
+class FrameRenderer:
+
+    def __init__(self, frame_shape, size=(500, 500), aspect="auto", cmap="gray", vmin=None, vmax=None, title=None,
+                 caption_height=None, fontsize=12, background_colour=255):
+        """
+        Render ultrasound frames of a given shape as RGB images.
+        :param frame_shape: the shape of each frame, e.g., ult_3d.shape[1:]
+        :param size: (width, height) of the images in pixels. Keep them even for video codecs such as mpeg4 and h264.
+        :param aspect: see get_frame_index_map
+        :param cmap: a matplotlib colormap name
+        :param vmin: the value mapped to the lowest colour. As with imshow, vmin and vmax default to the range of the
+         first frame rendered.
+        :param vmax: the value mapped to the highest colour
+        :param title: an optional caption, burnt in above the frame
+        :param caption_height: in pixels. Defaults to a tenth of the height.
+        :param fontsize:
+        :param background_colour: of the caption band and of the margins, black = 0 and white = 255
+        """
+        self.frame_shape = tuple(frame_shape)
+        self.width, self.height = size
+        self.cmap = cmap
+        self.vmin = vmin
+        self.vmax = vmax
+
+        self.background = np.full((self.height, self.width, 3), background_colour, dtype=np.uint8)
+
+        top = 0
+        if title:
+            top = caption_height or max(self.height // 10, 1)
+            coverage = get_caption_bitmap(title, self.width, top, fontsize=fontsize)
+            self.background[:top] = np.rint(background_colour * (1 - coverage))[..., np.newaxis]
+
+        self.index_map, (offset_top, left) = get_frame_index_map(self.frame_shape, (self.height - top, self.width),
+                                                                 aspect=aspect)
+        scaled_height, scaled_width = self.index_map.shape
+        self.rows = slice(top + offset_top, top + offset_top + scaled_height)
+        self.cols = slice(left, left + scaled_width)
+
+    def _get_pixels(self, frames):
+        """
+        Map frames to uint8 colormap indices, so that a single 256 entry LUT serves any dtype.
+        :param frames: array of shape (number of frames, ) + frame_shape
+        :return: uint8 array of shape (number of frames, number of frame pixels), and the LUT
+        """
+        frames = np.asarray(frames)
+        if self.vmin is None or self.vmax is None:
+            first = np.asarray(frames[0])
+            self.vmin = float(first.min()) if self.vmin is None else self.vmin
+            self.vmax = float(first.max()) if self.vmax is None else self.vmax
+
+        flat = frames.reshape(len(frames), -1)
+        if flat.dtype == np.uint8:
+            return flat, get_colormap_lut(self.cmap, float(self.vmin), float(self.vmax))
+
+        scale = 255 / max(self.vmax - self.vmin, np.finfo(np.float64).eps)
+        pixels = np.clip((flat - self.vmin) * scale, 0, 255).astype(np.uint8)
+        return pixels, get_colormap_lut(self.cmap)
+
+    def render_batch(self, frames, out=None):
+        """
+        Render a batch of frames.
+        :param frames: array of shape (number of frames, ) + frame_shape, e.g., a slice of ult_3d
+        :param out: optionally, a uint8 array of shape (number of frames, height, width, 3) to render into
+        :return: uint8 array of shape (number of frames, height, width, 3)
+        """
+        if tuple(np.shape(frames)[1:]) != self.frame_shape:
+            raise ValueError("Expected frames of shape %s, got %s" % (self.frame_shape, np.shape(frames)[1:]))
+
+        pixels, lut = self._get_pixels(frames)
+
+        if out is None:
+            out = np.empty((len(pixels), self.height, self.width, 3), dtype=np.uint8)
+
+        # only the caption and the margins around the frame show the background
+        out[:, :self.rows.start] = self.background[:self.rows.start]
+        out[:, self.rows.stop:] = self.background[self.rows.stop:]
+        out[:, self.rows, :self.cols.start] = self.background[self.rows, :self.cols.start]
+        out[:, self.rows, self.cols.stop:] = self.background[self.rows, self.cols.stop:]
+
+        np.take(lut, pixels[:, self.index_map], axis=0, out=out[:, self.rows, self.cols])
+        return out
+
+    def render(self, frame):
+        """
+        Render a single frame.
+        :param frame: array of shape frame_shape
+        :return: uint8 array of shape (height, width, 3)
+        """
+        return self.render_batch(np.asarray(frame)[np.newaxis])[0]
+
+    def iter_frames(self, ult_3d, batch_size=32):
+        """
+        Render frames in batches, e.g., to stream them into a video encoder.
+        :param ult_3d: array of frames, e.g., a memmap
+        :param batch_size:
+        :return: a generator of uint8 arrays of shape (height, width, 3). Each array is only valid until the next one is
+         requested, since the batch buffer is reused.
+        """
+        buffer = None
+        for start in range(0, len(ult_3d), batch_size):
+            batch = ult_3d[start:start + batch_size]
+            if buffer is None or len(buffer) != len(batch):
+                buffer = np.empty((len(batch), self.height, self.width, 3), dtype=np.uint8)
+            for image in self.render_batch(batch, out=buffer):
+                yield image
+
+
+def write_png(filename, image, compression=6):
+    """
+    Write an RGB or grayscale image as a PNG file.
+    :param filename:
+    :param image: uint8 array of shape (height, width, 3) or (height, width)
+    :param compression: zlib compression level, from 0 to 9
+    :return:
+    """
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    colour_type = 2 if image.ndim == 3 else 0
+
+    # each row is preceded by its filter type, 0 (none)
+    rows = np.zeros((height, 1 + image[0].size), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, colour_type, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), compression)))
+        f.write(chunk(b"IEND", b""))
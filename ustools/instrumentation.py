@@ -0,0 +1,198 @@
+"""
+Stage-level instrumentation for UltraSuiteCore.process, Chunk and the corpus runner.
+
+An Instrumentation object records, for each processing stage, the wall and CPU time and the shapes and bytes of the
+signals before and after the stage. Hooks wrap every stage, so that a profiler (see CProfileHook) or any other context
+can be attached without changing the processing code. Records from many utterances, e.g., from a corpus run, are
+aggregated per stage (and per dataset) with summarise, and exported with write_json.
+
+Date: Oct 2026
+
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import time
+from contextlib import contextmanager, ExitStack
+
+import numpy as np
+
+
+def get_array_info(usage):
+    """
+    Keep the shape, dtype and bytes of each array of a memory.get_memory_usage report.
+    :param usage:
+    :return: a dictionary mapping each non-empty array to its shape, dtype and nbytes
+    """
+    return {name: {"shape": list(info["shape"]), "dtype": info["dtype"], "nbytes": info["nbytes"]}
+            for name, info in usage.items()
+            if isinstance(info, dict) and info["nbytes"] != 0}
+
+
+class Instrumentation:
+
+    def __init__(self, enabled=True, hooks=(), labels=None):
+        """
+        Record the time and data sizes of each processing stage.
+        :param enabled: if False, nothing is recorded
+        :param hooks: callables which take a stage name and return a context manager which is entered around the
+         stage, e.g., CProfileHook()
+        :param labels: a dictionary added to every record, e.g., {"utterance_id": ..., "dataset": ...}
+        """
+        self.enabled = enabled
+        self.hooks = list(hooks)
+        self.labels = dict(labels or {})
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, usage_func=None):
+        """
+        Instrument a stage, e.g.:
+
+            with instrumentation.stage("transform_ult", core.memory_usage):
+                core.transform_ult()
+
+        :param name: the name of the stage
+        :param usage_func: optionally, a function returning memory.get_memory_usage of the object being processed,
+         which is called before and after the stage to record the shapes and bytes of its input and output
+        :return:
+        """
+        if not self.enabled:
+            yield
+            return
+
+        record = dict(self.labels)
+        record["stage"] = name
+        if usage_func is not None:
+            record["input"] = get_array_info(usage_func())
+
+        with ExitStack() as hooks:
+            for hook in self.hooks:
+                hooks.enter_context(hook(name))
+
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            try:
+                yield
+            finally:
+                record["wall_seconds"] = time.perf_counter() - wall_start
+                record["cpu_seconds"] = time.process_time() - cpu_start
+
+        if usage_func is not None:
+            record["output"] = get_array_info(usage_func())
+            record["input_bytes"] = sum(info["nbytes"] for info in record["input"].values())
+            record["output_bytes"] = sum(info["nbytes"] for info in record["output"].values())
+
+        self.records.append(record)
+
+    def get_total_seconds(self):
+        return sum(record["wall_seconds"] for record in self.records)
+
+    def report(self):
+        """
+        A human readable table of the recorded stages.
+        :return: string
+        """
+        lines = ["%-28s %10s %10s %14s" % ("stage", "wall (s)", "cpu (s)", "output bytes")]
+        for record in self.records:
+            lines.append("%-28s %10.3f %10.3f %14d" % (record["stage"], record["wall_seconds"], record["cpu_seconds"],
+                                                       record.get("output_bytes", 0)))
+        return "\n".join(lines)
+
+
+@contextmanager
+def track_stage(name, memory_tracker, instrumentation, usage_func=None):
+    """
+    Track the memory of a processing stage and instrument it, e.g., in UltraSuiteCore.process and Chunk.
+    :param name: the name of the stage
+    :param memory_tracker: a memory.MemoryTracker
+    :param instrumentation: an Instrumentation
+    :param usage_func: see Instrumentation.stage
+    :return:
+    """
+    with memory_tracker.stage(name, usage_func):
+        with instrumentation.stage(name, usage_func):
+            yield
+
+
+def summarise(records, by=("stage",)):
+    """
+    Aggregate stage records, e.g., from the utterances of a corpus run.
+    :param records: a list of records, as in Instrumentation.records
+    :param by: the record keys to group by, e.g., ("dataset", "stage")
+    :return: a list of dictionaries, one per group, sorted by decreasing total wall time, containing the group keys, the
+     count, the total, mean and maximum wall time, the total CPU time and the mean output bytes
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(tuple(record.get(key) for key in by), []).append(record)
+
+    summary = []
+    for key, group in groups.items():
+        wall = np.array([record["wall_seconds"] for record in group])
+        entry = dict(zip(by, key))
+        entry.update({"count": len(group),
+                      "wall_seconds": float(wall.sum()),
+                      "mean_wall_seconds": float(wall.mean()),
+                      "max_wall_seconds": float(wall.max()),
+                      "cpu_seconds": float(sum(record["cpu_seconds"] for record in group)),
+                      "mean_output_bytes": float(np.mean([record.get("output_bytes", 0) for record in group]))})
+        summary.append(entry)
+
+    return sorted(summary, key=lambda entry: -entry["wall_seconds"])
+
+
+def write_json(filename, records, by=("stage",)):
+    """
+    Export stage records and their summary as JSON.
+    :param filename:
+    :param records:
+    :param by: the keys to summarise by, see summarise
+    :return:
+    """
+    with open(filename, "w") as f:
+        json.dump({"summary": summarise(records, by=by), "records": records}, f, indent=1)
+
+
+class CProfileHook:
+
+    def __init__(self, stages=None):
+        """
+        A hook which profiles stages with cProfile, accumulating one profile per stage name, e.g.:
+
+            hook = CProfileHook(stages=["transform_ult"])
+            core.process(transform_ult=True, instrumentation=Instrumentation(hooks=[hook]))
+            hook.print_stats("transform_ult")
+
+        :param stages: the names of the stages to profile. Defaults to all stages.
+        """
+        self.stages = stages
+        self.profiles = {}
+
+    @contextmanager
+    def __call__(self, name):
+        if self.stages is not None and name not in self.stages:
+            yield
+            return
+
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def print_stats(self, name, sort="cumulative", limit=20):
+        pstats.Stats(self.profiles[name]).sort_stats(sort).print_stats(limit)
+
+    def dump(self, directory):
+        """
+        Write one .prof file per stage, which can be read with pstats or snakeviz.
+        :param directory:
+        :return:
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(directory, name + ".prof"))
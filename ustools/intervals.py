@@ -0,0 +1,189 @@
+"""
+Sets of half-open integer intervals [start, stop), used as keep-masks over the samples of a wav or the frames of an
+ultrasound. Masks are composed with set operations and applied with a single gather, instead of one np.delete per
+region.
+
+Date: Oct 2026
+
+"""
+
+import numpy as np
+
+
+class IntervalSet:
+
+    def __init__(self, starts=(), stops=()):
+        """
+        Create a set of half-open intervals [start, stop). The intervals may be given in any order and may overlap;
+        they are sorted and merged, and empty intervals are dropped.
+        :param starts:
+        :param stops:
+        """
+        starts = np.asarray(starts, dtype=np.int64).ravel()
+        stops = np.asarray(stops, dtype=np.int64).ravel()
+        if starts.shape != stops.shape:
+            raise ValueError("The number of starts and stops differ")
+
+        non_empty = stops > starts
+        self.starts, self.stops = self._sweep(starts[non_empty], stops[non_empty], min_count=1)
+
+    @classmethod
+    def _from_normalised(cls, starts, stops):
+        interval_set = cls.__new__(cls)
+        interval_set.starts = starts
+        interval_set.stops = stops
+        return interval_set
+
+    @staticmethod
+    def _sweep(starts, stops, min_count):
+        """
+        Find the intervals covered by at least min_count of the given intervals.
+        :return: sorted, disjoint and non-adjacent starts and stops
+        """
+        points = np.concatenate((starts, stops))
+        deltas = np.concatenate((np.ones(len(starts), dtype=np.int64), -np.ones(len(stops), dtype=np.int64)))
+
+        # at equal points, starts are counted before stops so that adjacent intervals merge
+        order = np.lexsort((-deltas, points))
+        points = points[order]
+        inside = np.cumsum(deltas[order]) >= min_count
+        entering = inside & ~np.concatenate(([False], inside[:-1]))
+        leaving = ~inside & np.concatenate(([False], inside[:-1]))
+
+        new_starts = points[entering]
+        new_stops = points[leaving]
+        non_empty = new_stops > new_starts
+        return new_starts[non_empty], new_stops[non_empty]
+
+    @classmethod
+    def from_mask(cls, mask):
+        """
+        Create the set of intervals where a boolean mask is True.
+        :param mask: 1d boolean array
+        :return:
+        """
+        edges = np.diff(np.concatenate(([False], np.asarray(mask, dtype=bool), [False])).view(np.int8))
+        return cls._from_normalised(np.flatnonzero(edges == 1).astype(np.int64),
+                                    np.flatnonzero(edges == -1).astype(np.int64))
+
+    @classmethod
+    def from_inclusive(cls, regions):
+        """
+        Create a set from (start, end) regions with inclusive ends, as returned by segment_signal.get_zero_regions.
+        :param regions:
+        :return:
+        """
+        regions = np.asarray(regions, dtype=np.int64).reshape(-1, 2)
+        return cls(regions[:, 0], regions[:, 1] + 1)
+
+    @classmethod
+    def full(cls, length):
+        """
+        The interval [0, length).
+        :param length:
+        :return:
+        """
+        return cls([0], [length])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts.tolist(), self.stops.tolist())
+
+    def __eq__(self, other):
+        return np.array_equal(self.starts, other.starts) and np.array_equal(self.stops, other.stops)
+
+    def __repr__(self):
+        return "IntervalSet(" + ", ".join("[%d, %d)" % interval for interval in self) + ")"
+
+    def size(self):
+        """
+        The number of samples in the set.
+        :return:
+        """
+        return int(np.sum(self.stops - self.starts))
+
+    def union(self, other):
+        return self._from_normalised(*self._sweep(np.concatenate((self.starts, other.starts)),
+                                                  np.concatenate((self.stops, other.stops)), min_count=1))
+
+    def intersection(self, other):
+        # both sets are disjoint internally, so a point covered twice is in both
+        return self._from_normalised(*self._sweep(np.concatenate((self.starts, other.starts)),
+                                                  np.concatenate((self.stops, other.stops)), min_count=2))
+
+    def complement(self, length):
+        """
+        The samples in [0, length) which are not in the set.
+        :param length:
+        :return:
+        """
+        clipped = self.clip(0, length)
+        return IntervalSet(np.concatenate(([0], clipped.stops)), np.concatenate((clipped.starts, [length])))
+
+    def difference(self, other, length=None):
+        if length is None:
+            length = max(int(self.stops[-1]) if len(self) else 0, int(other.stops[-1]) if len(other) else 0)
+        return self.intersection(other.complement(length))
+
+    def clip(self, start, stop):
+        """
+        The part of the set within [start, stop).
+        :param start:
+        :param stop:
+        :return:
+        """
+        return IntervalSet(np.clip(self.starts, start, stop), np.clip(self.stops, start, stop))
+
+    def shift(self, offset):
+        return self._from_normalised(self.starts + offset, self.stops + offset)
+
+    def convert_rate(self, from_rate, to_rate):
+        """
+        Convert the intervals from one sampling rate to another, e.g., from wav samples to ult frames. The first and
+        last sample of each interval are each mapped to the nearest sample at the new rate.
+        :param from_rate:
+        :param to_rate:
+        :return:
+        """
+        ratio = to_rate / from_rate
+        return IntervalSet(np.rint(self.starts * ratio).astype(np.int64),
+                           np.rint((self.stops - 1) * ratio).astype(np.int64) + 1)
+
+    def to_mask(self, length):
+        """
+        A boolean mask of length samples which is True inside the set.
+        :param length:
+        :return:
+        """
+        edges = np.zeros(length + 1, dtype=np.int8)
+        clipped = self.clip(0, length)
+        np.add.at(edges, clipped.starts, 1)
+        np.add.at(edges, clipped.stops, -1)
+        return np.cumsum(edges[:-1]) > 0
+
+    def apply(self, array, axis=0):
+        """
+        Keep only the parts of an array inside the set, with a single gather. Intervals beyond the end of the array are
+        clipped. If the set keeps a single contiguous range, a view is returned without copying.
+        :param array:
+        :param axis:
+        :return:
+        """
+        clipped = self.clip(0, array.shape[axis])
+        index = [slice(None)] * array.ndim
+
+        if len(clipped) == 1:
+            index[axis] = slice(int(clipped.starts[0]), int(clipped.stops[0]))
+            return array[tuple(index)]
+
+        if len(clipped) == 0:
+            index[axis] = slice(0, 0)
+            return np.array(array[tuple(index)])
+
+        pieces = []
+        for start, stop in clipped:
+            index[axis] = slice(start, stop)
+            pieces.append(array[tuple(index)])
+        return np.concatenate(pieces, axis=axis)
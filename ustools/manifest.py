@@ -0,0 +1,241 @@
+"""
+A persistent corpus manifest with one row per utterance, stored in an SQLite database.
+
+Each row holds the directory information (dataset, speaker, session), the parsed parameter file, the prompt, the number
+of ult frames and wav samples, and the size and modification time of each of the four files. Rescanning is incremental:
+only utterances whose files have changed in size or modification time are re-read, and only their prompt and parameter
+files and wav header are parsed.
+
+Date: Oct 2026
+
+"""
+
+import os
+import sqlite3
+
+import pandas as pd
+
+from ustools.core import UltraSuiteCore
+from ustools.folder_utils import get_dir_info, get_utterance_id_from_path
+
+EXTENSIONS = (".txt", ".wav", ".param", ".ult")
+
+PARAM_COLUMNS = ("kind", "num_scanlines", "size_scanline", "zero_offset", "angle", "bits_per_pixel", "pixel_per_mm",
+                 "ult_fps", "sync", "wav_fps")
+
+FILE_COLUMNS = tuple(ext[1:] + "_" + stat for ext in EXTENSIONS for stat in ("size", "mtime"))
+
+COLUMNS = (("path", "TEXT PRIMARY KEY"),
+           ("utterance_id", "TEXT"),
+           ("dataset", "TEXT"),
+           ("speaker", "TEXT"),
+           ("session", "TEXT"),
+           ("basename", "TEXT"),
+           ("dirname", "TEXT"),
+           ("prompt", "TEXT"),
+           ("datetime", "TEXT")) + \
+          tuple((name, "REAL") for name in PARAM_COLUMNS) + \
+          (("num_ult_frames", "INTEGER"),
+           ("num_wav_samples", "INTEGER"),
+           ("wav_duration", "REAL"),
+           ("ult_duration", "REAL"),
+           ("duration", "REAL")) + \
+          tuple((name, "INTEGER") for name in FILE_COLUMNS)
+
+
+def scan_utterance_files(root_dir):
+    """
+    A generator over the .ult files under a directory, using os.scandir so that the file stats come with the listing.
+    :param root_dir:
+    :return: (dirpath, basename) tuples
+    """
+    stack = [root_dir]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            entries = list(os.scandir(dirpath))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.name.endswith(".ult"):
+                yield dirpath, entry.name[:-len(".ult")]
+
+
+def get_file_signature(dirpath, basename):
+    """
+    Get the size and modification time of each of the four files of an utterance.
+    :param dirpath:
+    :param basename:
+    :return: a dictionary keyed on FILE_COLUMNS, or None if one of the files is missing
+    """
+    signature = {}
+    for ext in EXTENSIONS:
+        try:
+            stat = os.stat(os.path.join(dirpath, basename + ext))
+        except OSError:
+            return None
+        signature[ext[1:] + "_size"] = stat.st_size
+        signature[ext[1:] + "_mtime"] = stat.st_mtime_ns
+    return signature
+
+
+def read_utterance_row(dirpath, basename):
+    """
+    Read the metadata of an utterance without reading the wav or ult signals.
+    :param dirpath:
+    :param basename:
+    :return: a dictionary keyed on the manifest columns
+    """
+    core = UltraSuiteCore(dirpath, basename, lazy=True)
+    durations = core.estimate_duration()
+    dir_info = get_dir_info(dirpath)
+
+    # the synchronised duration: the wav is cropped when the sync is positive and the ult when it is negative
+    duration = min(durations["wav_duration"] - max(core.params['sync'], 0),
+                   durations["ult_duration"] - max(-core.params['sync'], 0))
+
+    row = {"path": os.path.join(os.path.abspath(dirpath), basename),
+           "utterance_id": get_utterance_id_from_path(dirpath, basename),
+           "dataset": dir_info["dataset"],
+           "speaker": dir_info["speaker"],
+           "session": dir_info["session"],
+           "basename": basename,
+           "dirname": os.path.abspath(dirpath),
+           "prompt": core.prompt,
+           "datetime": core.datetime.isoformat(),
+           "duration": max(duration, 0)}
+    row.update({name: core.params[name] for name in PARAM_COLUMNS})
+    row.update(durations)
+    return row
+
+
+class CorpusManifest:
+
+    def __init__(self, manifest_file):
+        """
+        Open (or create) a manifest.
+        :param manifest_file: the SQLite database file
+        """
+        self.manifest_file = manifest_file
+        self.connection = sqlite3.connect(manifest_file)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS utterances (" +
+                                ", ".join(name + " " + kind for name, kind in COLUMNS) + ")")
+        for name in ("dataset", "speaker", "duration"):
+            self.connection.execute("CREATE INDEX IF NOT EXISTS utterances_" + name + " ON utterances (" + name + ")")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM utterances").fetchone()[0]
+
+    def update(self, root_dir, verbose=False):
+        """
+        Scan a directory and bring the manifest up to date. Only utterances which are new or whose files changed in
+        size or modification time are re-read. Rows for utterances under root_dir which no longer exist are removed.
+        :param root_dir:
+        :param verbose: print each utterance that is (re-)read
+        :return: a dictionary counting the added, updated, unchanged, removed and failed utterances
+        """
+        root = os.path.join(os.path.abspath(root_dir), "")
+        stored = {path: tuple(values) for path, *values in self.connection.execute(
+            "SELECT path, " + ", ".join(FILE_COLUMNS) + " FROM utterances WHERE path LIKE ? ESCAPE '\\'",
+            (root.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%",))}
+
+        counts = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        seen = set()
+        insert = ("INSERT OR REPLACE INTO utterances (" + ", ".join(name for name, _ in COLUMNS) + ") VALUES (" +
+                  ", ".join("?" for _ in COLUMNS) + ")")
+
+        with self.connection:
+            for dirpath, basename in scan_utterance_files(root_dir):
+                path = os.path.join(os.path.abspath(dirpath), basename)
+                signature = get_file_signature(dirpath, basename)
+                if signature is None:
+                    continue
+                seen.add(path)
+
+                if stored.get(path) == tuple(signature[name] for name in FILE_COLUMNS):
+                    counts["unchanged"] += 1
+                    continue
+
+                if verbose:
+                    print(path)
+
+                try:
+                    row = read_utterance_row(dirpath, basename)
+                except (OSError, ValueError, KeyError) as e:
+                    print("Failed to read", path + ":", e)
+                    counts["failed"] += 1
+                    continue
+
+                row.update(signature)
+                self.connection.execute(insert, tuple(row[name] for name, _ in COLUMNS))
+                counts["updated" if path in stored else "added"] += 1
+
+            removed = [(path,) for path in stored if path not in seen]
+            self.connection.executemany("DELETE FROM utterances WHERE path = ?", removed)
+            counts["removed"] = len(removed)
+
+        return counts
+
+    def query(self, dataset=None, speaker=None, session=None, min_duration=None, max_duration=None, where=None,
+              params=()):
+        """
+        Query the manifest. All filters are optional and combined with AND.
+        :param dataset: e.g., "uxtd", or a list of datasets
+        :param speaker: e.g., "01M", or a list of speakers
+        :param session: e.g., "BL1", or a list of sessions
+        :param min_duration: minimum synchronised duration in seconds
+        :param max_duration: maximum synchronised duration in seconds
+        :param where: an additional SQL condition, e.g., "ult_fps > 100"
+        :param params: the parameters of the additional SQL condition
+        :return: a pandas data frame with one row per utterance
+        """
+        conditions = []
+        values = []
+
+        for name, value in (("dataset", dataset), ("speaker", speaker), ("session", session)):
+            if value is None:
+                continue
+            if isinstance(value, str):
+                value = [value]
+            conditions.append(name + " IN (" + ", ".join("?" for _ in value) + ")")
+            values.extend(value)
+
+        if min_duration is not None:
+            conditions.append("duration >= ?")
+            values.append(min_duration)
+
+        if max_duration is not None:
+            conditions.append("duration <= ?")
+            values.append(max_duration)
+
+        if where:
+            conditions.append("(" + where + ")")
+            values.extend(params)
+
+        sql = "SELECT * FROM utterances"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY path"
+
+        return pd.read_sql_query(sql, self.connection, params=values)
+
+    def get_utterance_files(self, **kwargs):
+        """
+        Like folder_utils.get_all_utterance_files, but from the manifest. Accepts the same filters as query.
+        :return: a list of (dirname, basename + ".ult") tuples
+        """
+        df = self.query(**kwargs)
+        return [(dirname, basename + ".ult") for dirname, basename in zip(df["dirname"], df["basename"])]
@@ -0,0 +1,181 @@
+"""
+Memory accounting for the arrays held by UltraSuiteCore and Chunk, and per-stage peak memory tracking.
+
+get_memory_usage reports the bytes held by each array attribute of an object. Arrays which are views of the same buffer
+are reported as shared and counted once in the total, and memory-mapped arrays are reported separately, since their
+pages belong to the file and can be dropped by the operating system.
+
+MemoryTracker records the peak memory allocated during each processing stage with tracemalloc, which numpy reports
+its array allocations to.
+
+Date: Oct 2026
+
+"""
+
+import mmap
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def get_buffer_owner(a):
+    """
+    Follow the chain of bases of an array to the object which owns its memory. Strided views (see
+    segment_signal.get_windows) have an intermediate base which is not an array, but which has a base of its own.
+    :param a: numpy array
+    :return: an array which owns its data, or the underlying buffer (e.g., an mmap.mmap)
+    """
+    while getattr(a, "base", None) is not None:
+        a = a.base
+    return a
+
+
+def is_memory_mapped(a):
+    """
+    Whether an array is, or is a view of, a memory-mapped file.
+    :param a: numpy array
+    :return:
+    """
+    return isinstance(a, np.memmap) or isinstance(get_buffer_owner(a), mmap.mmap)
+
+
+def get_owner_nbytes(owner):
+    if isinstance(owner, np.ndarray):
+        return owner.nbytes
+    return memoryview(owner).nbytes
+
+
+def get_memory_usage(arrays):
+    """
+    Report the memory held by a set of named arrays.
+    :param arrays: a dictionary mapping names to arrays. Values which are not arrays are ignored.
+    :return: a dictionary with one entry per array (shape, dtype, nbytes, mapped, and shared: the names of the other
+     arrays which are views of the same buffer), and the totals: "resident_bytes", the bytes of the distinct in-memory
+     buffers, and "mapped_bytes", the bytes of the distinct memory-mapped buffers.
+    """
+    usage = {}
+    owners = {}  # id(owner) -> (owner, names)
+
+    for name, a in arrays.items():
+        if not isinstance(a, np.ndarray):
+            continue
+        owner = get_buffer_owner(a)
+        owners.setdefault(id(owner), (owner, []))[1].append(name)
+        usage[name] = {"shape": a.shape,
+                       "dtype": str(a.dtype),
+                       "nbytes": a.nbytes,
+                       "mapped": is_memory_mapped(a)}
+
+    for owner, names in owners.values():
+        for name in names:
+            usage[name]["shared"] = [other for other in names if other != name]
+
+    usage["resident_bytes"] = sum(get_owner_nbytes(owner) for owner, names in owners.values()
+                                  if not usage[names[0]]["mapped"])
+    usage["mapped_bytes"] = sum(get_owner_nbytes(owner) for owner, names in owners.values()
+                                if usage[names[0]]["mapped"])
+    return usage
+
+
+def format_bytes(num_bytes):
+    """
+    e.g., 1536 -> "1.5 KiB"
+    :param num_bytes:
+    :return:
+    """
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(num_bytes) < 1024 or unit == "GiB":
+            return ("%d %s" if unit == "B" else "%.1f %s") % (num_bytes, unit)
+        num_bytes /= 1024
+
+
+class MemoryTracker:
+
+    def __init__(self, enabled=True, use_tracemalloc=True):
+        """
+        Record the memory used by each processing stage.
+        :param enabled: if False, no memory is tracked
+        :param use_tracemalloc: if True, the peak allocation of each stage is traced with tracemalloc, which is started
+         for the duration of the outermost stage if it is not already running. Otherwise only the memory held after
+         each stage is recorded.
+        """
+        self.enabled = enabled
+        self.use_tracemalloc = use_tracemalloc
+        self.stages = []
+        self._open = []  # the stages in progress, outermost first
+
+    def _fold_peak(self):
+        """
+        tracemalloc has a single peak counter, which each stage resets. Before resetting it, fold the peak so far into
+        every stage in progress, so that nested stages do not hide the peaks of the stages around them.
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        for stage in self._open:
+            stage["peak_bytes"] = max(stage["peak_bytes"], peak - stage["start_bytes"])
+        return current
+
+    @contextmanager
+    def stage(self, name, usage_func=None):
+        """
+        Track a stage, e.g.:
+
+            with tracker.stage("transform_ult", core.memory_usage):
+                core.transform_ult()
+
+        :param name: the name of the stage
+        :param usage_func: optionally, a function returning get_memory_usage of the object being processed, which is
+         called after the stage to record the memory it holds
+        :return:
+        """
+        if not self.enabled:
+            yield
+            return
+
+        record = {"stage": name, "peak_bytes": 0, "retained_bytes": 0, "start_bytes": 0}
+        started = False
+
+        if self.use_tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started = True
+            record["start_bytes"] = self._fold_peak()
+            tracemalloc.reset_peak()
+            self._open.append(record)
+
+        try:
+            yield
+        finally:
+            if self.use_tracemalloc:
+                current = self._fold_peak()
+                self._open.remove(record)
+                record["retained_bytes"] = current - record["start_bytes"]
+                if started:
+                    tracemalloc.stop()
+            del record["start_bytes"]
+
+            if usage_func is not None:
+                usage = usage_func()
+                record["resident_bytes"] = usage["resident_bytes"]
+                record["mapped_bytes"] = usage["mapped_bytes"]
+
+            self.stages.append(record)
+
+    def get_peak(self):
+        """
+        The largest peak over all recorded stages.
+        :return:
+        """
+        return max([stage["peak_bytes"] for stage in self.stages] or [0])
+
+    def report(self):
+        """
+        A human readable table of the recorded stages.
+        :return: string
+        """
+        lines = ["%-28s %12s %12s %12s" % ("stage", "peak", "retained", "resident")]
+        for stage in self.stages:
+            lines.append("%-28s %12s %12s %12s" % (stage["stage"], format_bytes(stage["peak_bytes"]),
+                                                   format_bytes(stage["retained_bytes"]),
+                                                   format_bytes(stage.get("resident_bytes", 0))))
+        return "\n".join(lines)
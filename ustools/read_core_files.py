@@ -15,6 +15,7 @@ Author: Aciel Eshky
 """
 
 import io
+import struct
 from datetime import datetime
 import numpy as np
 import pandas as pd
@@ -86,3 +87,38 @@ def read_wav_file(wave_file):
     return wavfile.read(wave_file)
 
 
+def read_wav_header(wave_file):
+    """
+    A function to read the header of a wave file without reading the samples.
+
+    :param wave_file: .wav file
+    :return: a dictionary containing the sample rate, the number of channels, the bits per sample and the number of
+     samples (per channel)
+    """
+    with open(wave_file, "rb") as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff not in (b'RIFF', b'RIFX') or wave != b'WAVE':
+            raise ValueError("Not a wave file: " + str(wave_file))
+        endian = '<' if riff == b'RIFF' else '>'
+
+        header = {}
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError("No data chunk found in wave file: " + str(wave_file))
+            chunk_id, chunk_size = struct.unpack(endian + '4sI', chunk_header)
+
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                _, channels, sample_rate, _, _, bits_per_sample = struct.unpack(endian + 'HHIIHH', fmt[:16])
+                header = {"sample_rate": sample_rate, "channels": channels, "bits_per_sample": bits_per_sample}
+                f.seek(chunk_size % 2, 1)
+
+            elif chunk_id == b'data':
+                if not header:
+                    raise ValueError("No fmt chunk found before the data chunk in wave file: " + str(wave_file))
+                header["num_samples"] = chunk_size // (header["channels"] * header["bits_per_sample"] // 8)
+                return header
+
+            else:
+                f.seek(chunk_size + chunk_size % 2, 1)
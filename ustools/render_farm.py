@@ -0,0 +1,211 @@
+"""
+A batch renderer of utterance videos, e.g., to review whole sessions or datasets.
+
+Utterances are rendered in a pool of worker processes (see corpus_runner.run_jobs), one video per utterance, with the
+frames streamed into ffmpeg (see animate_utterance.create_video). Each job works in a private temporary directory next
+to its output and moves the finished video into place with a single rename, so concurrent jobs never share files and an
+interrupted job never leaves a partial video behind. Videos which are newer than all four files of their utterance are
+skipped, so a batch can be re-run after adding or changing utterances. Failures are collected and reported at the end
+without stopping the batch.
+
+    python -m ustools.render_farm /path/to/data /path/to/videos --dataset uxtd --workers 4
+
+Date: Oct 2026
+
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from scipy.io import wavfile
+
+from ustools.animate_utterance import create_video
+from ustools.core import UltraSuiteCore
+from ustools.corpus_runner import make_jobs, run_jobs
+from ustools.folder_utils import get_all_utterance_files
+from ustools.manifest import CorpusManifest, EXTENSIONS
+
+DEFAULT_PROCESS_KWARGS = {"apply_sync": True, "transform_ult": True}
+
+# audio codecs which every ffmpeg build has, for the containers they fit
+AUDIO_CODECS = {".avi": "pcm_s16le", ".mkv": "pcm_s16le", ".mov": "pcm_s16le", ".mp4": "aac"}
+
+
+def render_utterance(directory, basename, output_file, process_kwargs=None, aspect='equal', dpi=100,
+                     encoder_kwargs=None):
+    """
+    Render a single utterance as a video with its audio.
+    :param directory: the directory containing the files
+    :param basename: base file name without extension
+    :param output_file: the video file, e.g., with an .avi or .mp4 extension
+    :param process_kwargs: keyword arguments to UltraSuiteCore.process. Defaults to DEFAULT_PROCESS_KWARGS, which
+     synchronises the signals and transforms the ultrasound to world coordinates.
+    :param aspect:
+    :param dpi: the video is 5 by 5 inches at this resolution
+    :param encoder_kwargs: passed to animate_utterance.get_ffmpeg_command. The audio codec defaults to AUDIO_CODECS.
+    :return: a dictionary with the number of frames and the duration of the video in seconds
+    """
+    core = UltraSuiteCore(directory, basename)
+    core.process(**(DEFAULT_PROCESS_KWARGS if process_kwargs is None else process_kwargs))
+
+    ult = core.ult_t if core.params['ult_transformed'] else core.ult
+    if len(ult) == 0 or len(core.wav) == 0:
+        raise ValueError("Nothing to render: " + os.path.join(directory, basename))
+
+    extension = os.path.splitext(output_file)[1].lower()
+    encoder_kwargs = dict(encoder_kwargs or {})
+    encoder_kwargs.setdefault("audio_codec", AUDIO_CODECS.get(extension))
+
+    # the workspace is next to the output, so that the finished video can be moved into place with a rename
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    os.makedirs(output_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix=".render-", dir=output_dir) as workspace:
+        audio_file = os.path.join(workspace, "audio.wav")
+        video_file = os.path.join(workspace, "video" + extension)
+
+        wavfile.write(audio_file, core.params['wav_fps'], core.wav)
+        create_video(ult, core.params['ult_fps'], video_file, title=core.prompt, aspect=aspect, audio_file=audio_file,
+                     dpi=dpi, **encoder_kwargs)
+        os.replace(video_file, output_file)
+
+    return {"num_frames": len(ult), "duration": len(ult) / core.params['ult_fps']}
+
+
+def is_up_to_date(job):
+    """
+    Whether the output of a job exists and is newer than the files of its utterance.
+    :param job: a job dictionary, see corpus_runner.make_jobs
+    :return:
+    """
+    try:
+        output_mtime = os.path.getmtime(job["output_file"])
+        input_mtime = max(os.path.getmtime(os.path.join(job["directory"], job["basename"] + ext)) for ext in EXTENSIONS)
+    except OSError:  # no output yet, or a missing input, which the job itself will report
+        return False
+    return output_mtime >= input_mtime
+
+
+def render_corpus(utterances, output_dir, extension=".avi", process_kwargs=None, aspect='equal', dpi=100,
+                  encoder_kwargs=None, workers=None, max_in_flight=None, force=False):
+    """
+    Render a list of utterances in parallel. This is a generator: results are yielded as they are delivered, starting
+    with the skipped utterances.
+
+    :param utterances: (directory, basename) tuples, e.g., from folder_utils.get_all_utterance_files or
+     manifest.CorpusManifest.get_utterance_files
+    :param output_dir: the directory to write the videos to, named after the utterance ids
+    :param extension: of the videos, which selects the container
+    :param process_kwargs: see render_utterance
+    :param aspect: see render_utterance
+    :param dpi: see render_utterance
+    :param encoder_kwargs: see render_utterance
+    :param workers: the number of worker processes. Defaults to the number of available CPUs.
+    :param max_in_flight: see corpus_runner.run_jobs
+    :param force: if True, videos which are up to date are rendered again
+    :return: result dictionaries with the keys utterance_id, directory, basename, output_file, status ("done", "failed"
+     or "skipped"), seconds and either result or error
+    """
+    jobs = make_jobs(utterances, output_dir)
+    for job in jobs:
+        job["output_file"] += extension
+
+    pending = []
+    for job in jobs:
+        if not force and is_up_to_date(job):
+            yield dict(job, status="skipped", seconds=0)
+        else:
+            pending.append(job)
+
+    kwargs = {"process_kwargs": process_kwargs, "aspect": aspect, "dpi": dpi, "encoder_kwargs": encoder_kwargs}
+    for result in run_jobs(pending, render_utterance, kwargs, workers=workers, max_in_flight=max_in_flight):
+        yield result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render UltraSuite utterances as videos in parallel.")
+    parser.add_argument("input", help="the root directory of the data, or a manifest file if --manifest is given")
+    parser.add_argument("output_dir", help="the directory to write the videos to")
+    parser.add_argument("--manifest", action="store_true", help="read the utterances from a corpus manifest")
+    parser.add_argument("--dataset", nargs="+", help="only render these datasets (requires --manifest)")
+    parser.add_argument("--speaker", nargs="+", help="only render these speakers (requires --manifest)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--force", action="store_true", help="render videos which are already up to date")
+    parser.add_argument("--failures", metavar="FILE", help="write the failed utterances and their errors to a JSON file")
+
+    group = parser.add_argument_group("video")
+    group.add_argument("--extension", default=".avi", help="the video container, e.g., .avi or .mp4")
+    group.add_argument("--video-codec", default="mpeg4", help="e.g., mpeg4 or libx264")
+    group.add_argument("--quality", type=int, default=5, help="the -q:v value of the video codec, lower is better")
+    group.add_argument("--dpi", type=int, default=100, help="the video is 5 by 5 inches at this resolution")
+    group.add_argument("--aspect", default="equal", choices=("equal", "auto"))
+    group.add_argument("--raw", action="store_true", help="show the raw ultrasound instead of transforming it")
+    group.add_argument("--frame-rate", type=float, help="reduce the frame rate of the video by re-sampling")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+    :param argv:
+    :return: the exit status
+    """
+    args = parse_args(argv)
+
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg was not found on the PATH", file=sys.stderr)
+        return 2
+
+    if args.manifest:
+        with CorpusManifest(args.input) as manifest:
+            utterances = manifest.get_utterance_files(dataset=args.dataset, speaker=args.speaker)
+    else:
+        utterances = get_all_utterance_files(args.input)
+
+    process_kwargs = {"apply_sync": True, "transform_ult": not args.raw,
+                      "change_frame_rate": args.frame_rate is not None, "new_frame_rate": args.frame_rate}
+    encoder_kwargs = {"video_codec": args.video_codec, "quality": args.quality}
+
+    start = time.time()
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    num_frames = 0
+    duration = 0
+    failed = []
+
+    for i, result in enumerate(render_corpus(utterances, args.output_dir, extension=args.extension,
+                                             process_kwargs=process_kwargs, aspect=args.aspect, dpi=args.dpi,
+                                             encoder_kwargs=encoder_kwargs, workers=args.workers, force=args.force)):
+        counts[result["status"]] += 1
+        progress = "[%d/%d]" % (i + 1, len(utterances))
+
+        if result["status"] == "done":
+            num_frames += result["result"]["num_frames"]
+            duration += result["result"]["duration"]
+            elapsed = time.time() - start
+            print(progress, result["utterance_id"], "done in %.1f s (%.0f frames/s, %.1fx real time overall)"
+                  % (result["seconds"], num_frames / elapsed, duration / elapsed))
+        elif result["status"] == "failed":
+            failed.append({"utterance_id": result["utterance_id"], "error": result["error"]})
+            print(progress, result["utterance_id"], "FAILED:", result["error"].strip().splitlines()[-1], file=sys.stderr)
+        else:
+            print(progress, result["utterance_id"], "up to date")
+
+    elapsed = time.time() - start
+    print("%d videos rendered, %d up to date, %d failed, in %.1f s: %d frames, %.1f s of video (%.1fx real time)"
+          % (counts["done"], counts["skipped"], counts["failed"], elapsed, num_frames, duration,
+             duration / elapsed if elapsed > 0 else 0))
+
+    if args.failures:
+        with open(args.failures, "w") as f:
+            json.dump(failed, f, indent=1)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
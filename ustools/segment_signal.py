@@ -23,6 +23,57 @@ def get_segment(signal, sampling_rate=22050, start_time=0, end_time=None):
     return signal[int(round(start_frame)):int(round(end_frame))]
 
 
+def get_num_windows(length, window_length, step=None, pad_tail=False):
+    """
+    The number of windows get_windows returns for a signal of a given length.
+    :param length:
+    :param window_length:
+    :param step: defaults to window_length
+    :param pad_tail: count a final, partial window covering the remaining samples
+    :return:
+    """
+    step = step or window_length
+    if pad_tail:
+        return 0 if length == 0 else max(-(-(length - window_length) // step), 0) + 1
+    if length < window_length:
+        return 0
+    return (length - window_length) // step + 1
+
+
+def get_windows(signal, window_length, step=None, pad_tail=False, pad_value=0):
+    """
+    Split a signal into windows along its first axis, as a read-only strided view: window i is
+    signal[i * step:i * step + window_length], and nothing is copied. The step may be smaller than the window length
+    (overlapping windows) or larger (gaps between windows).
+
+    :param signal: numpy array (e.g., a wav, or a sequence of ultrasound frames), or a memmap
+    :param window_length: in samples (or frames)
+    :param step: in samples (or frames). Defaults to window_length.
+    :param pad_tail: if True, a final window covering the remaining samples is padded with pad_value. This copies the
+     signal. Otherwise only complete windows are returned.
+    :param pad_value:
+    :return: read-only array of shape (number of windows, window_length) + signal.shape[1:]
+    """
+    signal = np.asanyarray(signal)
+    step = step or window_length
+    if window_length < 1 or step < 1:
+        raise ValueError("The window length and step must be positive")
+
+    num_windows = get_num_windows(len(signal), window_length, step=step, pad_tail=pad_tail)
+
+    if pad_tail and num_windows > 0:
+        padded_length = (num_windows - 1) * step + window_length
+        if padded_length > len(signal):
+            padded = np.full((padded_length,) + signal.shape[1:], pad_value, dtype=signal.dtype)
+            padded[:len(signal)] = signal
+            signal = padded
+
+    return np.lib.stride_tricks.as_strided(signal,
+                                           shape=(num_windows, window_length) + signal.shape[1:],
+                                           strides=(step * signal.strides[0],) + signal.strides,
+                                           writeable=False)
+
+
 def window_signal(signal, sampling_rate=22050, start_time=0, end_time=None, time_window=0.2):
     """
     A function to get windows of a signal where start, end, and window are specified as time.
@@ -31,42 +82,65 @@ def window_signal(signal, sampling_rate=22050, start_time=0, end_time=None, time
     :param start_time: in seconds
     :param end_time: in seconds
     :param time_window: in seconds
-    :return: The windowed signal as a list. Windows can vary in size.
+    :return: The windows, of shape (number of windows, window length in samples). Only complete windows are returned.
+     When the start and the window are a whole number of samples, the windows are a read-only strided view of the
+     signal. Otherwise they are copied, so that each window still starts at the sample nearest its start time.
     """
-    a = []
     if not end_time:
         end_time = len(signal) / sampling_rate
 
-    for value in np.arange(start_time, end_time - time_window, time_window):
-        a.append(get_segment(signal=signal, sampling_rate=sampling_rate, start_time=value, end_time=value+time_window))
+    window_length = int(round(sampling_rate * time_window))
 
-    return a
+    # one window per time step in [start_time, end_time - time_window)
+    start_times = np.arange(start_time, end_time - time_window, time_window)
+    starts = np.round(sampling_rate * start_times).astype(np.int64)
+    starts = starts[starts + window_length <= len(signal)]
 
+    if len(starts) > 1 and np.all(np.diff(starts) == window_length):
+        return get_windows(signal[starts[0]:], window_length)[:len(starts)]
 
-def get_zero_regions(signal, num_repetitions=2):
+    return np.asarray(signal)[starts[:, np.newaxis] + np.arange(window_length)]
+
+
+def get_runs(signal, value=None, min_length=1):
     """
-    A function to get the zwero regions of a signal. This is useful for selecting the regions that were zero-ed during
-    anonymisation.
+    Run-length encode a 1d signal: find the runs of consecutive equal values.
 
-    :param signal: 
-    :param num_repetitions:
-    :return: 
+    :param signal: 1d numpy array
+    :param value: if given, only return runs of this value
+    :param min_length: only return runs of at least this many samples
+    :return: two numpy arrays containing the start and end index (inclusive) of each run
     """
-    indices = []
-    i = 0
+    signal = np.asarray(signal)
 
-    while i < len(signal) - 1:
+    if len(signal) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
 
-        start_index = i
+    if value is not None:
+        # runs of a single value are the rising and falling edges of a boolean mask
+        edges = np.diff(np.concatenate(([False], signal == value, [False])).view(np.int8))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1) - 1
+    else:
+        changes = np.flatnonzero(signal[1:] != signal[:-1]) + 1
+        starts = np.concatenate(([0], changes))
+        ends = np.concatenate((changes - 1, [len(signal) - 1]))
 
-        while i < len(signal) - 1 and signal[i] == signal[i + 1] and signal[i] == 0:
-            i = i + 1
+    keep = ends - starts + 1 >= min_length
 
-        end_index = i
+    return starts[keep], ends[keep]
 
-        if (start_index != end_index) & (end_index - start_index >= num_repetitions - 1):
-            indices.append((start_index, end_index))
 
-        i = i + 1
+def get_zero_regions(signal, num_repetitions=2):
+    """
+    A function to get the zwero regions of a signal. This is useful for selecting the regions that were zero-ed during
+    anonymisation.
+
+    :param signal: 
+    :param num_repetitions:
+    :return: a list of (start, end) tuples, with the end index inclusive
+    """
+    # a single zero is never a region
+    starts, ends = get_runs(signal, value=0, min_length=max(num_repetitions, 2))
 
-    return indices
+    return list(zip(starts.tolist(), ends.tolist()))
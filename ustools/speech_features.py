@@ -4,23 +4,192 @@ Date: Jun 2018
 Author: Aciel Eshky
 
 """
+import functools
+import math
+
 import python_speech_features as psf
+from python_speech_features.sigproc import round_half_up
 import matplotlib.pyplot as plt
 import numpy as np
+import scipy.fft
+
+PREEMPH = 0.97  # the python_speech_features default
+NFFT = 512  # the python_speech_features default
+EPS = np.finfo(float).eps  # python_speech_features replaces zero energies with this before taking logs
+
+
+def get_frame_size(samplerate, winlen, winstep):
+    """
+    The window length and step in samples, rounded as python_speech_features does.
+    :param samplerate:
+    :param winlen:
+    :param winstep:
+    :return: frame length, frame step
+    """
+    return int(round_half_up(winlen * samplerate)), int(round_half_up(winstep * samplerate))
+
+
+def get_num_feature_frames(num_samples, samplerate=22050, winlen=0.02, winstep=0.01):
+    """
+    The number of feature frames python_speech_features computes for a signal of a given length.
+    :param num_samples:
+    :param samplerate:
+    :param winlen:
+    :param winstep:
+    :return:
+    """
+    frame_len, frame_step = get_frame_size(samplerate, winlen, winstep)
+    if num_samples <= frame_len:
+        return 1
+    return 1 + int(math.ceil((1.0 * num_samples - frame_len) / frame_step))
+
+
+def get_preemphasised_segment(wav, start, end, coeff=PREEMPH):
+    """
+    Pre-emphasise a segment of a signal exactly as pre-emphasising the whole signal and then taking the segment would.
+    :param wav:
+    :param start: first sample
+    :param end: last sample (exclusive)
+    :param coeff:
+    :return: float64 numpy array
+    """
+    segment = np.asarray(wav[start:end], dtype=np.float64)
+    emphasised = segment.copy()
+    emphasised[1:] -= coeff * segment[:-1]
+    if start > 0 and len(segment):
+        emphasised[0] -= coeff * float(wav[start - 1])
+    return emphasised
+
+
+def preemphasise(wav, coeff=PREEMPH):
+    """
+    Pre-emphasise a signal as python_speech_features does.
+    :param wav:
+    :param coeff: 0 for no pre-emphasis
+    :return: float64 numpy array
+    """
+    wav = np.asarray(wav, dtype=np.float64)
+    if coeff == 0 or len(wav) == 0:
+        return wav
+    emphasised = wav.copy()
+    emphasised[1:] -= coeff * wav[:-1]
+    return emphasised
+
+
+def get_frames(wav, frame_len, frame_step):
+    """
+    Split a signal into overlapping frames as python_speech_features.sigproc.framesig does, padding the end with zeros,
+    but as a read-only strided view of the padded signal rather than a gathered copy.
+    :param wav: 1d numpy array
+    :param frame_len:
+    :param frame_step:
+    :return: 2d array of shape (number of frames, frame_len)
+    """
+    num_frames = get_num_feature_frames(len(wav), samplerate=1, winlen=frame_len, winstep=frame_step)
+    padded = np.zeros((num_frames - 1) * frame_step + frame_len, dtype=wav.dtype)
+    padded[:len(wav)] = wav[:len(padded)]
+    return np.lib.stride_tricks.sliding_window_view(padded, frame_len)[::frame_step]
+
+
+@functools.lru_cache(maxsize=16)
+def get_filterbanks(nfilt, nfft, samplerate, lowfreq, highfreq):
+    """
+    The mel filterbank of python_speech_features, cached and read-only.
+    """
+    filterbanks = psf.get_filterbanks(nfilt, nfft, samplerate, lowfreq, highfreq)
+    filterbanks.flags.writeable = False
+    return filterbanks
+
+
+def get_speech_features_batch(wavs, samplerate=22050, winlen=0.02, winstep=0.01, mfcc=True, fbank=True,
+                              drop_first_mfcc=False, preemph=PREEMPH, nfilt=26, numcep=13, nfft=NFFT, lowfreq=0,
+                              highfreq=None, ceplifter=22, dtype=np.float32, workers=1):
+    """
+    Compute MFCC and filterbank features for a batch of signals from a single power spectrum. Every frame of every
+    signal is transformed in one batched real FFT, and the filterbank energies, log filterbank energies and MFCCs are
+    all derived from the same spectrum. The features are those of python_speech_features' mfcc, fbank and logfbank
+    with their default settings, to within the precision of dtype.
+
+    :param wavs: a list of 1d signals, all with the same sample rate
+    :param samplerate:
+    :param winlen: the window length in seconds
+    :param winstep: the window step in seconds
+    :param mfcc: compute the MFCCs
+    :param fbank: compute the filterbank energies and log filterbank energies
+    :param drop_first_mfcc: discard the first MFCC (the log frame energy)
+    :param preemph: the pre-emphasis coefficient. 0 if the signals have already been pre-emphasised.
+    :param nfilt: the number of filters
+    :param numcep: the number of MFCCs, including the first
+    :param nfft: the FFT size. Longer frames are truncated, as in python_speech_features.
+    :param lowfreq:
+    :param highfreq: defaults to samplerate / 2
+    :param ceplifter: the cepstral lifter, 0 for none
+    :param dtype: the precision of the spectrum and features, e.g., np.float32 or np.float64
+    :param workers: the number of threads computing the FFT
+    :return: a list with a dictionary per signal, containing "mfcc", "fbank", "logfbank" and "energy" arrays with one
+     row per frame, as requested
+    """
+    frame_len, frame_step = get_frame_size(samplerate, winlen, winstep)
+
+    frames = [get_frames(preemphasise(wav, preemph).astype(dtype, copy=False), frame_len, frame_step) for wav in wavs]
+    counts = [len(f) for f in frames]
+    frames = frames[0] if len(frames) == 1 else np.concatenate(frames)
+
+    spectrum = scipy.fft.rfft(frames, n=nfft, axis=1, workers=workers)
+    power = np.square(spectrum.real)
+    power += np.square(spectrum.imag)
+    power *= 1.0 / nfft
+    del spectrum
+
+    energy = power.sum(axis=1)
+    energy[energy == 0] = EPS
+
+    filterbanks = get_filterbanks(nfilt, nfft, samplerate, lowfreq, highfreq or samplerate / 2).astype(dtype)
+    feat = power @ filterbanks.T
+    feat[feat == 0] = EPS
+    log_feat = np.log(feat)
+
+    features = {"energy": energy}
+    if fbank:
+        features["fbank"] = feat
+        features["logfbank"] = log_feat
+
+    if mfcc:
+        cepstra = scipy.fft.dct(log_feat, type=2, axis=1, norm='ortho')[:, :numcep]
+        if ceplifter > 0:
+            cepstra *= (1 + (ceplifter / 2.0) * np.sin(np.pi * np.arange(numcep) / ceplifter)).astype(dtype)
+        cepstra[:, 0] = np.log(energy)  # the first cepstral coefficient is replaced with the log of the frame energy
+        features["mfcc"] = cepstra[:, 1:] if drop_first_mfcc else cepstra
+
+    offsets = np.cumsum([0] + counts)
+    return [{name: feature[start:end] for name, feature in features.items()}
+            for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def get_speech_features(wav, samplerate=22050, winlen=0.02, winstep=0.01, mfcc=True, fbank=True,
+                        drop_first_mfcc=False, preemph=PREEMPH, dtype=np.float32, **kwargs):
+    """
+    Compute MFCC and filterbank features of a signal from a single power spectrum. See get_speech_features_batch.
+    :return: a dictionary containing "mfcc", "fbank", "logfbank" and "energy" arrays, as requested
+    """
+    return get_speech_features_batch([wav], samplerate=samplerate, winlen=winlen, winstep=winstep, mfcc=mfcc,
+                                     fbank=fbank, drop_first_mfcc=drop_first_mfcc, preemph=preemph, dtype=dtype,
+                                     **kwargs)[0]
 
 
-def get_logfbank_feat(wav, samplerate=22050, winlen=0.02, winstep=0.01):
+def get_logfbank_feat(wav, samplerate=22050, winlen=0.02, winstep=0.01, preemph=PREEMPH):
     """
 
     :param wav:
     :param samplerate:
     :param winlen:
+    :param preemph: the pre-emphasis coefficient. 0 if the wav has already been pre-emphasised.
     :return:
     """
-    return psf.logfbank(signal=wav, samplerate=samplerate, winlen=winlen, winstep=winstep)
+    return psf.logfbank(signal=wav, samplerate=samplerate, winlen=winlen, winstep=winstep, preemph=preemph)
 
 
-def get_mfcc_feat(wav, samplerate=22050, winlen=0.02, winstep=0.01, drop_first_mfcc=False):
+def get_mfcc_feat(wav, samplerate=22050, winlen=0.02, winstep=0.01, drop_first_mfcc=False, preemph=PREEMPH):
     """
 
     :param wav: the waveform
@@ -28,9 +197,10 @@ def get_mfcc_feat(wav, samplerate=22050, winlen=0.02, winstep=0.01, drop_first_m
     :param winlen: The size of the window. This should be equal to the ultrasound window in seconds.
     The skip will be calculated as size of window / 2
     :param drop_first_mfcc: discard the first mfcc
+    :param preemph: the pre-emphasis coefficient. 0 if the wav has already been pre-emphasised.
     :return:
     """
-    mfcc_feat = psf.mfcc(signal=wav, samplerate=samplerate, winlen=winlen, winstep=winstep)
+    mfcc_feat = psf.mfcc(signal=wav, samplerate=samplerate, winlen=winlen, winstep=winstep, preemph=preemph)
 
     if drop_first_mfcc:
         return mfcc_feat[:, 1:]  # get only the 2nd-13th DCT coefficients (indices 1-13 inclusive)
@@ -0,0 +1,250 @@
+"""
+A sharded container for synchronised chunks, as an alternative to saving one npz file per utterance with
+Chunk.save_sync_data.
+
+The chunks of many utterances are appended to large raw arrays, one file per modality per shard. An offset index maps
+each chunk to its shard and row, its utterance, and the ult frame range and wav sample range it was taken from. Reading
+memory-maps the shard files, so opening a dataset only reads the index and fetching a chunk only reads that chunk.
+
+The layout of a dataset directory is:
+
+    index.json                          the modalities (dtype and chunk shape), the utterance ids and the shards
+    index.npy                           one row per chunk, see INDEX_DTYPE
+    shard_00000.raw_ult.bin             the raw chunks of each modality of each shard
+    shard_00000.raw_wav.bin
+    ...
+
+Date: Oct 2026
+
+"""
+
+import json
+import os
+
+import numpy as np
+
+from ustools.chunk import Chunk
+
+INDEX_DTYPE = np.dtype([("shard", np.int32),
+                        ("row", np.int64),
+                        ("utterance", np.int32),
+                        ("chunk", np.int32),
+                        ("ult_start", np.int64),
+                        ("ult_end", np.int64),
+                        ("wav_start", np.int64),
+                        ("wav_end", np.int64)])
+
+
+def get_shard_file(directory, shard_name, modality):
+    return os.path.join(directory, shard_name + "." + modality + ".bin")
+
+
+class SyncShardWriter:
+
+    def __init__(self, directory, chunks_per_shard=10000):
+        """
+        Create a dataset, or open an existing one to append to it. Appended chunks go to new shards.
+        :param directory: the dataset directory
+        :param chunks_per_shard: the number of chunks after which a new shard is started
+        """
+        self.directory = directory
+        self.chunks_per_shard = chunks_per_shard
+
+        os.makedirs(directory, exist_ok=True)
+        index_file = os.path.join(directory, "index.json")
+
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                self.header = json.load(f)
+            self.index = list(np.load(os.path.join(directory, "index.npy")))
+        else:
+            self.header = {"modalities": {}, "utterances": [], "shards": []}
+            self.index = []
+
+        self.files = {}  # the open files of the current shard, by modality
+        self.shard = None  # the current shard's entry in the header
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _start_shard(self):
+        self._close_files()
+        self.shard = {"name": "shard_%05d" % len(self.header["shards"]), "num_chunks": 0}
+        self.header["shards"].append(self.shard)
+
+    def _close_files(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def append(self, utterance_id, arrays, ult_ranges, wav_ranges):
+        """
+        Append the chunks of an utterance.
+        :param utterance_id:
+        :param arrays: a dictionary mapping each modality to an array of chunks. All arrays must contain the same
+         number of chunks, and the modalities must be the same for all utterances. Empty arrays are ignored.
+        :param ult_ranges: (start, end) ult frame range of each chunk
+        :param wav_ranges: (start, end) wav sample range of each chunk
+        :return:
+        """
+        arrays = {name: np.asarray(a) for name, a in arrays.items() if a is not None and np.size(a) != 0}
+        num_chunks = len(ult_ranges)
+        if num_chunks == 0:
+            return
+
+        modalities = self.header["modalities"]
+        if not modalities and not self.index:
+            for name, a in arrays.items():
+                modalities[name] = {"dtype": a.dtype.str, "shape": list(a.shape[1:])}
+
+        if set(arrays) != set(modalities):
+            raise ValueError("Expected modalities " + str(sorted(modalities)) + ", got " + str(sorted(arrays)))
+
+        for name, a in arrays.items():
+            if a.dtype.str != modalities[name]["dtype"] or list(a.shape[1:]) != modalities[name]["shape"]:
+                raise ValueError("Expected " + name + " chunks of dtype " + modalities[name]["dtype"] + " and shape " +
+                                 str(modalities[name]["shape"]) + ", got " + a.dtype.str + " and " +
+                                 str(list(a.shape[1:])))
+            if len(a) != num_chunks:
+                raise ValueError("Expected " + str(num_chunks) + " " + name + " chunks, got " + str(len(a)))
+
+        utterance = len(self.header["utterances"])
+        self.header["utterances"].append(utterance_id)
+
+        written = 0
+        while written < num_chunks:
+            if self.shard is None or self.shard["num_chunks"] >= self.chunks_per_shard:
+                self._start_shard()
+            n = min(num_chunks - written, self.chunks_per_shard - self.shard["num_chunks"])
+
+            for name, a in arrays.items():
+                if name not in self.files:
+                    # a new shard: truncate, since a writer which was interrupted before flushing may have left a file
+                    # of the same name behind
+                    self.files[name] = open(get_shard_file(self.directory, self.shard["name"], name), "wb")
+                np.ascontiguousarray(a[written:written + n]).tofile(self.files[name])
+
+            shard_number = len(self.header["shards"]) - 1
+            for i in range(written, written + n):
+                self.index.append((shard_number, self.shard["num_chunks"] + i - written, utterance, i,
+                                   ult_ranges[i][0], ult_ranges[i][1], wav_ranges[i][0], wav_ranges[i][1]))
+
+            self.shard["num_chunks"] += n
+            written += n
+
+    def add_chunk(self, utterance_id, chunk):
+        """
+        Append the chunks of a Chunk object.
+        :param utterance_id:
+        :param chunk: a Chunk object
+        :return:
+        """
+        num_chunks = len(chunk.chunk_ids)
+        wav_step, wav_window = Chunk.get_wav_step_and_window(chunk.core.params, chunk.ult_chunk_size)
+
+        self.append(utterance_id,
+                    {"raw_ult": chunk.ult_chunks,
+                     "trans_ult": chunk.ult_t_chunks,
+                     "raw_wav": chunk.wav_chunks,
+                     "logfbank_feat": chunk.fbank_chunks,
+                     "mfcc_feat": chunk.mfcc_chunks},
+                    ult_ranges=[(i * chunk.ult_chunk_size, (i + 1) * chunk.ult_chunk_size) for i in range(num_chunks)],
+                    wav_ranges=[(i * wav_step, i * wav_step + wav_window) for i in range(num_chunks)])
+
+    def flush(self):
+        """
+        Write the index, so that the chunks appended so far can be read.
+        :return:
+        """
+        for f in self.files.values():
+            f.flush()
+
+        index = np.array(self.index, dtype=INDEX_DTYPE)
+
+        # write to temporary files first, so that readers never see a partially written file. The header is replaced
+        # before the index, and readers load the index before the header, so a reader always gets a header at least
+        # as new as its index: a newer header only lists more shards and utterances than the index refers to.
+        np.save(os.path.join(self.directory, "index.tmp.npy"), index)
+        with open(os.path.join(self.directory, "index.json.tmp"), "w") as f:
+            json.dump(self.header, f)
+        os.replace(os.path.join(self.directory, "index.json.tmp"), os.path.join(self.directory, "index.json"))
+        os.replace(os.path.join(self.directory, "index.tmp.npy"), os.path.join(self.directory, "index.npy"))
+
+    def close(self):
+        self.flush()
+        self._close_files()
+
+
+class SyncShardDataset:
+
+    def __init__(self, directory):
+        """
+        Open a dataset for random access. Only the index is read here; shard files are memory-mapped on first use.
+        :param directory: the dataset directory
+        """
+        self.directory = directory
+
+        # the index is loaded before the header, see SyncShardWriter.flush
+        self.index = np.load(os.path.join(directory, "index.npy"), mmap_mode="r")
+        with open(os.path.join(directory, "index.json")) as f:
+            header = json.load(f)
+
+        self.modalities = {name: (np.dtype(m["dtype"]), tuple(m["shape"])) for name, m in header["modalities"].items()}
+        self.utterances = header["utterances"]
+        self.shards = header["shards"]
+
+        self._memmaps = {}  # (shard, modality) -> np.memmap
+
+    def __len__(self):
+        return len(self.index)
+
+    def _get_memmap(self, shard, modality):
+        key = (shard, modality)
+        if key not in self._memmaps:
+            dtype, shape = self.modalities[modality]
+            self._memmaps[key] = np.memmap(get_shard_file(self.directory, self.shards[shard]["name"], modality),
+                                           dtype=dtype, mode="r", shape=(self.shards[shard]["num_chunks"],) + shape)
+        return self._memmaps[key]
+
+    def __getitem__(self, i):
+        """
+        Get a chunk.
+        :param i: the chunk number
+        :return: a dictionary mapping each modality to the chunk, as a read-only memory-mapped array
+        """
+        entry = self.index[i]
+        return {name: self._get_memmap(int(entry["shard"]), name)[entry["row"]] for name in self.modalities}
+
+    def get_modality(self, i, modality):
+        """
+        Get a single modality of a chunk.
+        :param i: the chunk number
+        :param modality: e.g., "raw_ult"
+        :return:
+        """
+        entry = self.index[i]
+        return self._get_memmap(int(entry["shard"]), modality)[entry["row"]]
+
+    def get_info(self, i):
+        """
+        Get where a chunk comes from.
+        :param i: the chunk number
+        :return: a dictionary containing the utterance id, the chunk id within the utterance, the ult frame range and
+         the wav sample range
+        """
+        entry = self.index[i]
+        return {"utterance_id": self.utterances[entry["utterance"]],
+                "chunk_id": "ch_" + str(entry["chunk"]),
+                "ult_range": (int(entry["ult_start"]), int(entry["ult_end"])),
+                "wav_range": (int(entry["wav_start"]), int(entry["wav_end"]))}
+
+    def get_utterance_chunks(self, utterance_id):
+        """
+        Get the chunk numbers of an utterance.
+        :param utterance_id:
+        :return: numpy array of chunk numbers
+        """
+        return np.flatnonzero(self.index["utterance"] == self.utterances.index(utterance_id))
@@ -0,0 +1,174 @@
+"""
+Synthetic UltraSuite utterances, for exercising and benchmarking the processing pipeline without the real data.
+
+An utterance is written as the usual four files (.txt, .wav, .param and .ult). The ultrasound shows a bright, smoothly
+moving tongue contour with an acoustic shadow behind it and speckle noise, and the audio alternates between voiced,
+harmonic syllables and low-level background noise, with some regions zeroed as in the anonymised UltraSuite recordings.
+The signals are deterministic for a given seed.
+
+Date: Oct 2026
+
+"""
+
+import io
+import os
+from datetime import datetime
+
+import numpy as np
+from scipy.io import wavfile
+
+PARAMS = {"num_scanlines": 63,
+          "size_scanline": 412,
+          "zero_offset": 51,
+          "bits_per_pixel": 8,
+          "angle": 0.038,
+          "kind": 0,
+          "pixel_per_mm": 10.0,
+          "ult_fps": 121.618,
+          "sync": 0.5073,
+          "wav_fps": 22050}
+
+
+def make_synthetic_ult(num_frames, num_scanlines=63, size_scanline=412, ult_fps=121.618, rng=None, start_frame=0):
+    """
+    Make ultrasound frames showing a moving tongue contour.
+    :param num_frames:
+    :param num_scanlines:
+    :param size_scanline:
+    :param ult_fps: the frame rate, which sets the speed of the tongue movement
+    :param rng: a numpy random Generator, for the speckle noise
+    :param start_frame: the index of the first frame, so that an utterance can be made in consecutive blocks
+    :return: uint8 array of shape (num_frames, num_scanlines, size_scanline)
+    """
+    rng = rng or np.random.default_rng(0)
+
+    t = (start_frame + np.arange(num_frames, dtype=np.float32))[:, None, None] / ult_fps
+    scanline = np.linspace(-1, 1, num_scanlines, dtype=np.float32)[None, :, None]
+    depth = np.arange(size_scanline, dtype=np.float32)[None, None, :]
+
+    # a dome shaped contour, farthest from the probe in the middle, which rises, falls and tilts at a few syllable-like rates
+    contour = size_scanline * (0.4 + 0.2 * (1 - scanline ** 2)
+                               + 0.05 * np.sin(2 * np.pi * 3.1 * t)
+                               + 0.03 * np.sin(2 * np.pi * 1.3 * t) * scanline)
+
+    distance = depth - contour
+    image = 60 * np.exp(-depth / (0.4 * size_scanline))  # near field, attenuated with depth
+    image = image + 170 * np.exp(-0.5 * (distance / 3) ** 2)  # the tongue surface
+    image *= np.where(distance > 6, 0.25, 1)  # the acoustic shadow behind the tongue
+    image *= rng.rayleigh(0.8, size=image.shape).astype(np.float32)  # speckle
+
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def make_synthetic_wav(num_samples, sample_rate=22050, rng=None, num_zero_regions=1, zero_region_duration=0.3):
+    """
+    Make audio alternating between harmonic syllables and background noise, with zeroed regions.
+    :param num_samples:
+    :param sample_rate:
+    :param rng: a numpy random Generator
+    :param num_zero_regions: the number of regions set to exactly zero, as in the anonymised UltraSuite recordings
+    :param zero_region_duration: the duration of each zeroed region in seconds
+    :return: int16 array
+    """
+    rng = rng or np.random.default_rng(0)
+
+    wav = rng.normal(0, 30, num_samples)  # background noise, which never stays at zero for long
+
+    position = int(0.1 * sample_rate)
+    while position < num_samples:
+        length = min(int(rng.uniform(0.1, 0.3) * sample_rate), num_samples - position)
+        t = np.arange(length) / sample_rate
+        f0 = rng.uniform(100, 220)
+
+        # harmonics weighted by two formant-like peaks, under a smooth syllable envelope
+        harmonics = np.arange(1, 20)[:, None]
+        formants = rng.uniform(300, 900), rng.uniform(900, 2500)
+        weights = sum(np.exp(-0.5 * ((harmonics * f0 - f) / 150) ** 2) for f in formants) + 0.05
+        syllable = (weights * np.sin(2 * np.pi * harmonics * f0 * t)).sum(axis=0)
+        syllable *= np.hanning(length) * rng.uniform(3000, 8000) / np.abs(syllable).max()
+
+        wav[position:position + length] += syllable
+        position += length + int(rng.uniform(0.05, 0.3) * sample_rate)
+
+    zero_length = int(zero_region_duration * sample_rate)
+    if num_zero_regions and num_samples > zero_length:
+        for start in np.sort(rng.integers(0, num_samples - zero_length, num_zero_regions)):
+            wav[start:start + zero_length] = 0
+
+    return np.clip(np.rint(wav), -32768, 32767).astype(np.int16)
+
+
+def write_synthetic_utterance(directory, basename, duration=2.0, seed=0, prompt="synthetic utterance",
+                              speaker_id="SYN_01", num_zero_regions=1, frames_per_block=512, **params):
+    """
+    Write a synthetic utterance as the four UltraSuite files. The ult is written in blocks of frames, so long
+    utterances do not need to fit in memory.
+
+    :param directory:
+    :param basename: base file name without extension
+    :param duration: the duration of the synchronised signals in seconds. The leading signal is longer by the sync.
+    :param seed:
+    :param prompt:
+    :param speaker_id:
+    :param num_zero_regions: see make_synthetic_wav
+    :param frames_per_block:
+    :param params: overrides for PARAMS, e.g., ult_fps=60 or sync=-0.2. A positive sync means the wav leads.
+    :return: the path of the utterance without extension
+    """
+    p = dict(PARAMS)
+    p.update(params)
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, basename)
+
+    with io.open(path + ".txt", mode="w", encoding='utf-8') as prompt_f:
+        prompt_f.write(prompt + '\n')
+        prompt_f.write(datetime(2015, 6, 26, 15, 9, 25).strftime('%d/%m/%Y %H:%M:%S') + '\n')
+        prompt_f.write(speaker_id)
+
+    with open(path + ".param", "w") as param_f:
+        param_f.write("NumVectors=%d\n" % p["num_scanlines"])
+        param_f.write("PixPerVector=%d\n" % p["size_scanline"])
+        param_f.write("ZeroOffset=%d\n" % p["zero_offset"])
+        param_f.write("BitsPerPixel=%d\n" % p["bits_per_pixel"])
+        param_f.write("Angle=%.3f\n" % p["angle"])
+        param_f.write("Kind=%d\n" % p["kind"])
+        param_f.write("PixelsPerMm=%.3f\n" % p["pixel_per_mm"])
+        param_f.write("FramesPerSec=%.3f\n" % p["ult_fps"])
+        param_f.write("TimeInSecsOfFirstFrame=%.5f\n" % p["sync"])
+
+    num_samples = int(round((duration + max(p["sync"], 0)) * p["wav_fps"]))
+    wav = make_synthetic_wav(num_samples, sample_rate=p["wav_fps"], rng=rng, num_zero_regions=num_zero_regions)
+    wavfile.write(path + ".wav", p["wav_fps"], wav)
+
+    num_frames = int(round((duration + max(-p["sync"], 0)) * p["ult_fps"]))
+    with open(path + ".ult", "wb") as ult_f:
+        for start in range(0, num_frames, frames_per_block):
+            make_synthetic_ult(min(frames_per_block, num_frames - start), num_scanlines=p["num_scanlines"],
+                               size_scanline=p["size_scanline"], ult_fps=p["ult_fps"], rng=rng,
+                               start_frame=start).tofile(ult_f)
+
+    return path
+
+
+def write_synthetic_corpus(root_dir, num_speakers=2, num_utterances=3, dataset="uxtd", duration=2.0, seed=0):
+    """
+    Write a small synthetic corpus, laid out like an UltraSuite dataset (root_dir/dataset/core/speaker/utterance), so
+    that folder_utils, the manifest and the corpus runner recognise it.
+    :param root_dir:
+    :param num_speakers:
+    :param num_utterances: per speaker
+    :param dataset: e.g., "uxtd"
+    :param duration: of each utterance, in seconds
+    :param seed:
+    :return: a list of (directory, basename) tuples
+    """
+    utterances = []
+    for s in range(num_speakers):
+        directory = os.path.join(root_dir, dataset, "core", "%02dM" % (s + 1))
+        for u in range(num_utterances):
+            basename = "%03dA" % (u + 1)
+            write_synthetic_utterance(directory, basename, duration=duration, seed=seed + s * num_utterances + u,
+                                      speaker_id="SYN_%02d" % (s + 1))
+            utterances.append((directory, basename))
+    return utterances
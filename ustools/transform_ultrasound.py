@@ -6,10 +6,16 @@ Author: Aciel Eshky
 
 """
 
+import functools
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from scipy import ndimage
+from scipy import ndimage, sparse
+
+# a directory in which the coordinate maps are saved, so that other processes can load them instead of recomputing them
+GEOMETRY_CACHE_DIR = os.environ.get("USTOOLS_GEOMETRY_CACHE_DIR")
 
 
 def cart2pol_vectorised(x, y):
@@ -49,8 +55,191 @@ def get_cart2pol_coordinates_vectorised(output_coordinates, origin=(0, 0), num_s
     return np.subtract(cl, np.divide(np.subtract(th, np.divide(np.pi, 2)), angle)), np.subtract(r, zero_offset)
 
 
+def get_output_shape(num_scanlines=63, size_scanline=412, zero_offset=50, pixels_per_mm=1):
+    """
+    The shape of a transformed ultrasound frame.
+
+    :param num_scanlines:
+    :param size_scanline:
+    :param zero_offset:
+    :param pixels_per_mm:
+    :return:
+    """
+    # ideal output size for ultrasuite data is (884, 488)
+    width = math.sqrt(math.pow(num_scanlines, 2) + math.pow(size_scanline, 2)) * 2 + zero_offset
+    height = size_scanline + zero_offset * 1.5
+
+    # reducing resolution using pixel per mm
+    return (int(width // pixels_per_mm),
+            int(height // pixels_per_mm))
+
+
+@functools.lru_cache(maxsize=16)
+def get_scan_conversion_geometry(num_scanlines=63, size_scanline=412, angle=0.038, zero_offset=50, pixels_per_mm=1,
+                                 cache_dir=None):
+    """
+    The coordinates in the raw ultrasound of each pixel of a transformed frame. These only depend on the geometry, so
+    they are computed once per geometry and kept in memory. If a cache directory is given, they are also saved to disk
+    and loaded from there by other processes.
+
+    :param num_scanlines:
+    :param size_scanline:
+    :param angle:
+    :param zero_offset:
+    :param pixels_per_mm:
+    :param cache_dir: optional directory to save and load the coordinates
+    :return: the output shape and the (read-only) coordinates, an array of shape (2, output_shape[1], output_shape[0])
+    """
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, "geometry_%d_%d_%r_%r_%r.npy" % (
+            num_scanlines, size_scanline, float(angle), float(zero_offset), float(pixels_per_mm)))
+
+    output_shape = get_output_shape(num_scanlines=num_scanlines, size_scanline=size_scanline,
+                                    zero_offset=zero_offset, pixels_per_mm=pixels_per_mm)
+
+    if cache_file and os.path.exists(cache_file):
+        return output_shape, np.load(cache_file, mmap_mode='r')
+
+    origin = (int(output_shape[0] // 2), 0)
+
+    xx, yy = np.meshgrid(np.arange(output_shape[0]), np.arange(output_shape[1]))
+    coordinates_in_input = np.array(get_cart2pol_coordinates_vectorised((xx, yy), origin=origin,
+                                                                        num_scanlines=num_scanlines, angle=angle,
+                                                                        zero_offset=zero_offset,
+                                                                        pixels_per_mm=pixels_per_mm))
+
+    if cache_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_file = cache_file + ".%d.tmp.npy" % os.getpid()
+        np.save(temp_file, coordinates_in_input)
+        os.replace(temp_file, cache_file)  # atomic, so concurrent processes never read a partial file
+
+    coordinates_in_input.flags.writeable = False
+    return output_shape, coordinates_in_input
+
+
+@functools.lru_cache(maxsize=16)
+def get_scan_conversion_matrix(num_scanlines=63, size_scanline=412, angle=0.038, zero_offset=50, pixels_per_mm=1,
+                               order=1, cache_dir=None):
+    """
+    A sparse matrix which maps the pixels of a flattened raw frame to the pixels of a flattened transformed frame. It
+    reproduces ndimage.map_coordinates with mode='constant' for nearest (order 0) and linear (order 1) interpolation,
+    so a block of frames can be transformed with a single sparse matrix product.
+
+    :param num_scanlines:
+    :param size_scanline:
+    :param angle:
+    :param zero_offset:
+    :param pixels_per_mm:
+    :param order: 0 (nearest) or 1 (linear)
+    :param cache_dir: passed to get_scan_conversion_geometry
+    :return: the output shape, the float32 csr matrix of shape (output pixels, input pixels), and a boolean mask of the
+     output pixels which fall outside the raw ultrasound and take the background colour
+    """
+    if order not in (0, 1):
+        raise ValueError("The sparse scan conversion supports interpolation orders 0 and 1, not " + str(order))
+
+    output_shape, coordinates_in_input = get_scan_conversion_geometry(
+        num_scanlines=num_scanlines, size_scanline=size_scanline, angle=angle, zero_offset=zero_offset,
+        pixels_per_mm=pixels_per_mm, cache_dir=cache_dir)
+
+    # the rows of the matrix are in the order of the (transposed) output frame
+    c0 = np.ravel(coordinates_in_input[0].T)
+    c1 = np.ravel(coordinates_in_input[1].T)
+    inside = (c0 >= 0) & (c0 <= num_scanlines - 1) & (c1 >= 0) & (c1 <= size_scanline - 1)
+    rows = np.flatnonzero(inside)
+    c0 = c0[rows]
+    c1 = c1[rows]
+
+    if order == 0:
+        columns = np.floor(c0 + 0.5).astype(int) * size_scanline + np.floor(c1 + 0.5).astype(int)
+        weights = np.ones(len(rows))
+
+    else:
+        i0 = np.floor(c0).astype(int)
+        j0 = np.floor(c1).astype(int)
+        f0 = c0 - i0
+        f1 = c1 - j0
+        i1 = np.minimum(i0 + 1, num_scanlines - 1)
+        j1 = np.minimum(j0 + 1, size_scanline - 1)
+
+        rows = np.tile(rows, 4)
+        columns = np.concatenate([i0 * size_scanline + j0, i0 * size_scanline + j1,
+                                  i1 * size_scanline + j0, i1 * size_scanline + j1])
+        weights = np.concatenate([(1 - f0) * (1 - f1), (1 - f0) * f1, f0 * (1 - f1), f0 * f1])
+
+    matrix = sparse.csr_matrix((weights.astype(np.float32), (rows, columns)),
+                               shape=(inside.size, num_scanlines * size_scanline))
+
+    return output_shape, matrix, ~inside
+
+
+def store_frames(out, values):
+    """
+    Store values into an output array, rounding and clipping when the output has an integer type.
+
+    :param out: the output array (or a view of it)
+    :param values:
+    :return:
+    """
+    if np.issubdtype(out.dtype, np.integer) and not np.issubdtype(values.dtype, np.integer):
+        info = np.iinfo(out.dtype)
+        values = np.clip(np.rint(values), info.min, info.max)
+    out[...] = values
+
+
+def get_output_array(num_frames, output_shape, dtype=np.float64, out=None):
+    """
+    Allocate the output of a transform, or check the one provided.
+
+    :param num_frames:
+    :param output_shape:
+    :param dtype:
+    :param out: an optional preallocated array, e.g., a memmap
+    :return:
+    """
+    shape = (num_frames, output_shape[0], output_shape[1])
+    if out is None:
+        return np.zeros(shape, dtype=dtype)
+    if out.shape != shape:
+        raise ValueError("Expected an output array of shape " + str(shape) + ", got " + str(out.shape))
+    return out
+
+
+def apply_blockwise(func, ult, out, block_size, workers=1):
+    """
+    Apply a function to consecutive blocks of frames, writing into the matching blocks of the output. With more than
+    one worker, the blocks are processed in a thread pool; the interpolation and sparse products release the GIL, and
+    each block writes to its own part of the shared output array. Temporary memory is bounded by block_size * workers
+    frames.
+
+    :param func: called as func(ult_block, out_block)
+    :param ult: 3d ultrasound
+    :param out: the output array, with the same number of frames
+    :param block_size: the number of frames per block
+    :param workers: the number of threads
+    :return: out
+    """
+    starts = range(0, ult.shape[0], block_size)
+
+    def process_block(start):
+        func(ult[start:start + block_size], out[start:start + block_size])
+
+    if workers > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(process_block, starts):  # iterate to surface exceptions
+                pass
+    else:
+        for start in starts:
+            process_block(start)
+
+    return out
+
+
 def transform_ultrasound(ult, spline_interpolation_order=2, background_colour=255, num_scanlines=63, size_scanline=412,
-                         angle=0.038, zero_offset=50, pixels_per_mm=1):
+                         angle=0.038, zero_offset=50, pixels_per_mm=1, geometry_cache_dir=None,
+                         method="map_coordinates", dtype=np.float64, out=None, workers=1, block_size=None):
     """
     A function to transform ultrasound from raw to world. Can be applied to an utterance (seuqnece of ultrasound
     frames) or a single ultrasound frame.
@@ -63,6 +252,17 @@ def transform_ultrasound(ult, spline_interpolation_order=2, background_colour=25
     :param angle:
     :param zero_offset:
     :param pixels_per_mm: number to divide resolution by
+    :param geometry_cache_dir: directory to save and load the coordinate maps. Defaults to GEOMETRY_CACHE_DIR.
+    :param method: "map_coordinates" interpolates each frame with ndimage.map_coordinates. "sparse" transforms blocks
+     of frames with a precomputed sparse matrix, which is much faster but only supports spline_interpolation_order 0
+     and 1. The two agree to within one grey level.
+    :param dtype: the type of the output, e.g., np.uint8 or np.float32. Values are rounded and clipped for integer
+     types. Ignored if out is given.
+    :param out: an optional preallocated output array of shape (frames, width, height), e.g., a memmap or part of a
+     larger array. The transformed frames are written into it directly.
+    :param workers: the number of threads transforming blocks of frames in parallel
+    :param block_size: the number of frames per block, which bounds the temporary memory. Defaults to 64 frames for
+     map_coordinates and 16 for sparse.
 
     :return: 3 dimensional ultrasound. if one frame was pased, the first dimension is 1.
     """
@@ -75,22 +275,6 @@ def transform_ultrasound(ult, spline_interpolation_order=2, background_colour=25
         angle = 0.038
         print("Zero value provided for angle. Value set to 0.038.")
 
-    # ideal output size for ultrasuite data is (884, 488)
-    width = math.sqrt(math.pow(num_scanlines, 2) + math.pow(size_scanline, 2)) * 2 + zero_offset
-    height = size_scanline + zero_offset * 1.5
-
-    # reducing resolution using pixel per mm
-    output_shape = (int(width // pixels_per_mm),
-                    int(height // pixels_per_mm))
-
-    origin = (int(output_shape[0] // 2), 0)
-
-    xx, yy = np.meshgrid(np.arange(output_shape[0]), np.arange(output_shape[1]))
-    coordinates_in_input = get_cart2pol_coordinates_vectorised((xx, yy), origin=origin, num_scanlines=num_scanlines,
-                                                               angle=angle, zero_offset=zero_offset,
-                                                               pixels_per_mm=pixels_per_mm)
-    transformed_ult = []  # output
-
     if len(ult.shape) == 1:  # raw ultrasound has not yet been reshaped -> reshape it.
 
         ult = ult.reshape(-1, num_scanlines, size_scanline)
@@ -99,19 +283,70 @@ def transform_ultrasound(ult, spline_interpolation_order=2, background_colour=25
 
         assert (ult.shape[0] == num_scanlines and ult.shape[1] == size_scanline)
 
-        transformed_ult = np.zeros((1, output_shape[0], output_shape[1]))
+        ult = ult[np.newaxis]
+
+    assert (ult.shape[1] == num_scanlines and ult.shape[2] == size_scanline)
+
+    cache_dir = geometry_cache_dir or GEOMETRY_CACHE_DIR
+
+    if method == "sparse":
+        return transform_ultrasound_sparse(ult, order=spline_interpolation_order, background_colour=background_colour,
+                                           num_scanlines=num_scanlines, size_scanline=size_scanline, angle=angle,
+                                           zero_offset=zero_offset, pixels_per_mm=pixels_per_mm, cache_dir=cache_dir,
+                                           dtype=dtype, out=out, workers=workers, block_size=block_size or 16)
+
+    elif method != "map_coordinates":
+        raise ValueError("Unknown transform method: " + str(method))
 
-        transformed_ult[0] = ndimage.map_coordinates(ult, coordinates_in_input, order=spline_interpolation_order,
-                                                     cval=background_colour).transpose()
+    output_shape, coordinates_in_input = get_scan_conversion_geometry(
+        num_scanlines=num_scanlines, size_scanline=size_scanline, angle=angle, zero_offset=zero_offset,
+        pixels_per_mm=pixels_per_mm, cache_dir=cache_dir)
 
-    elif len(ult.shape) == 3:
+    transformed_ult = get_output_array(ult.shape[0], output_shape, dtype=dtype, out=out)
 
-        assert (ult.shape[1] == num_scanlines and ult.shape[2] == size_scanline)
+    def transform_block(ult_block, out_block):
+        for i, frame in enumerate(ult_block):
+            store_frames(out_block[i], ndimage.map_coordinates(frame, coordinates_in_input,
+                                                               order=spline_interpolation_order,
+                                                               cval=background_colour).transpose())
+
+    return apply_blockwise(transform_block, ult, transformed_ult, block_size=block_size or 64, workers=workers)
+
+
+def transform_ultrasound_sparse(ult, order=1, background_colour=255, num_scanlines=63, size_scanline=412, angle=0.038,
+                                zero_offset=50, pixels_per_mm=1, cache_dir=None, block_size=16, dtype=np.float64,
+                                out=None, workers=1):
+    """
+    Transform a sequence of ultrasound frames with a sparse matrix product per block of frames.
+    See get_scan_conversion_matrix.
+
+    :param ult: 3d ultrasound
+    :param order: 0 (nearest) or 1 (linear)
+    :param background_colour:
+    :param num_scanlines:
+    :param size_scanline:
+    :param angle:
+    :param zero_offset:
+    :param pixels_per_mm:
+    :param cache_dir:
+    :param block_size: the number of frames transformed at once
+    :param dtype: the type of the output. Ignored if out is given.
+    :param out: an optional preallocated output array
+    :param workers: the number of threads transforming blocks in parallel
+    :return: 3 dimensional transformed ultrasound
+    """
+    output_shape, matrix, outside = get_scan_conversion_matrix(
+        num_scanlines=num_scanlines, size_scanline=size_scanline, angle=angle, zero_offset=zero_offset,
+        pixels_per_mm=pixels_per_mm, order=order, cache_dir=cache_dir)
 
-        transformed_ult = np.zeros((ult.shape[0], output_shape[0], output_shape[1]))
+    transformed_ult = get_output_array(ult.shape[0], output_shape, dtype=dtype, out=out)
 
-        for i, frame in enumerate(ult):
-            transformed_ult[i] = ndimage.map_coordinates(frame, coordinates_in_input, order=spline_interpolation_order,
-                                                         cval=background_colour).transpose()
+    def transform_block(ult_block, out_block):
+        block = np.asarray(ult_block, dtype=np.float32).reshape(-1, num_scanlines * size_scanline)
+        result = matrix @ block.T  # (output pixels, frames)
+        result[outside] = background_colour
+        if np.issubdtype(ult.dtype, np.integer):
+            np.rint(result, out=result)  # map_coordinates rounds when the input is an integer type
+        store_frames(out_block, result.T.reshape(-1, output_shape[0], output_shape[1]))
 
-    return transformed_ult
+    return apply_blockwise(transform_block, ult, transformed_ult, block_size=block_size, workers=workers)
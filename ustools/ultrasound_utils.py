@@ -3,12 +3,18 @@ Ultrasound utilities including:
  a function to reshape the ultrasound array into 1D, 2D or 3D
  a function to reduce the frame rate of a sequence of ultrasound frames
  a function to return a segment of ultrasound or audio by start and end times
+ a function to re-sample the frame rate of a sequence of ultrasound frames
+ functions to down-sample or resize all the frames of a sequence of ultrasound frames at once
 
 Date: Mar 2018
 Author: Aciel Eshky
 
 """
+import functools
+
 import numpy as np
+import samplerate
+from skimage.transform import resize
 
 
 def reduce_frame_rate(ult_3d, input_frame_rate=121.5, output_frame_rate=60):
@@ -38,3 +44,111 @@ def reduce_frame_rate(ult_3d, input_frame_rate=121.5, output_frame_rate=60):
     return y, input_frame_rate / skip
 
 
+def resample_frame_rate(ult_3d, ratio, converter_type='linear', block_size=None):
+    """
+    Re-sample the frame rate of a sequence of ultrasound frames by interpolating along the time axis. Every pixel is a
+    channel of a single multi-channel resampler, rather than one resampler call per pixel.
+    :param ult_3d: ultrasound as a 3d numpy array (frames, num_scanlines, size_scanline)
+    :param ratio: output frame rate / input frame rate
+    :param converter_type: a libsamplerate converter, e.g., 'linear' or 'sinc_best'
+    :param block_size: if given, the frames are fed to the resampler in blocks of this many frames, which bounds the
+     temporary memory for long utterances
+    :return: the re-sampled ultrasound, with the same dtype as the input (rounded and clipped for integer types)
+    """
+    frame_shape = ult_3d.shape[1:]
+    num_frames = ult_3d.shape[0]
+    num_channels = int(np.prod(frame_shape))
+
+    if not block_size or block_size >= num_frames:
+        x = np.asarray(ult_3d, dtype=np.float32).reshape(num_frames, num_channels)
+        y = _cast_frames(samplerate.resample(x, ratio, converter_type), ult_3d.dtype)
+    else:
+        # each re-sampled block is cast back straight away, so that only one block is held as floats
+        resampler = samplerate.Resampler(converter_type, channels=num_channels)
+        blocks = []
+        for start in range(0, num_frames, block_size):
+            x = np.asarray(ult_3d[start:start + block_size], dtype=np.float32).reshape(-1, num_channels)
+            blocks.append(_cast_frames(resampler.process(x, ratio, end_of_input=start + block_size >= num_frames),
+                                       ult_3d.dtype))
+        y = np.concatenate(blocks)
+
+    return y.reshape((-1,) + frame_shape)
+
+
+def _cast_frames(y, dtype):
+    """
+    Round and clip to an integer type, or cast to a floating point type.
+    """
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        y = np.clip(np.rint(y), info.min, info.max)
+    return y.astype(dtype, copy=False)
+
+
+def block_reduce_frames(ult_3d, ratio=(1, 3), func=np.mean, dtype=None, frames_per_block=256):
+    """
+    Down-sample every frame by applying a function to blocks of pixels, like skimage.measure.block_reduce applied to
+    each frame (frames are padded with zeros to a multiple of the ratio), but for all the frames at once with a single
+    reshape and reduction.
+    :param ult_3d: ultrasound as a 3d numpy array (frames, num_scanlines, size_scanline). Can be a memmap.
+    :param ratio: the block size, e.g., (1, 3)
+    :param func: a reduction which accepts an axis argument, e.g., np.mean, np.max or np.median
+    :param dtype: the output type. Defaults to the input type for integer inputs, with rounding, and float32 otherwise.
+    :param frames_per_block: the number of frames reduced at once, which bounds the temporary memory
+    :return: 3d numpy array
+    """
+    if dtype is None:
+        dtype = ult_3d.dtype if np.issubdtype(ult_3d.dtype, np.integer) else np.float32
+
+    num_frames, height, width = ult_3d.shape
+    out_height = -(-height // ratio[0])
+    out_width = -(-width // ratio[1])
+
+    reduced = np.empty((num_frames, out_height, out_width), dtype=dtype)
+
+    for start in range(0, num_frames, frames_per_block):
+        block = np.asarray(ult_3d[start:start + frames_per_block])
+        pad = ((0, 0), (0, out_height * ratio[0] - height), (0, out_width * ratio[1] - width))
+        if any(p[1] for p in pad):
+            block = np.pad(block, pad, mode='constant', constant_values=0)
+        block = block.reshape(-1, out_height, ratio[0], out_width, ratio[1])
+        reduced[start:start + frames_per_block] = _cast_frames(func(block, axis=(2, 4)), dtype)
+
+    return reduced
+
+
+@functools.lru_cache(maxsize=16)
+def get_resize_index_map(input_shape, output_shape):
+    """
+    The index of the input pixel each output pixel takes in a nearest neighbour resize, found by resizing an image of
+    pixel indices with skimage, so that it matches skimage.transform.resize(order=0, mode='reflect') exactly.
+    :param input_shape: (num_scanlines, size_scanline)
+    :param output_shape:
+    :return: flat int64 indices into a flattened input frame
+    """
+    indices = np.arange(input_shape[0] * input_shape[1], dtype=np.float64).reshape(input_shape)
+    index_map = resize(indices, output_shape=output_shape, order=0, mode='reflect', clip=False, preserve_range=True,
+                       anti_aliasing=False)
+    index_map = np.rint(index_map).astype(np.int64).ravel()
+    index_map.flags.writeable = False
+    return index_map
+
+
+def resize_frames(ult_3d, output_shape=(63, 138), frames_per_block=256):
+    """
+    Resize every frame with nearest neighbour interpolation, as a single gather with a precomputed index map.
+    :param ult_3d: ultrasound as a 3d numpy array (frames, num_scanlines, size_scanline). Can be a memmap.
+    :param output_shape: the frame size, e.g., (63, 138)
+    :param frames_per_block: the number of frames gathered at once when reading from a memmap
+    :return: 3d numpy array with the same dtype as the input
+    """
+    num_frames = ult_3d.shape[0]
+    index_map = get_resize_index_map(tuple(ult_3d.shape[1:]), tuple(output_shape))
+
+    resized = np.empty((num_frames,) + tuple(output_shape), dtype=ult_3d.dtype)
+
+    for start in range(0, num_frames, frames_per_block):
+        block = np.asarray(ult_3d[start:start + frames_per_block]).reshape(-1, ult_3d.shape[1] * ult_3d.shape[2])
+        resized[start:start + frames_per_block] = block[:, index_map].reshape((-1,) + tuple(output_shape))
+
+    return resized
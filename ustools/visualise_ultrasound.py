@@ -8,9 +8,11 @@ Author: Aciel Eshky
 
 import matplotlib.pyplot as plt
 
+from ustools.frame_renderer import FrameRenderer, write_png
+
 
 def display_2d_ultrasound_frame(ult_frame, dpi=72, figsize=(5, 5), aspect="equal", interpolation=None,
-                                title="", output_file=None):
+                                title="", output_file=None, show=True):
     """
     A function to plot a single ultrasound frame (either raw or transformed).
 
@@ -21,8 +23,16 @@ def display_2d_ultrasound_frame(ult_frame, dpi=72, figsize=(5, 5), aspect="equal
     :param interpolation:
     :param title:
     :param output_file:
+    :param show: if False, the frame is not displayed, only saved to output_file as a PNG with the fast renderer
+     (see save_ultrasound_thumbnail), without drawing a figure
     :return:
     """
+    if not show:
+        if output_file:
+            width, height = figsize or (5, 5)
+            save_ultrasound_thumbnail(ult_frame, output_file, size=(int(width * (dpi or 72)), int(height * (dpi or 72))),
+                                      aspect=aspect, title=title)
+        return
 
     plt.figure(figsize=figsize, dpi=dpi)
     plt.title(title)
@@ -32,3 +42,25 @@ def display_2d_ultrasound_frame(ult_frame, dpi=72, figsize=(5, 5), aspect="equal
         plt.savefig(output_file)
 
     plt.show()
+
+
+def save_ultrasound_thumbnail(ult_frame, output_file, size=(128, 128), aspect="equal", title=None, cmap="gray",
+                              vmin=None, vmax=None, background_colour=255):
+    """
+    Save an ultrasound frame (either raw or transformed) as a PNG image, oriented as display_2d_ultrasound_frame shows
+    it.
+
+    :param ult_frame: the ultrasound frame
+    :param output_file: a .png file
+    :param size: (width, height) in pixels
+    :param aspect:
+    :param title: an optional caption
+    :param cmap:
+    :param vmin: defaults to the minimum of the frame, as in imshow
+    :param vmax: defaults to the maximum of the frame, as in imshow
+    :param background_colour: black = 0 and white = 255
+    :return:
+    """
+    renderer = FrameRenderer(ult_frame.shape, size=size, aspect=aspect, cmap=cmap, vmin=vmin, vmax=vmax, title=title,
+                             background_colour=background_colour)
+    write_png(output_file, renderer.render(ult_frame))
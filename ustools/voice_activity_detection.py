@@ -5,22 +5,131 @@ Author: Aciel Eshky
 
 """
 
-import os
-import subprocess
-import struct
+from math import gcd
+
 import webrtcvad
-from scipy.io import wavfile
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy.signal import resample_poly
+
+from ustools.intervals import IntervalSet
+from ustools.segment_signal import get_runs
+
+
+class VoiceActivity:
+
+    def __init__(self, is_speech, samples_per_window, sample_rate):
+        """
+        The result of voice activity detection: one boolean per window of samples_per_window samples at sample_rate.
+        Window i covers the samples [i * samples_per_window, (i + 1) * samples_per_window) at the VAD sample rate.
+
+        :param is_speech: boolean numpy array, one value per window
+        :param samples_per_window:
+        :param sample_rate: the sample rate at which VAD was run, e.g., 16000
+        """
+        self.is_speech = np.asarray(is_speech, dtype=bool)
+        self.samples_per_window = samples_per_window
+        self.sample_rate = sample_rate
+
+    def __len__(self):
+        return len(self.is_speech)
+
+    @property
+    def window_duration(self):
+        return self.samples_per_window / self.sample_rate
+
+    def get_runs(self, is_speech=True):
+        """
+        Merge adjacent windows with the same label into runs.
+
+        :param is_speech: get the runs of speech, or of non-speech
+        :return: two numpy arrays containing the first window and the last window + 1 of each run
+        """
+        starts, ends = get_runs(self.is_speech, value=is_speech)
+        return starts, ends + 1
+
+    def smooth(self, hangover=0, min_gap=0):
+        """
+        Smooth the decisions: extend each speech run by a number of windows, and fill short gaps between speech runs.
+
+        :param hangover: the number of windows labelled speech after each speech run
+        :param min_gap: non-speech runs between two speech runs shorter than this many windows become speech
+        :return: a new VoiceActivity object
+        """
+        starts, stops = self.get_runs(is_speech=True)
+        speech = IntervalSet(starts, np.minimum(stops + hangover, len(self)))
+
+        if min_gap > 0 and len(speech) > 1:
+            gaps = IntervalSet(speech.stops[:-1], speech.starts[1:])
+            short = gaps.stops - gaps.starts < min_gap
+            speech = speech.union(IntervalSet(gaps.starts[short], gaps.stops[short]))
+
+        return VoiceActivity(speech.to_mask(len(self)), self.samples_per_window, self.sample_rate)
+
+    def to_intervals(self, sample_rate, is_speech=True):
+        """
+        The samples covered by the speech (or non-speech) runs at another sample rate, e.g., the wav or ult frame rate.
+        The boundaries are computed exactly as separate_silence_and_speech does for the time segments.
+
+        :param sample_rate:
+        :param is_speech:
+        :return: an IntervalSet
+        """
+        starts, stops = self.get_runs(is_speech=is_speech)
+        return IntervalSet((starts * self.samples_per_window / self.sample_rate * sample_rate).astype(np.int64),
+                           (stops * self.samples_per_window / self.sample_rate * sample_rate).astype(np.int64))
+
+    def to_mask(self, sample_rate, length, is_speech=True):
+        """
+        A per-sample (or per-frame) mask at another sample rate.
+
+        :param sample_rate: e.g., the wav sample rate or the ult frame rate
+        :param length: the number of samples (or frames) in the signal
+        :param is_speech: if True, the mask is True for speech, otherwise for non-speech
+        :return: boolean numpy array
+        """
+        return self.to_intervals(sample_rate, is_speech=is_speech).to_mask(length)
+
+    def to_time_segments(self):
+        """
+        Convert to the list of dictionaries returned by detect_voice_activity.
+
+        :return:
+        """
+        starts = np.arange(len(self)) * self.samples_per_window
+        return [dict(start=start, stop=stop, is_speech=is_speech) for start, stop, is_speech in
+                zip((starts / self.sample_rate).tolist(),
+                    ((starts + self.samples_per_window) / self.sample_rate).tolist(),
+                    self.is_speech.tolist())]
+
+
+def resample_to_int16(wav, sample_rate, new_sample_rate):
+    """
+    Resample a wav signal with a polyphase filter and convert it to 16 bit integers.
 
-
-def detect_voice_activity(wav, sample_rate,
-                          vad_wav_sample_rate=16000, aggressiveness=2, window_duration=0.03, bytes_per_sample=2):
+    :param wav: numpy array containing a wav signal. Floating point signals are assumed to be in the range [-1, 1].
+    :param sample_rate: sample rate of the signal
+    :param new_sample_rate:
+    :return: a contiguous int16 numpy array
     """
-    Run voice activity detection on a given wav signal and return time segements of size "window_duration" with
-    a boolean indicating whether or not the segment is speech.
+    wav = np.asarray(wav)
 
-    Code adapted from a Kaggle tutorial: https://www.kaggle.com/holzner/voice-activity-detection-example/notebook
+    if np.issubdtype(wav.dtype, np.floating):
+        wav = wav * 32767
+
+    if sample_rate != new_sample_rate:
+        divisor = gcd(int(sample_rate), int(new_sample_rate))
+        wav = resample_poly(wav.astype(np.float64), int(new_sample_rate) // divisor, int(sample_rate) // divisor)
+
+    if wav.dtype != np.int16:
+        wav = np.clip(np.rint(wav), -32768, 32767).astype(np.int16)
+
+    return np.ascontiguousarray(wav)
+
+
+def get_voice_activity(wav, sample_rate, vad_wav_sample_rate=16000, aggressiveness=2, window_duration=0.03):
+    """
+    Run voice activity detection on a given wav signal.
 
     :param wav: numpy array containing a wav signal
 
@@ -33,53 +142,56 @@ def detect_voice_activity(wav, sample_rate,
 
     :param window_duration: in seconds. A frame must be either 0.01, 0.02, or 0.03 s in duration.
 
-    :param bytes_per_sample:
-
-    :return:
+    :return: a VoiceActivity object
     """
 
     # VAD operates on a frame rate of 16000
-    # so first I down-sample the wav form using ffmpeg while writing to disl
-    # ffmpeg is the most reliable way I found of doing this.
+    # so first I down-sample the wav form in memory with a polyphase filter.
 
-    # 1) Down-sample wav:
+    samples = resample_to_int16(wav, sample_rate, vad_wav_sample_rate)
 
-    temp_wav = "temp_wav.wav"
-    temp_downsampled_wav = "temp_downsampled_wav.wav"
+    vad = webrtcvad.Vad(aggressiveness)  # set aggressiveness from 0 to 3 (low to high filtering of non-speech).
 
-    wavfile.write(filename=temp_wav, rate=sample_rate, data=wav)
-    subprocess.call(["ffmpeg", "-loglevel", "panic", "-i", temp_wav, "-ar", str(vad_wav_sample_rate), temp_downsampled_wav])
-    new_sample_rate, samples = wavfile.read(filename=temp_downsampled_wav)
+    raw_samples = memoryview(samples).cast('B')  # slices of a memoryview are not copied
+    samples_per_window = int(window_duration * vad_wav_sample_rate + 0.5)
+    bytes_per_window = samples_per_window * samples.itemsize
 
-    assert new_sample_rate == vad_wav_sample_rate
+    # only complete windows are used, and never the one ending on the last sample
+    num_windows = max(-(-(len(samples) - samples_per_window) // samples_per_window), 0)
 
-    # remove temp wav files
-    os.remove(temp_wav)
-    os.remove(temp_downsampled_wav)
+    is_speech = np.zeros(num_windows, dtype=bool)
+    for i in range(num_windows):
+        is_speech[i] = vad.is_speech(raw_samples[i * bytes_per_window:(i + 1) * bytes_per_window],
+                                     sample_rate=vad_wav_sample_rate)
 
-    # 2) set up VAD:
+    return VoiceActivity(is_speech, samples_per_window, vad_wav_sample_rate)
 
-    vad = webrtcvad.Vad(aggressiveness)  # set aggressiveness from 0 to 3 (low to high filtering of non-speech).
 
-    raw_samples = struct.pack("%dh" % len(samples), *samples)
-    samples_per_window = int(window_duration * new_sample_rate + 0.5)
+def detect_voice_activity(wav, sample_rate,
+                          vad_wav_sample_rate=16000, aggressiveness=2, window_duration=0.03, bytes_per_sample=2):
+    """
+    Run voice activity detection on a given wav signal and return time segements of size "window_duration" with
+    a boolean indicating whether or not the segment is speech. See get_voice_activity for a compact result.
+
+    Code adapted from a Kaggle tutorial: https://www.kaggle.com/holzner/voice-activity-detection-example/notebook
 
-    # 3) run VAD:
+    :param wav: numpy array containing a wav signal
 
-    time_segments = []
+    :param sample_rate: sample rate of the signal
 
-    for start in np.arange(0, len(samples) - samples_per_window, samples_per_window):
-        stop = min(start + samples_per_window, len(samples))
+    :param vad_wav_sample_rate: must be 8000, 16000, 32000 or 48000 Hz
 
-        is_speech = vad.is_speech(raw_samples[start * bytes_per_sample: stop * bytes_per_sample],
-                                  sample_rate=new_sample_rate)
+    :param aggressiveness: an integer between 0 and 3. 0 is the least aggressive when filtering out non-speech,
+            3 is the most aggressive.
 
-        time_segments.append(dict(
-            start=start / new_sample_rate,
-            stop=stop / new_sample_rate,
-            is_speech=is_speech))
+    :param window_duration: in seconds. A frame must be either 0.01, 0.02, or 0.03 s in duration.
 
-    return time_segments
+    :param bytes_per_sample: unused, the VAD always runs on 16 bit samples
+
+    :return:
+    """
+    return get_voice_activity(wav, sample_rate, vad_wav_sample_rate=vad_wav_sample_rate,
+                              aggressiveness=aggressiveness, window_duration=window_duration).to_time_segments()
 
 
 def visualise_voice_activity_detection(wav, sample_rate, time_segments):
@@ -88,7 +200,7 @@ def visualise_voice_activity_detection(wav, sample_rate, time_segments):
     
     :param wav: 
     :param sample_rate: 
-    :param time_segments: 
+    :param time_segments: the time segments or a VoiceActivity object
     :return: 
     """
 
@@ -97,17 +209,31 @@ def visualise_voice_activity_detection(wav, sample_rate, time_segments):
 
     y_max = max(wav)
 
-    # plot segment identifed as speech
-    for segment in time_segments:
-        if segment['is_speech']:
-            start = segment['start'] * sample_rate
-            stop = segment['stop'] * sample_rate
-            plt.plot([start, stop - 1], [y_max * 1.1, y_max * 1.1], color='orange')
+    # plot runs identifed as speech
+    for start, stop in get_segment_intervals(time_segments, sample_rate, is_speech=True):
+        plt.plot([start, stop - 1], [y_max * 1.1, y_max * 1.1], color='orange')
 
     plt.xlabel('sample')
     plt.grid()
 
 
+def get_segment_intervals(time_segments, sample_rate, is_speech=True):
+    """
+    The samples covered by the speech (or non-speech) segments produced by the VAD function, at a given sample rate.
+
+    :param time_segments: output of the VAD function "detection_voice_activity", or a VoiceActivity object
+    :param sample_rate: the sample rate of the signal the intervals apply to
+    :param is_speech: if True get the speech segments, otherwise the non-speech segments
+    :return: an IntervalSet
+    """
+    if isinstance(time_segments, VoiceActivity):
+        return time_segments.to_intervals(sample_rate, is_speech=is_speech)
+
+    starts = [int(segment['start'] * sample_rate) for segment in time_segments if segment['is_speech'] == is_speech]
+    stops = [int(segment['stop'] * sample_rate) for segment in time_segments if segment['is_speech'] == is_speech]
+    return IntervalSet(starts, stops)
+
+
 def separate_silence_and_speech(signal, sample_rate, time_segments):
     """
     This can be applied to wav files and ultrasound files to separate silence and speech in a signal
@@ -115,21 +241,15 @@ def separate_silence_and_speech(signal, sample_rate, time_segments):
 
     :param signal:
     :param sample_rate:
-    :param time_segments: output of the VAD function "detection_voice_activity"
+    :param time_segments: output of the VAD function "detection_voice_activity", or a VoiceActivity object
     :return: two numpy arrays: "silence" and "speech"
     """
+    speech_intervals = get_segment_intervals(time_segments, sample_rate, is_speech=True)
+    silence_intervals = get_segment_intervals(time_segments, sample_rate, is_speech=False)
 
-    silence = signal
-    speech = signal
-
-    for segment in reversed(time_segments):
-
-        start = int(segment['start'] * sample_rate)
-        stop = int(segment['stop'] * sample_rate)
-
-        if segment['is_speech']:
-            silence = np.delete(silence, np.s_[start:stop], axis=0)
-        else:
-            speech = np.delete(speech, np.s_[start:stop], axis=0)
+    # the silence is everything except the speech segments and vice versa, so that samples beyond the last segment
+    # are in both
+    silence = speech_intervals.complement(len(signal)).apply(signal)
+    speech = silence_intervals.complement(len(signal)).apply(signal)
 
     return silence, speech